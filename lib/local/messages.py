@@ -0,0 +1,79 @@
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+
+
+#####################################################################################################
+#
+# messageBox
+#
+# Classical messages received by a local node, keyed by the round of the protocol they belong to and the node
+# that sent them. Remote methods of the local node deliver messages, and the protocol waits for them.
+#
+class messageBox(object):
+    def __init__(self):
+        """
+        Initialize an empty message box.
+        """
+
+        # Messages delivered but not yet asked for, and deferreds asking for messages not yet delivered,
+        # both in the order they came in for each (round_id, sender)
+        self._messages = {}
+        self._waiters = {}
+
+    def deliver(self, sender, content, round_id=0):
+        """
+        Delivers a message, handing it to the first one waiting for it if any.
+
+        Arguments
+        sender		name of the node which sent the message
+        content		content of the message
+        round_id	round of the protocol the message belongs to
+        """
+
+        key = (round_id, sender)
+        waiters = self._waiters.get(key)
+        if waiters:
+            d = waiters.popleft()
+            if not waiters:
+                del self._waiters[key]
+            d.callback(content)
+        else:
+            self._messages.setdefault(key, deque()).append(content)
+
+    def expect(self, sender, round_id=0, timeout=None):
+        """
+        Returns a deferred firing with the next message of the sender in the round, as soon as it is delivered.
+
+        Arguments
+        sender		name of the node to expect the message from
+        round_id	round of the protocol the message belongs to
+        timeout		seconds to wait at most before the deferred fails with a TimeoutError, None to wait forever
+        """
+
+        key = (round_id, sender)
+        messages = self._messages.get(key)
+        if messages:
+            content = messages.popleft()
+            if not messages:
+                del self._messages[key]
+            return succeed(content)
+
+        d = Deferred(canceller=self._forget)
+        d.key = key
+        self._waiters.setdefault(key, deque()).append(d)
+        if timeout is not None:
+            d.addTimeout(timeout, reactor)
+        return d
+
+    def _forget(self, d):
+        """
+        Stops a deferred from waiting for its message, once it is cancelled or timed out.
+        """
+
+        waiters = self._waiters.get(d.key)
+        if waiters and d in waiters:
+            waiters.remove(d)
+            if not waiters:
+                del self._waiters[d.key]
@@ -28,6 +28,7 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import abc
+import numpy as np
 from twisted.spread import pb
 
 
@@ -85,6 +86,30 @@ class quantumEngine(pb.Referenceable):
         """
         pass
 
+    def add_fresh_qubits(self, n):
+        """
+        Add n new qubits initialized in the \|0\> state.
+        :return: The qubit numbers
+        :rtype: list of int
+        """
+        # Check if we are still allowed to add qubits
+        if self.activeQubits + n > self.maxQubits:
+            raise noQubitError("No more qubits available in register.")
+
+        return [self.add_fresh_qubit() for _ in range(n)]
+
+    def add_epr_pair(self):
+        """
+        Add two new qubits in the Bell state (\|00\> + \|11\>)/sqrt(2).
+        :return: The qubit numbers
+        :rtype: tuple of int
+        """
+        num1, num2 = self.add_fresh_qubits(2)
+        self.apply_H(num1)
+        self.apply_CNOT(num1, num2)
+
+        return num1, num2
+
     @abc.abstractmethod
     def add_qubit(self, newQubit):
         """
@@ -102,6 +127,15 @@ class quantumEngine(pb.Referenceable):
         """
         pass
 
+    def remove_qubits(self, qubitNums):
+        """
+        Removes the qubits with the desired numbers qubitNums
+        :rtype: None
+        """
+        # Remove from the back so that the remaining numbers stay valid
+        for qubitNum in sorted(qubitNums, reverse=True):
+            self.remove_qubit(qubitNum)
+
     @abc.abstractmethod
     def get_register_RI(self):
         """
@@ -112,6 +146,14 @@ class quantumEngine(pb.Referenceable):
         """
         pass
 
+    def get_register_arrays(self):
+        """
+        Retrieves the entire register in real and imaginary parts as numpy arrays, for handing it over without
+        converting it to lists. The imaginary part may be None.
+        """
+        R, I = self.get_register_RI()
+        return np.asarray(R), None if I is None else np.asarray(I)
+
     @abc.abstractmethod
     def apply_H(self, qubitNum):
         """
@@ -225,6 +267,15 @@ class quantumEngine(pb.Referenceable):
         """
         pass
 
+    def apply_circuit(self, circuit, qubitNums):
+        """
+        Applies the circuit to the qubits with numbers qubitNums. The circuit is a tuple of gates (name, i, ...),
+        where name selects the apply_<name> method and i, ... are positions in qubitNums.
+        :rtype: None
+        """
+        for gate in circuit:
+            getattr(self, "apply_" + gate[0])(*[qubitNums[i] for i in gate[1:]])
+
     @abc.abstractmethod
     def measure_qubit_inplace(self, qubitNum):
         """
@@ -233,11 +284,76 @@ class quantumEngine(pb.Referenceable):
 
         Arguments:
         qubitNum	qubit to be measured
-        :return: The meaurement outcome
+        :return: The measurement outcome
         :rtype: int
         """
         pass
 
+    def measure_bell_inplace(self, qubitNum1, qubitNum2):
+        """
+        Measures the two qubits in the Bell basis. This returns the classical outcomes (x, y), where the state
+        (\|0,y\> + (-1)^x \|1,1-y\>)/sqrt(2) gives (x, y). The two qubits are left in the state \|x,y\>.
+
+        Arguments:
+        qubitNum1	first qubit to be measured
+        qubitNum2	second qubit to be measured
+        :return: The measurement outcomes
+        :rtype: tuple of int
+        """
+        self.apply_CNOT(qubitNum1, qubitNum2)
+        self.apply_H(qubitNum1)
+        x = self.measure_qubit_inplace(qubitNum1)
+        y = self.measure_qubit_inplace(qubitNum2)
+
+        return x, y
+
+    def measure_pauli(self, pauli, qubitNums):
+        """
+        Measures the Pauli operator given as a string such as "XZZXI" on the qubits qubitNums, without extra qubits.
+        The operator is rotated onto Z on a single qubit with Clifford gates, which are undone after the measurement.
+
+        Arguments:
+        pauli		Pauli operator, one letter per qubit in qubitNums
+        qubitNums	qubits the operator acts on
+        :return: The measurement outcome, 0 for eigenvalue +1 and 1 for eigenvalue -1
+        :rtype: int
+        """
+        support = [(p, qubitNum) for p, qubitNum in zip(pauli, qubitNums) if p != "I"]
+        if not support:
+            return 0
+        target = support[0][1]
+
+        # Map X and Y to Z, H and K are their own inverses
+        basisChange = {"X": self.apply_H, "Y": self.apply_K}
+        for p, qubitNum in support:
+            if p in basisChange:
+                basisChange[p](qubitNum)
+        for p, qubitNum in support[1:]:
+            self.apply_CNOT(qubitNum, target)
+
+        outcome = self.measure_qubit_inplace(target)
+
+        for p, qubitNum in reversed(support[1:]):
+            self.apply_CNOT(qubitNum, target)
+        for p, qubitNum in support:
+            if p in basisChange:
+                basisChange[p](qubitNum)
+
+        return outcome
+
+    def measure_paulis(self, paulis, qubitNums):
+        """
+        Measures the commuting Pauli operators paulis one after the other on the qubits qubitNums, as for syndrome
+        extraction. Engines override this to measure them in one pass over their state.
+
+        Arguments:
+        paulis		Pauli operators, one letter per qubit in qubitNums each
+        qubitNums	qubits the operators act on
+        :return: The measurement outcomes, 0 for eigenvalue +1 and 1 for eigenvalue -1
+        :rtype: list of int
+        """
+        return [self.measure_pauli(pauli, qubitNums) for pauli in paulis]
+
     @abc.abstractmethod
     def measure_qubit(self, qubitNum):
         """
@@ -245,7 +361,7 @@ class quantumEngine(pb.Referenceable):
 
         Arguments:
         qubitNum	qubit to be measured
-        :return: The meaurement outcome
+        :return: The measurement outcome
         :rtype: int
         """
         pass
@@ -278,3 +394,84 @@ class quantumEngine(pb.Referenceable):
         :rtype: None
         """
         pass
+
+    def absorb_arrays(self, R, I, activeQ):
+        """
+        Absorb the qubits, given in pieces as numpy arrays as returned by get_register_arrays. The arrays may only
+        be valid during the call, so they must not be kept.
+        """
+        self.absorb_parts(R.tolist(), None if I is None else I.tolist(), activeQ)
+
+    def correlated_with(self, qubitNums):
+        """
+        Returns the other qubits which may be correlated with the qubits qubitNums. Only these can come apart from the
+        rest of the register once qubitNums are removed. The default is all other qubits.
+
+        Arguments:
+        qubitNums	qubits to be removed
+        :rtype: list of int
+        """
+        return [j for j in range(self.activeQubits) if j not in qubitNums]
+
+    def find_factors(self, candidates=None):
+        """
+        Looks for parts of the register that are in a tensor product with the rest, such that they can be simulated
+        in separate registers. Engines that cannot detect this cheaply keep the register as a single part.
+
+        Arguments:
+        candidates	if given, only these qubits are looked at for parts of their own, the others stay together
+        :return: Partition of the qubit numbers
+        :rtype: list of list of int
+        """
+        return [list(range(self.activeQubits))]
+
+    def split_off(self, qubitNums, other):
+        """
+        Moves the qubits qubitNums, which must be in a tensor product with the rest of the register, to the end
+        of the register other of the same engine. The qubits keep their order. The default copies the whole
+        register into other and removes from each register the qubits the other one keeps, which leaves the
+        right state since the two parts are in a tensor product.
+
+        Arguments:
+        qubitNums	qubits to move, in increasing order
+        other		register to move them to
+        :rtype: None
+        """
+        n = self.activeQubits
+        keepList = [j for j in range(n) if j not in qubitNums]
+        if not keepList:
+            raise quantumError("Cannot split off all qubits of the register.")
+        if other.activeQubits + n > other.maxQubits:
+            raise quantumError("Cannot split: qubits exceed the maximum available.")
+
+        start = other.activeQubits
+        R, I = self.get_register_RI()
+        other.absorb_parts(R, I, n)
+        other.remove_qubits([start + j for j in keepList])
+        self.remove_qubits(qubitNums)
+
+    def permute_qubits(self, order):
+        """
+        Reorders the qubits of the register, such that qubit order[i] becomes qubit i. The default uses swaps made
+        of CNOTs.
+
+        Arguments:
+        order		list of all qubit numbers in their new order
+        :rtype: None
+        """
+        current = list(range(self.activeQubits))
+        for i, qubitNum in enumerate(order):
+            j = current.index(qubitNum)
+            if j != i:
+                self.apply_CNOT(i, j)
+                self.apply_CNOT(j, i)
+                self.apply_CNOT(i, j)
+                current[i], current[j] = current[j], current[i]
+
+    def reset(self):
+        """
+        Removes all qubits, leaving an empty register whose engine can be reused for a new register.
+        :rtype: None
+        """
+        if self.activeQubits > 0:
+            self.remove_qubits(list(range(self.activeQubits)))
@@ -0,0 +1,483 @@
+"""
+Register made of independent factors, each simulated by its own engine.
+
+New qubits start in a factor of their own. Factors are only joined when a gate or measurement acts on qubits in
+different factors, and the state of the whole register is only formed when it is exported. Qubits left in a product
+state by a measurement are split off into a factor of their own again.
+"""
+
+from simulaqron.virtNode.basics import quantumEngine, quantumError, noQubitError
+
+
+class _factor(object):
+    """
+    Factor of the register: an engine together with the qubit numbers in the register of its qubits, in the order
+    of the engine.
+    """
+
+    def __init__(self, engine, qubitNums):
+        self.engine = engine
+        self.qubitNums = qubitNums
+
+
+class factoredEngine(quantumEngine):
+    """
+    Quantum engine keeping a register as a tensor product of independent factors, each simulated by an engine of the
+    class engineClass.
+
+    Attributes:
+        maxQubits:	maximum number of qubits this engine will support.
+        engineClass:	engine class used to simulate the factors
+    """
+
+    # Have the node keep parts of the register apart here, rather than in registers of their own
+    factored = True
+
+    def __init__(self, node, num, maxQubits=10, engineClass=None):
+        """
+        Initialize the engine. If no number is given for maxQubits, the assumption will be 10.
+        """
+
+        super().__init__(node=node, num=num, maxQubits=maxQubits)
+
+        if engineClass is None:
+            raise quantumError("A factored register needs an engine class to simulate the factors.")
+        self.engineClass = engineClass
+
+        # We start with no factors
+        self.factors = []
+
+    @property
+    def activeQubits(self):
+        return sum(len(f.qubitNums) for f in self.factors)
+
+    def _new_factor(self, n):
+        """
+        Returns a new empty factor that can hold n qubits.
+        """
+        return _factor(self.engineClass(self.simNode, self.num, max(n, 1)), [])
+
+    def _locate(self, qubitNum):
+        """
+        Returns the factor holding the qubit and its number in the engine of the factor.
+        """
+        for f in self.factors:
+            if qubitNum in f.qubitNums:
+                return f, f.qubitNums.index(qubitNum)
+        raise quantumError("No such qubit {} in register.".format(qubitNum))
+
+    def _join(self, qubitNums):
+        """
+        Joins the factors holding the qubits into one and returns it, together with the numbers of the qubits in its
+        engine.
+        """
+        joined = None
+        for qubitNum in qubitNums:
+            f, _ = self._locate(qubitNum)
+            if joined is None:
+                joined = f
+            elif f is not joined:
+                joined.engine.maxQubits = max(joined.engine.maxQubits, len(joined.qubitNums) + len(f.qubitNums))
+                joined.engine.absorb(f.engine)
+                joined.qubitNums = joined.qubitNums + f.qubitNums
+                self.factors.remove(f)
+        return joined, [joined.qubitNums.index(qubitNum) for qubitNum in qubitNums]
+
+    def _add_factor(self, f):
+        """
+        Adds the factor, whose qubits get the next numbers in the register. Returns their numbers.
+        """
+        n = self.activeQubits
+        if n + f.engine.activeQubits > self.maxQubits:
+            raise noQubitError("No more qubits available in register.")
+
+        f.qubitNums = list(range(n, n + f.engine.activeQubits))
+        if f.qubitNums:
+            self.factors.append(f)
+        return f.qubitNums
+
+    def _drop(self, qubitNums):
+        """
+        Renumbers the qubits after the qubits qubitNums have been taken out of the factors.
+        """
+        for f in self.factors:
+            f.qubitNums = [j - len([k for k in qubitNums if k < j]) for j in f.qubitNums]
+        self.factors = [f for f in self.factors if f.qubitNums]
+
+    def _export(self, factors):
+        """
+        Returns an engine holding the state of the given factors, with their qubits in increasing order of their
+        numbers in the register. The factors themselves are left as they are.
+        """
+        qubitNums = [j for f in factors for j in f.qubitNums]
+        engine = self.engineClass(self.simNode, self.num, max(len(qubitNums), 1))
+        for f in factors:
+            engine.absorb(f.engine)
+
+        # Qubit order[i] of the product becomes qubit i
+        order = sorted(range(len(qubitNums)), key=lambda i: qubitNums[i])
+        engine.permute_qubits(order)
+        return engine, sorted(qubitNums)
+
+    def add_fresh_qubit(self):
+        """
+        Add a new qubit initialized in the \|0\> state, in a factor of its own.
+        """
+        f = self._new_factor(1)
+        f.engine.add_fresh_qubit()
+        return self._add_factor(f)[0]
+
+    def add_fresh_qubits(self, n):
+        """
+        Add n new qubits initialized in the \|0\> state, each in a factor of its own.
+        """
+        if self.activeQubits + n > self.maxQubits:
+            raise noQubitError("No more qubits available in register.")
+
+        return [self.add_fresh_qubit() for _ in range(n)]
+
+    def add_epr_pair(self):
+        """
+        Add two new qubits in the Bell state (\|00\> + \|11\>)/sqrt(2), as a factor of their own.
+        """
+        f = self._new_factor(2)
+        f.engine.add_epr_pair()
+        num1, num2 = self._add_factor(f)
+        return num1, num2
+
+    def add_qubit(self, newQubit):
+        """
+        Add new qubit in the state described by newQubit, in a factor of its own.
+        """
+        f = self._new_factor(1)
+        f.engine.add_qubit(newQubit)
+        return self._add_factor(f)[0]
+
+    def remove_qubit(self, qubitNum):
+        """
+        Removes the qubit with the desired number qubitNum
+        """
+        self.remove_qubits([qubitNum])
+
+    def remove_qubits(self, qubitNums):
+        """
+        Removes the qubits with the desired numbers qubitNums, from each factor in one step
+        """
+        located = [self._locate(qubitNum) for qubitNum in qubitNums]
+        for f in self.factors:
+            nums = [i for g, i in located if g is f]
+            if nums and len(nums) < len(f.qubitNums):
+                f.engine.remove_qubits(nums)
+            f.qubitNums = [j for j in f.qubitNums if j not in qubitNums]
+        self._drop(qubitNums)
+
+    def get_register_RI(self):
+        """
+        Retrieves the entire register in real and imaginary parts, forming the state of all factors together.
+        """
+        engine, _ = self._export(self.factors)
+        return engine.get_register_RI()
+
+    def get_register_arrays(self):
+        """
+        Retrieves the entire register in real and imaginary parts as numpy arrays, forming the state of all factors
+        together.
+        """
+        engine, _ = self._export(self.factors)
+        return engine.get_register_arrays()
+
+    def get_qubits_RI(self, qList):
+        """
+        Retrieves the qubits in the list in real and imaginary parts, forming the state of the factors holding them.
+        """
+        factors = []
+        for qubitNum in qList:
+            f, _ = self._locate(qubitNum)
+            if f not in factors:
+                factors.append(f)
+        engine, qubitNums = self._export(factors)
+        return engine.get_qubits_RI([qubitNums.index(qubitNum) for qubitNum in qList])
+
+    def _single(self, name, qubitNum, *args):
+        """
+        Applies the single qubit operation name of the engines to the qubit.
+        """
+        f, i = self._locate(qubitNum)
+        return getattr(f.engine, name)(i, *args)
+
+    def apply_H(self, qubitNum):
+        """
+        Applies a Hadamard gate to the qubits with number qubitNum.
+        """
+        self._single("apply_H", qubitNum)
+
+    def apply_K(self, qubitNum):
+        """
+        Applies a K gate to the qubits with number qubitNum. Maps computational basis to Y eigenbasis.
+        """
+        self._single("apply_K", qubitNum)
+
+    def apply_X(self, qubitNum):
+        """
+        Applies a X gate to the qubits with number qubitNum.
+        """
+        self._single("apply_X", qubitNum)
+
+    def apply_Z(self, qubitNum):
+        """
+        Applies a Z gate to the qubits with number qubitNum.
+        """
+        self._single("apply_Z", qubitNum)
+
+    def apply_Y(self, qubitNum):
+        """
+        Applies a Y gate to the qubits with number qubitNum.
+        """
+        self._single("apply_Y", qubitNum)
+
+    def apply_T(self, qubitNum):
+        """
+        Applies a T gate to the qubits with number qubitNum.
+        """
+        self._single("apply_T", qubitNum)
+
+    def apply_inverse_T(self, qubitNum):
+        """
+        Applies the inverse of the T gate to the qubits with number qubitNum.
+        """
+        self._single("apply_inverse_T", qubitNum)
+
+    def apply_rotation(self, qubitNum, n, a):
+        """
+        Applies a rotation around the axis n with the angle a to qubit with number qubitNum.
+        """
+        self._single("apply_rotation", qubitNum, n, a)
+
+    def apply_onequbit_gate(self, gateU, qubitNum):
+        """
+        Applies a unitary gate to the specified qubit.
+        """
+        f, i = self._locate(qubitNum)
+        f.engine.apply_onequbit_gate(gateU, i)
+
+    def apply_CNOT(self, qubitNum1, qubitNum2):
+        """
+        Applies the CNOT to the qubit with the numbers qubitNum1 and qubitNum2, joining their factors.
+        """
+        f, (i, j) = self._join([qubitNum1, qubitNum2])
+        f.engine.apply_CNOT(i, j)
+
+    def apply_CPHASE(self, qubitNum1, qubitNum2):
+        """
+        Applies the CPHASE to the qubit with the numbers qubitNum1 and qubitNum2, joining their factors.
+        """
+        f, (i, j) = self._join([qubitNum1, qubitNum2])
+        f.engine.apply_CPHASE(i, j)
+
+    def apply_twoqubit_gate(self, gateU, qubit1, qubit2):
+        """
+        Applies a unitary gate to the two specified qubits, joining their factors.
+        """
+        f, (i, j) = self._join([qubit1, qubit2])
+        f.engine.apply_twoqubit_gate(gateU, i, j)
+
+    def apply_circuit(self, circuit, qubitNums):
+        """
+        Applies the circuit to the qubits with numbers qubitNums, joining their factors.
+        """
+        f, nums = self._join(qubitNums)
+        f.engine.apply_circuit(circuit, nums)
+
+    def _split_measured(self, qubitNums):
+        """
+        Moves measured qubits, which are in a product state with the rest of their factor, into factors of their own.
+        """
+        for qubitNum in qubitNums:
+            f, i = self._locate(qubitNum)
+            if len(f.qubitNums) > 1:
+                g = self._new_factor(1)
+                f.engine.split_off([i], g.engine)
+                f.qubitNums.pop(i)
+                g.qubitNums = [qubitNum]
+                self.factors.append(g)
+
+    def measure_qubit_inplace(self, qubitNum):
+        """
+        Measures the desired qubit in the standard basis. This returns the classical outcome. The qubit is left in
+        a factor of its own.
+        """
+        outcome = self._single("measure_qubit_inplace", qubitNum)
+        self._split_measured([qubitNum])
+        return outcome
+
+    def measure_bell_inplace(self, qubitNum1, qubitNum2):
+        """
+        Measures the two qubits in the Bell basis. This returns the classical outcomes (x, y). The qubits are left
+        in factors of their own.
+        """
+        f, (i, j) = self._join([qubitNum1, qubitNum2])
+        outcomes = f.engine.measure_bell_inplace(i, j)
+        self._split_measured([qubitNum1, qubitNum2])
+        return outcomes
+
+    def measure_pauli(self, pauli, qubitNums):
+        """
+        Measures the Pauli operator given as a string such as "XZZXI" on the qubits qubitNums, joining their factors.
+        """
+        f, nums = self._join(qubitNums)
+        return f.engine.measure_pauli(pauli, nums)
+
+    def measure_paulis(self, paulis, qubitNums):
+        """
+        Measures the commuting Pauli operators paulis on the qubits qubitNums, joining their factors once.
+        """
+        f, nums = self._join(qubitNums)
+        return f.engine.measure_paulis(paulis, nums)
+
+    def measure_qubit(self, qubitNum):
+        """
+        Measures the desired qubit in the standard basis. This returns the classical outcome and deletes the qubit.
+        """
+        f, i = self._locate(qubitNum)
+        if len(f.qubitNums) > 1:
+            outcome = f.engine.measure_qubit(i)
+        else:
+            outcome = f.engine.measure_qubit_inplace(i)
+        f.qubitNums.pop(i)
+        self._drop([qubitNum])
+        return outcome
+
+    def replace_qubit(self, qubitNum, state):
+        """
+        Replaces the qubit at position qubitNum with the one given by state.
+        """
+        f, i = self._locate(qubitNum)
+        if len(f.qubitNums) > 1:
+            f.engine.remove_qubit(i)
+            f.qubitNums.pop(i)
+        else:
+            self.factors.remove(f)
+
+        g = self._new_factor(1)
+        g.engine.add_qubit(state)
+        g.qubitNums = [qubitNum]
+        self.factors.append(g)
+
+    def absorb(self, other):
+        """
+        Absorb the qubits from the other engine into this one, keeping its factors separate.
+        """
+        newNum = self.activeQubits + other.activeQubits
+        if newNum > self.maxQubits:
+            raise quantumError("Cannot merge: qubits exceed the maximum available.\n")
+
+        n = self.activeQubits
+        if isinstance(other, factoredEngine):
+            for f in other.factors:
+                self.factors.append(_factor(f.engine, [n + j for j in f.qubitNums]))
+            other.factors = []
+        elif other.activeQubits > 0:
+            self.factors.append(_factor(other, list(range(n, newNum))))
+
+    def absorb_parts(self, R, I, activeQ):
+        """
+        Absorb the qubits, given in pieces, as a new factor
+
+        Arguments:
+        R		real part of the qubit state as a list
+        I		imaginary part as a list
+        activeQ		active number of qubits
+        """
+        if self.activeQubits + activeQ > self.maxQubits:
+            raise quantumError("Cannot merge: qubits exceed the maximum available.\n")
+
+        f = self._new_factor(activeQ)
+        f.engine.absorb_parts(R, I, activeQ)
+        self._add_factor(f)
+
+    def absorb_arrays(self, R, I, activeQ):
+        """
+        Absorb the qubits, given in pieces as numpy arrays, as a new factor
+        """
+        if self.activeQubits + activeQ > self.maxQubits:
+            raise quantumError("Cannot merge: qubits exceed the maximum available.\n")
+
+        f = self._new_factor(activeQ)
+        f.engine.absorb_arrays(R, I, activeQ)
+        self._add_factor(f)
+
+    def correlated_with(self, qubitNums):
+        """
+        Returns the other qubits which may be correlated with the qubits qubitNums, which are all in their factors.
+        """
+        qubits = []
+        for f in self.factors:
+            removed = [i for i, j in enumerate(f.qubitNums) if j in qubitNums]
+            if removed:
+                qubits.extend(f.qubitNums[i] for i in f.engine.correlated_with(removed))
+        return sorted(qubits)
+
+    def find_factors(self, candidates=None):
+        """
+        Looks for parts of the register that are in a tensor product with the rest, within each of the factors.
+        """
+        parts = []
+        for f in self.factors:
+            local = None if candidates is None else [i for i, j in enumerate(f.qubitNums) if j in candidates]
+            for part in f.engine.find_factors(local):
+                parts.append(sorted(f.qubitNums[i] for i in part))
+        return sorted(parts)
+
+    def separate(self, parts):
+        """
+        Puts each of the parts of the register, as returned by find_factors, into a factor of its own.
+        """
+        for part in parts:
+            f, _ = self._locate(part[0])
+            if len(part) == len(f.qubitNums):
+                continue
+            moved = [i for i, j in enumerate(f.qubitNums) if j in part]
+            g = self._new_factor(len(moved))
+            f.engine.split_off(moved, g.engine)
+            g.qubitNums = [f.qubitNums[i] for i in moved]
+            f.qubitNums = [j for i, j in enumerate(f.qubitNums) if i not in moved]
+            self.factors.append(g)
+
+    def split_off(self, qubitNums, other):
+        """
+        Moves the qubits qubitNums, which must be in a tensor product with the rest of the register, to the end
+        of the register other. The qubits keep their order.
+        """
+        if other.activeQubits + len(qubitNums) > other.maxQubits:
+            raise quantumError("Cannot split: qubits exceed the maximum available.")
+
+        n = other.activeQubits
+        for f in list(self.factors):
+            moved = [i for i, j in enumerate(f.qubitNums) if j in qubitNums]
+            if not moved:
+                continue
+            if len(moved) == len(f.qubitNums):
+                g = f
+                self.factors.remove(f)
+            else:
+                g = self._new_factor(len(moved))
+                f.engine.split_off(moved, g.engine)
+                g.qubitNums = [f.qubitNums[i] for i in moved]
+                f.qubitNums = [j for i, j in enumerate(f.qubitNums) if i not in moved]
+            g.qubitNums = [n + list(qubitNums).index(j) for j in g.qubitNums]
+            other.factors.append(g)
+        self._drop(qubitNums)
+
+    def permute_qubits(self, order):
+        """
+        Reorders the qubits of the register, such that qubit order[i] becomes qubit i.
+        """
+        newNums = {qubitNum: i for i, qubitNum in enumerate(order)}
+        for f in self.factors:
+            f.qubitNums = [newNums[j] for j in f.qubitNums]
+
+    def reset(self):
+        """
+        Removes all qubits, leaving an empty register whose engine can be reused for a new register.
+        """
+        self.factors = []
@@ -0,0 +1,496 @@
+"""
+Registers simulated in worker processes, so that one node can use several cores.
+
+Each worker process holds the engines of a number of registers and is driven by small command messages over a pipe:
+the method to run on an engine together with its arguments. The states of whole registers, which are moved when
+registers are merged or split between workers, are handed over in shared memory instead of being sent through the
+pipe.
+"""
+
+import itertools
+import multiprocessing
+import os
+import random
+import signal
+import threading
+from multiprocessing import resource_tracker
+
+import numpy as np
+
+from simulaqron.virtNode.basics import quantumEngine, quantumError, noQubitError
+from simulaqron.virtNode.sharedMemory import to_shared, use_shared, from_shared
+
+# Errors of the engines that are raised again as such at the node
+_errors = {"quantumError": quantumError, "noQubitError": noQubitError}
+
+
+def _serve(conn, engineClass, engineArgs):
+    """
+    Main loop of a worker process, running the commands received over conn on its engines until it receives None
+    or the node goes away. Each command is answered with (True, result, active qubits of the engine) or with
+    (False, error name, message).
+    """
+
+    # Leave interrupts to the node, and do not inherit its handlers, so that the node can always stop us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # Forked workers start with the random state of the node, and would otherwise all draw the same outcomes
+    np.random.seed(int.from_bytes(os.urandom(4), "little"))
+    random.seed(os.urandom(16))
+
+    engines = {}
+
+    def engine(key, maxQubits):
+        # Engines are made with their first command, which the node sends from a worker thread
+        if key not in engines:
+            engines[key] = engineClass(None, key, maxQubits, **engineArgs)
+        return engines[key]
+
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        command, key, maxQubits, args = msg
+
+        if command == "del":
+            engines.pop(key, None)
+            continue
+
+        try:
+            eng = engine(key, maxQubits)
+            eng.maxQubits = maxQubits
+
+            if command == "call":
+                name, callArgs = args
+                result = getattr(eng, name)(*callArgs)
+            elif command == "absorb":
+                eng.absorb(engine(args, maxQubits))
+                result = None
+            elif command == "split_off":
+                qubitNums, otherKey = args
+                other = engine(otherKey, maxQubits)
+                eng.split_off(qubitNums, other)
+                result = other.activeQubits
+            elif command == "export":
+                # Move the qubits args, or the whole register, out through shared memory
+                if args is not None:
+                    part = engineClass(None, key, len(args), **engineArgs)
+                    eng.split_off(args, part)
+                else:
+                    part = eng
+                shm, layout = to_shared(part.get_register_arrays())
+                shm.close()
+                result = (shm.name, layout, part.activeQubits)
+            elif command == "import":
+                name, layout, activeQ = args
+                use_shared(name, layout, lambda R, I: eng.absorb_arrays(R, I, activeQ))
+                result = None
+            else:
+                raise quantumError("Unknown command {}".format(command))
+
+            conn.send((True, result, engines[key].activeQubits))
+        except Exception as e:
+            conn.send((False, type(e).__name__, str(getattr(e, "value", e))))
+
+
+class registerWorker(object):
+    """
+    Worker process simulating registers, together with the pipe to send it commands. Commands are sent from the
+    reactor thread and from the threads engine work is handed to, so each command holds the lock of the pipe until
+    it is answered.
+    """
+
+    def __init__(self, context, engineClass, engineArgs):
+        self._conn, childConn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(childConn, engineClass, engineArgs), daemon=True)
+        self.process.start()
+        childConn.close()
+        self._lock = threading.Lock()
+
+        # Number of registers simulated by this worker, and engines to delete with the next command
+        self.numRegs = 0
+        self._deleted = []
+
+    def command(self, command, key, maxQubits, args=None):
+        """
+        Sends the command for the engine key to the worker and returns its result and the number of active qubits
+        of the engine afterwards.
+        """
+        with self._lock:
+            while self._deleted:
+                self._conn.send(("del", self._deleted.pop(), None, None))
+            self._conn.send((command, key, maxQubits, args))
+            reply = self._conn.recv()
+        if not reply[0]:
+            raise _errors.get(reply[1], quantumError)(reply[2])
+        return reply[1], reply[2]
+
+    def delete(self, key):
+        """
+        Deletes the engine key with the next command. Safe to call while another command is sent.
+        """
+        self._deleted.append(key)
+        self.numRegs -= 1
+
+    def stop(self):
+        with self._lock:
+            try:
+                self._conn.send(None)
+            except OSError:
+                # The worker is gone already
+                pass
+        self.process.join()
+
+
+class registerWorkers(object):
+    """
+    Pool of worker processes simulating registers with engines of the class engineClass.
+
+    Attributes:
+        Arguments
+        n		number of worker processes
+        engineClass	engine class simulating the registers
+        engineArgs	further keyword arguments of the engine class
+    """
+
+    def __init__(self, n, engineClass, engineArgs=None):
+        # Forking is fine as long as the workers are started before the reactor runs any threads. The workers
+        # share the resource tracker of the node, which keeps track of the blocks of shared memory.
+        resource_tracker.ensure_running()
+        context = multiprocessing.get_context("fork")
+        self.workers = [registerWorker(context, engineClass, engineArgs or {}) for _ in range(n)]
+        self.engineClass = engineClass
+        self._keys = itertools.count()
+
+    def new_key(self):
+        return next(self._keys)
+
+    def least_loaded(self):
+        """
+        Returns the worker simulating the fewest registers.
+        """
+        return min(self.workers, key=lambda w: w.numRegs)
+
+    def stop(self):
+        for w in self.workers:
+            w.stop()
+
+
+class processEngine(quantumEngine):
+    """
+    Quantum engine whose register is simulated in a worker process of a pool of register workers. Its methods wait
+    for the worker, which may be busy with other registers, so the node always runs them in a thread.
+
+    Attributes:
+        maxQubits:	maximum number of qubits this engine will support.
+        workers:	pool of register workers
+        worker:		worker to simulate the register, by default the least loaded one
+    """
+
+    # Have the node run all work on this engine in a thread
+    offload = True
+
+    def __init__(self, node, num, maxQubits=10, workers=None, worker=None):
+        """
+        Initialize the engine. If no number is given for maxQubits, the assumption will be 10.
+        """
+
+        super().__init__(node=node, num=num, maxQubits=maxQubits)
+
+        if workers is None:
+            raise quantumError("A register in a worker process needs a pool of register workers.")
+        self.workers = workers
+        self.worker = worker if worker is not None else workers.least_loaded()
+        self._key = workers.new_key()
+        self.worker.numRegs += 1
+
+        # Whether the engines in the workers keep parts of the register apart themselves
+        self.factored = getattr(workers.engineClass, "factored", False)
+
+        # Active qubits as reported by the worker with each command. The worker makes the engine with the first
+        # one, so that making the engine does not wait for the worker.
+        self.activeQubits = 0
+
+    def __del__(self):
+        if getattr(self, "_key", None) is not None:
+            self.worker.delete(self._key)
+
+    def _command(self, command, args=None):
+        result, self.activeQubits = self.worker.command(command, self._key, self.maxQubits, args)
+        return result
+
+    def _call(self, name, *args):
+        return self._command("call", (name, args))
+
+    def _export(self, qubitNums=None):
+        """
+        Moves the qubits qubitNums, or the whole register, out of the worker. Returns their state as arrays and
+        their number.
+        """
+        name, layout, activeQ = self._command("export", qubitNums)
+        return from_shared(name, layout, unlink=True), activeQ
+
+    def _import(self, arrays, activeQ):
+        """
+        Adds qubits whose state is given as arrays at the end of the register.
+        """
+        shm, layout = to_shared(arrays)
+        try:
+            self._command("import", (shm.name, layout, activeQ))
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def add_fresh_qubit(self):
+        """
+        Add a new qubit initialized in the \|0\> state.
+        """
+        return self._call("add_fresh_qubit")
+
+    def add_fresh_qubits(self, n):
+        """
+        Add n new qubits initialized in the \|0\> state.
+        """
+        return self._call("add_fresh_qubits", n)
+
+    def add_epr_pair(self):
+        """
+        Add two new qubits in the Bell state (\|00\> + \|11\>)/sqrt(2).
+        """
+        return self._call("add_epr_pair")
+
+    def add_qubit(self, newQubit):
+        """
+        Add new qubit in the state described by newQubit.
+        """
+        return self._call("add_qubit", newQubit)
+
+    def remove_qubit(self, qubitNum):
+        """
+        Removes the qubit with the desired number qubitNum
+        """
+        self._call("remove_qubit", qubitNum)
+
+    def remove_qubits(self, qubitNums):
+        """
+        Removes the qubits with the desired numbers qubitNums
+        """
+        self._call("remove_qubits", qubitNums)
+
+    def get_register_RI(self):
+        """
+        Retrieves the entire register in real and imaginary parts.
+        """
+        return self._call("get_register_RI")
+
+    def get_register_arrays(self):
+        """
+        Retrieves the entire register in real and imaginary parts as numpy arrays, through shared memory.
+        """
+        return self._export()[0]
+
+    def get_qubits_RI(self, qList):
+        """
+        Retrieves the qubits in the list in real and imaginary parts.
+        """
+        return self._call("get_qubits_RI", qList)
+
+    def apply_H(self, qubitNum):
+        """
+        Applies a Hadamard gate to the qubits with number qubitNum.
+        """
+        self._call("apply_H", qubitNum)
+
+    def apply_K(self, qubitNum):
+        """
+        Applies a K gate to the qubits with number qubitNum. Maps computational basis to Y eigenbasis.
+        """
+        self._call("apply_K", qubitNum)
+
+    def apply_X(self, qubitNum):
+        """
+        Applies a X gate to the qubits with number qubitNum.
+        """
+        self._call("apply_X", qubitNum)
+
+    def apply_Z(self, qubitNum):
+        """
+        Applies a Z gate to the qubits with number qubitNum.
+        """
+        self._call("apply_Z", qubitNum)
+
+    def apply_Y(self, qubitNum):
+        """
+        Applies a Y gate to the qubits with number qubitNum.
+        """
+        self._call("apply_Y", qubitNum)
+
+    def apply_T(self, qubitNum):
+        """
+        Applies a T gate to the qubits with number qubitNum.
+        """
+        self._call("apply_T", qubitNum)
+
+    def apply_inverse_T(self, qubitNum):
+        """
+        Applies the inverse of the T gate to the qubits with number qubitNum.
+        """
+        self._call("apply_inverse_T", qubitNum)
+
+    def apply_rotation(self, qubitNum, n, a):
+        """
+        Applies a rotation around the axis n with the angle a to qubit with number qubitNum.
+        """
+        self._call("apply_rotation", qubitNum, n, a)
+
+    def apply_onequbit_gate(self, gateU, qubitNum):
+        """
+        Applies a unitary gate to the specified qubit.
+        """
+        self._call("apply_onequbit_gate", gateU, qubitNum)
+
+    def apply_CNOT(self, qubitNum1, qubitNum2):
+        """
+        Applies the CNOT to the qubit with the numbers qubitNum1 and qubitNum2.
+        """
+        self._call("apply_CNOT", qubitNum1, qubitNum2)
+
+    def apply_CPHASE(self, qubitNum1, qubitNum2):
+        """
+        Applies the CPHASE to the qubit with the numbers qubitNum1 and qubitNum2.
+        """
+        self._call("apply_CPHASE", qubitNum1, qubitNum2)
+
+    def apply_twoqubit_gate(self, gateU, qubit1, qubit2):
+        """
+        Applies a unitary gate to the two specified qubits.
+        """
+        self._call("apply_twoqubit_gate", gateU, qubit1, qubit2)
+
+    def apply_circuit(self, circuit, qubitNums):
+        """
+        Applies the circuit to the qubits with numbers qubitNums, sent to the worker as one command.
+        """
+        self._call("apply_circuit", circuit, qubitNums)
+
+    def measure_qubit_inplace(self, qubitNum):
+        """
+        Measures the desired qubit in the standard basis. This returns the classical outcome.
+        """
+        return self._call("measure_qubit_inplace", qubitNum)
+
+    def measure_bell_inplace(self, qubitNum1, qubitNum2):
+        """
+        Measures the two qubits in the Bell basis. This returns the classical outcomes (x, y).
+        """
+        return self._call("measure_bell_inplace", qubitNum1, qubitNum2)
+
+    def measure_pauli(self, pauli, qubitNums):
+        """
+        Measures the Pauli operator given as a string such as "XZZXI" on the qubits qubitNums.
+        """
+        return self._call("measure_pauli", pauli, qubitNums)
+
+    def measure_paulis(self, paulis, qubitNums):
+        """
+        Measures the commuting Pauli operators paulis on the qubits qubitNums, in one round trip to the worker.
+        """
+        return self._call("measure_paulis", paulis, qubitNums)
+
+    def measure_qubit(self, qubitNum):
+        """
+        Measures the desired qubit in the standard basis. This returns the classical outcome and deletes the qubit.
+        """
+        return self._call("measure_qubit", qubitNum)
+
+    def replace_qubit(self, qubitNum, state):
+        """
+        Replaces the qubit at position qubitNum with the one given by state.
+        """
+        self._call("replace_qubit", qubitNum, state)
+
+    def absorb(self, other):
+        """
+        Absorb the qubits from the other engine into this one. Within one worker this is done there, and otherwise
+        the state of other is handed over in shared memory.
+        """
+        if self.activeQubits + other.activeQubits > self.maxQubits:
+            raise quantumError("Cannot merge: qubits exceed the maximum available.\n")
+
+        if isinstance(other, processEngine) and other.worker is self.worker:
+            self._command("absorb", other._key)
+        elif isinstance(other, processEngine):
+            arrays, activeQ = other._export()
+            self._import(arrays, activeQ)
+        else:
+            R, I = other.get_register_arrays()
+            self.absorb_arrays(R, I, other.activeQubits)
+
+    def absorb_parts(self, R, I, activeQ):
+        """
+        Absorb the qubits, given in pieces
+
+        Arguments:
+        R		real part of the qubit state as a list
+        I		imaginary part as a list
+        activeQ		active number of qubits
+        """
+        self.absorb_arrays(np.asarray(R), None if I is None else np.asarray(I), activeQ)
+
+    def absorb_arrays(self, R, I, activeQ):
+        """
+        Absorb the qubits, given in pieces as numpy arrays, through shared memory
+        """
+        self._import([R, I], activeQ)
+
+    def correlated_with(self, qubitNums):
+        """
+        Returns the other qubits which may be correlated with the qubits qubitNums.
+        """
+        return self._call("correlated_with", list(qubitNums))
+
+    def find_factors(self, candidates=None):
+        """
+        Looks for parts of the register that are in a tensor product with the rest.
+        """
+        return self._call("find_factors", candidates)
+
+    def separate(self, parts):
+        """
+        Puts each of the parts of the register, as returned by find_factors, into a factor of its own.
+        """
+        self._call("separate", parts)
+
+    def split_off(self, qubitNums, other):
+        """
+        Moves the qubits qubitNums, which must be in a tensor product with the rest of the register, to the end
+        of the register other. The qubits keep their order. If other is simulated by another worker, the state of
+        the qubits is handed over in shared memory.
+        """
+        if other.activeQubits + len(qubitNums) > other.maxQubits:
+            raise quantumError("Cannot split: qubits exceed the maximum available.")
+
+        if isinstance(other, processEngine) and other.worker is self.worker:
+            other.activeQubits = self._command("split_off", (list(qubitNums), other._key))
+        elif isinstance(other, processEngine):
+            arrays, activeQ = self._export(list(qubitNums))
+            other._import(arrays, activeQ)
+        else:
+            arrays, activeQ = self._export(list(qubitNums))
+            other.absorb_arrays(arrays[0], arrays[1], activeQ)
+
+    def permute_qubits(self, order):
+        """
+        Reorders the qubits of the register, such that qubit order[i] becomes qubit i.
+        """
+        self._call("permute_qubits", order)
+
+    def reset(self):
+        """
+        Removes all qubits, leaving an empty register whose engine can be reused for a new register.
+        """
+        self._call("reset")
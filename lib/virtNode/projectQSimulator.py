@@ -61,6 +61,10 @@ class projectQEngine(quantumEngine):
         """
         Measures out all the current qubits, needed for projectQs garbage collectorself.
         """
+        # The simulator may have been handed over to another engine
+        if self.eng is None:
+            return
+
         # Check first that project Q garbage collector not already removed qubits
         self.eng.flush()
         if not len(self.eng.backend.cheat()[0]) == 0:
@@ -294,6 +298,11 @@ class projectQEngine(quantumEngine):
         if self.activeQubits == 0:
             self.eng = other.eng
             self.qubitReg = list(other.qubitReg)
+
+            # The qubits now belong to us, make sure the other engine does not measure them out
+            other.eng = None
+            other.qubitReg = []
+            other.activeQubits = 0
         elif other.activeQubits > 0:
             # Get the current state of the other engine
             other.eng.flush()
@@ -339,3 +348,14 @@ class projectQEngine(quantumEngine):
             self.qubitReg += list(qreg)
 
             self.activeQubits = newNum
+
+    def reset(self):
+        """
+        Removes all qubits, leaving an empty register whose engine can be reused for a new register. The ProjectQ
+        simulator is kept, so that it does not need to be set up again.
+        """
+        if self.eng is None:
+            self.eng = pQ.MainEngine()
+        for _ in range(self.activeQubits):
+            self.measure_qubit(0)
+        self.eng.flush()
@@ -0,0 +1,243 @@
+"""
+Quantum error correcting codes, applied by the simulating engine to a block of qubits in one step.
+
+A circuit is a tuple of gates. Each gate is a tuple of the gate name, matching one of the apply_<name> methods of
+the engines, followed by the positions of the qubits it acts on within the block. Pauli operators on a block are
+strings such as "XZZXI", one letter per position.
+
+Codes are kept in a registry by name. New codes are added with register_code, after which they can be used by name
+through the encode, correct and decode operations of the virtual node.
+"""
+
+from simulaqron.virtNode.basics import quantumError
+
+# Inverses of gates that are not their own inverse
+_inverseGates = {"T": "inverse_T", "inverse_T": "T"}
+
+
+def inverse_circuit(circuit):
+    """
+    Returns the circuit undoing the given circuit.
+    """
+    return tuple((_inverseGates.get(gate[0], gate[0]),) + tuple(gate[1:]) for gate in reversed(circuit))
+
+
+def anticommutes(pauli1, pauli2):
+    """
+    Returns 1 if the two Pauli operators anticommute, and 0 if they commute.
+    """
+    return sum(1 for p1, p2 in zip(pauli1, pauli2) if p1 != "I" and p2 != "I" and p1 != p2) % 2
+
+
+def _row_reduce(rows):
+    """
+    Brings the binary vectors rows into reduced row echelon form. Returns the list of (pivot, row).
+    """
+    reduced = []
+    for row in rows:
+        row = list(row)
+        for pivot, other in reduced:
+            if row[pivot]:
+                row = [a ^ b for a, b in zip(row, other)]
+        if any(row):
+            pivot = row.index(1)
+            reduced = [(p, [a ^ b for a, b in zip(other, row)] if other[pivot] else other) for p, other in reduced]
+            reduced.append((pivot, row))
+    return reduced
+
+
+def css_encoder(stabilizers, logicalX):
+    """
+    Derives the encoding circuit of a CSS code with one logical qubit, whose logical Z only contains Z's. Starting from
+    \|0...0\>, it spreads the qubit at position data over the support of logical X and then adds the X type
+    stabilizers with a Hadamard and CNOTs each. Returns the circuit and the position data of the qubit to encode.
+    """
+    rows = [[int(p == "X") for p in s] for s in stabilizers if set(s) <= {"I", "X"}]
+    reduced = _row_reduce(rows)
+
+    # Choose a logical X without support on the pivots, so the pivot qubits are still |0> when used
+    lx = [int(p == "X") for p in logicalX]
+    for pivot, row in reduced:
+        if lx[pivot]:
+            lx = [a ^ b for a, b in zip(lx, row)]
+    data = lx.index(1)
+
+    circuit = [("CNOT", data, j) for j in range(len(lx)) if lx[j] and j != data]
+    for pivot, row in reduced:
+        circuit.append(("H", pivot))
+        circuit.extend(("CNOT", pivot, j) for j in range(len(row)) if row[j] and j != pivot)
+    return tuple(circuit), data
+
+
+class qecCode(object):
+    """
+    Stabilizer code encoding one qubit into a block of n qubits. The qubit to encode is at position 0 of the block,
+    and the other positions start in \|0\>. Decoding returns the qubit to position 0 and the others to \|0\>.
+
+    Attributes:
+        Arguments
+        name		name of the code
+        stabilizers	generators of the stabilizer group, as Pauli strings
+        logicalX	logical X operator, as Pauli string
+        logicalZ	logical Z operator, as Pauli string
+        encoder		encoding circuit. If not given, it is derived for CSS codes, moving the qubit that the derived
+                        circuit encodes to position 0.
+    """
+
+    def __init__(self, name, stabilizers, logicalX, logicalZ, encoder=None):
+        self.name = name
+        self.n = len(logicalX)
+
+        if encoder is None:
+            if not (set(logicalZ) <= {"I", "Z"} and all(set(s) <= {"I", "X"} or set(s) <= {"I", "Z"} for s in stabilizers)):
+                raise quantumError("Encoding circuits can only be derived for CSS codes.")
+            encoder, data = css_encoder(stabilizers, logicalX)
+
+            # Relabel the positions such that the qubit to encode is at position 0
+            swap = {0: data, data: 0}
+            encoder = tuple((gate[0],) + tuple(swap.get(i, i) for i in gate[1:]) for gate in encoder)
+            stabilizers = [self._swap_positions(s, swap) for s in stabilizers]
+            logicalX = self._swap_positions(logicalX, swap)
+            logicalZ = self._swap_positions(logicalZ, swap)
+
+        self.stabilizers = tuple(stabilizers)
+        self.logicalX = logicalX
+        self.logicalZ = logicalZ
+        self.encoder = tuple(encoder)
+        self.unencoder = inverse_circuit(self.encoder)
+
+        # Lookup table from syndromes to corrections, built on first use
+        self._table = None
+
+    @staticmethod
+    def _swap_positions(pauli, swap):
+        return "".join(pauli[swap.get(i, i)] for i in range(len(pauli)))
+
+    def syndrome_of(self, error):
+        """
+        Returns the syndrome of the Pauli error.
+        """
+        return tuple(anticommutes(s, error) for s in self.stabilizers)
+
+    @property
+    def table(self):
+        """
+        Lookup table from syndromes to the recovery circuits correcting them. Each syndrome is attributed to the
+        first single qubit error giving it, if any.
+        """
+        if self._table is None:
+            self._table = {self.syndrome_of("I" * self.n): ()}
+            for i in range(self.n):
+                for pauli in "XZY":
+                    syndrome = self.syndrome_of("I" * i + pauli + "I" * (self.n - i - 1))
+                    if syndrome not in self._table:
+                        self._table[syndrome] = ((pauli, i),)
+        return self._table
+
+    def encode(self, engine, qubitNums):
+        """
+        Encodes the qubit at qubitNums[0] into the block qubitNums.
+        """
+        engine.apply_circuit(self.encoder, qubitNums)
+
+    def measure_syndrome(self, engine, qubitNums):
+        """
+        Measures the stabilizer generators on the block qubitNums and returns the syndrome.
+        """
+        return tuple(engine.measure_paulis(self.stabilizers, qubitNums))
+
+    def correct(self, engine, qubitNums):
+        """
+        Measures the syndrome of the block qubitNums and applies the recovery from the lookup table. Returns the syndrome.
+        """
+        syndrome = self.measure_syndrome(engine, qubitNums)
+        recovery = self.table.get(syndrome, ())
+        if recovery:
+            engine.apply_circuit(recovery, qubitNums)
+        return syndrome
+
+    def decode(self, engine, qubitNums):
+        """
+        Corrects the block qubitNums and decodes it, leaving the qubit at qubitNums[0]. Returns the syndrome.
+        """
+        syndrome = self.correct(engine, qubitNums)
+        engine.apply_circuit(self.unencoder, qubitNums)
+        return syndrome
+
+
+# Registry of codes by name
+codes = {}
+
+
+def register_code(code):
+    """
+    Adds the code to the registry, replacing any code of the same name.
+    """
+    codes[code.name] = code
+    return code
+
+
+def get_code(name):
+    """
+    Returns the code with the given name from the registry.
+    """
+    try:
+        return codes[name]
+    except KeyError:
+        raise quantumError("Unknown error correcting code {}".format(name))
+
+
+register_code(qecCode("bit_flip", ["ZZI", "IZZ"], "XXX", "ZZZ"))
+
+register_code(
+    qecCode(
+        "phase_flip",
+        ["XXI", "IXX"],
+        "ZZZ",
+        "XXX",
+        encoder=(("CNOT", 0, 1), ("CNOT", 0, 2), ("H", 0), ("H", 1), ("H", 2)),
+    )
+)
+
+# Shor's 9 qubit code, with the blocks |000> +- |111>
+register_code(
+    qecCode(
+        "shor",
+        ["ZZIIIIIII", "IZZIIIIII", "IIIZZIIII", "IIIIZZIII", "IIIIIIZZI", "IIIIIIIZZ", "XXXXXXIII", "IIIXXXXXX"],
+        "ZIIZIIZII",
+        "XXXXXXXXX",
+        encoder=(
+            ("CNOT", 0, 3),
+            ("CNOT", 0, 6),
+            ("H", 0),
+            ("H", 3),
+            ("H", 6),
+            ("CNOT", 0, 1),
+            ("CNOT", 3, 4),
+            ("CNOT", 6, 7),
+            ("CNOT", 0, 2),
+            ("CNOT", 3, 5),
+            ("CNOT", 6, 8),
+        ),
+    )
+)
+
+# Steane's 7 qubit code, from the [7, 4] Hamming code
+register_code(
+    qecCode(
+        "steane",
+        ["IIIXXXX", "IXXIIXX", "XIXIXIX", "IIIZZZZ", "IZZIIZZ", "ZIZIZIZ"],
+        "XXXXXXX",
+        "ZZZZZZZ",
+    )
+)
+
+# Rotated surface code of distance 3 on a 3 x 3 grid, numbered row by row
+register_code(
+    qecCode(
+        "surface",
+        ["XXIXXIIII", "IIIIXXIXX", "IXXIIIIII", "IIIIIIXXI", "IZZIZZIII", "IIIZZIZZI", "ZIIZIIIII", "IIIIIZIIZ"],
+        "XIIXIIXII",
+        "ZZZIIIIII",
+    )
+)
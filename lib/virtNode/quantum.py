@@ -69,6 +69,9 @@ class simulatedQubit(pb.Referenceable):
         # Mark this qubit as active (still connected to a register)
         self.active = True
 
+        # Name of the other node holding the virtual qubit backed by this one, None if it is held at this node
+        self.holder = None
+
         # Optional parameters for when the simulation is noise
         self.noisy = settings.simulaqron_settings.noisy_qubits
         self.T1 = settings.simulaqron_settings.t1
@@ -97,69 +100,76 @@ class simulatedQubit(pb.Referenceable):
 
     def make_fresh(self):
         """
-        Make this a fresh qubit.
+        Make this a fresh qubit. Returns a deferred firing once it is added to the register.
         """
+
+        def added(num):
+            self.num = num
+            logging.info("QUANTUM %s: Adding qubit number %d to register %d", self.node.name, num, self.register.num)
+
         # Create a fresh qubit in the |0> state
-        num = self.register.add_fresh_qubit()
-        self.num = num
+        return self.node.root.run_on_register(self.register, self.register.add_fresh_qubit).addCallback(added)
 
-        logging.info("QUANTUM %s: Adding qubit number %d to register %d", self.node.name, num, self.register.num)
+    def _run(self, name, *args):
+        """
+        Runs the method name of the register on this qubit, through the node which may hand it to a worker thread.
+        Returns a deferred firing with the outcome. The qubit is taken at its current position, as the node may
+        move it before queued work runs.
+        """
+        return self.node.root.run_on_register(self.register, self._apply, self.register, self.num, name, *args)
+
+    def _apply(self, register, num, name, *args):
+        self._apply_random_pauli_noise(register, num)
+        return getattr(register, name)(num, *args)
 
     def remote_apply_X(self):
         """
         Apply X gate to itself by passing it onto the underlying register.
         """
         logging.debug("VIRTUAL NODE %s: applying X to number %d", self.node.name, self.num)
-        self._apply_random_pauli_noise()
-        self.register.apply_X(self.num)
+        return self._run("apply_X")
 
     def remote_apply_K(self):
         """
         Apply K gate to itself by passing it onto the underlying register. Maps computational to Y eigenbasis.
         """
         logging.debug("VIRTUAL NODE %s: applying K to number %d", self.node.name, self.num)
-        self._apply_random_pauli_noise()
-        self.register.apply_K(self.num)
+        return self._run("apply_K")
 
     def remote_apply_Y(self):
         """
         Apply Y gate.
         """
         logging.debug("VIRTUAL NODE %s: applying Y to number %d", self.node.name, self.num)
-        self._apply_random_pauli_noise()
-        self.register.apply_Y(self.num)
+        return self._run("apply_Y")
 
     def remote_apply_Z(self):
         """
         Apply Z gate.
         """
         logging.debug("VIRTUAL NODE %s: applying Z to number %d", self.node.name, self.num)
-        self._apply_random_pauli_noise()
-        self.register.apply_Z(self.num)
+        return self._run("apply_Z")
 
     def remote_apply_H(self):
         """
         Apply H gate.
         """
         logging.debug("VIRTUAL NODE %s: applying H to number %d", self.node.name, self.num)
-        self._apply_random_pauli_noise()
-        self.register.apply_H(self.num)
+        return self._run("apply_H")
 
     def remote_apply_T(self):
         """
         Apply T gate.
         """
         logging.debug("VIRTUAL NODE %s: applying T to number %d", self.node.name, self.num)
-        self._apply_random_pauli_noise()
-        self.register.apply_T(self.num)
+        return self._run("apply_T")
 
     def remote_apply_inverse_T(self):
         """
         Apply T gate.
         """
         logging.debug("VIRTUAL NODE %s: applying inverse T to number %d", self.node.name, self.num)
-        self._apply_random_pauli_noise()
-        self.register.apply_inverse_T(self.num)
+        return self._run("apply_inverse_T")
 
     def remote_apply_rotation(self, *args):
         """
@@ -177,8 +187,7 @@ class simulatedQubit(pb.Referenceable):
             str(tuple(n)),
             str(a),
         )
-        self._apply_random_pauli_noise()
-        self.register.apply_rotation(self.num, n, a)
+        return self._run("apply_rotation", n, a)
 
     def remote_measure_inplace(self):
         """
@@ -187,9 +196,7 @@ class simulatedQubit(pb.Referenceable):
 
         Returns the measurement outcome.
         """
-        self._apply_random_pauli_noise()
-        outcome = self.register.measure_qubit_inplace(self.num)
-        return outcome
+        return self._run("measure_qubit_inplace")
 
     def remote_measure(self):
         """
@@ -199,9 +206,20 @@ class simulatedQubit(pb.Referenceable):
         """
 
         # Measure the qubit
-        self._apply_random_pauli_noise()
-        outcome = self.register.measure_qubit(self.num)
-        return outcome
+        return self._run("measure_qubit")
+
+    def remote_measure_bell_inplace(self, targetNum):
+        """
+        Measure this qubit and the target qubit in the Bell basis. This does NOT delete the qubits, but leaves them
+        in the computational basis state given by the outcomes.
+
+        Arguments
+        targetNum    the qubit to measure together with this one
+
+        Returns the measurement outcomes.
+        """
+        logging.debug("VIRTUAL NODE %s: Bell measurement of %d and %d", self.node.name, self.num, targetNum)
+        return self._run("measure_bell_inplace", targetNum)
 
     def remote_cnot_onto(self, targetNum):
         """
@@ -212,8 +230,7 @@ class simulatedQubit(pb.Referenceable):
         """
 
         logging.debug("VIRTUAL NODE %s: CNOT from %d to %d", self.node.name, self.num, targetNum)
-        self._apply_random_pauli_noise()
-        self.register.apply_CNOT(self.num, targetNum)
+        return self._run("apply_CNOT", targetNum)
 
     def remote_cphase_onto(self, targetNum):
         """
@@ -222,8 +239,16 @@ class simulatedQubit(pb.Referenceable):
         Arguments
         targetNum    the qubit to use as the target of the CPHASE
         """
-        self._apply_random_pauli_noise()
-        self.register.apply_CPHASE(self.num, targetNum)
+        return self._run("apply_CPHASE", targetNum)
+
+    def remote_merge_with(self, targetNum):
+        """
+        Does nothing. Used as two qubit gate to bring this qubit and the target qubit into the same register.
+
+        Arguments
+        targetNum    the qubit to share the register with
+        """
+        pass
 
     def remote_get_sim_number(self):
         """
@@ -241,13 +266,15 @@ class simulatedQubit(pb.Referenceable):
         """
         Returns the register where this qubit is simulated.
         """
+        # Once handed out, the engine of the register cannot be reused for another register
+        self.node.root.pooledRegs.discard(self.register.num)
         return self.register
 
     def remote_get_register_RI(self):
         """
         Returns the register where this qubit is simulated.
         """
-        return self.register.get_register_RI()
+        return self.node.root.run_on_register(self.register, self.register.get_register_RI)
 
     def remote_get_numbers(self):
         """
@@ -263,7 +290,7 @@ class simulatedQubit(pb.Referenceable):
         if backend != "qutip":
             raise RuntimeError("Cannot get reduced qubit state using backend {}".format(backend))
         logging.debug("VIRTUAL NODE %s: Returning qubit %d", self.node.name, self.num)
-        return self.register.get_qubits_RI([self.num])
+        return self.node.root.run_on_register(self.register, self.register.get_qubits_RI, [self.num])
 
     def remote_get_details(self):
         """
@@ -271,23 +298,25 @@ class simulatedQubit(pb.Referenceable):
         """
         return (self.simNum, self.node.name)
 
-    def _apply_random_pauli_noise(self):
+    def _apply_random_pauli_noise(self, register=None, num=None):
         """
-        Applies random pauli gate if required
+        Applies random pauli gate if required, to the qubit num of register, by default this one
         """
         if not self.noisy:
             return
             # Assumes qubit is locked and active
+        if register is None:
+            register, num = self.register, self.num
         t = time.time() - self.last_accessed
         self.last_accessed = time.time()
         p = (1 - np.exp(-t / self.T1)) / 4
         x = random.random()
         if x < p:
-            logging.debug("VIRTUAL NODE %s: random pauli X applied on %d", self.node.name, self.num)
-            self.register.apply_X(self.num)
+            logging.debug("VIRTUAL NODE %s: random pauli X applied on %d", self.node.name, num)
+            register.apply_X(num)
         elif x < 2 * p:
-            logging.debug("VIRTUAL NODE %s: random pauli Y applied on %d", self.node.name, self.num)
-            self.register.apply_Y(self.num)
+            logging.debug("VIRTUAL NODE %s: random pauli Y applied on %d", self.node.name, num)
+            register.apply_Y(num)
         elif x < 3 * p:
-            logging.debug("VIRTUAL NODE %s: random pauli Z applied on %d", self.node.name, self.num)
-            self.register.apply_Z(self.num)
+            logging.debug("VIRTUAL NODE %s: random pauli Z applied on %d", self.node.name, num)
+            register.apply_Z(num)
@@ -59,6 +59,23 @@ class qutipEngine(quantumEngine):
         self.activeQubits = 0
         self.qubitReg = qp.Qobj()
 
+        # Qubits which were correlated with measured qubits, and so may have come apart from the rest
+        self.disturbed = set()
+
+    def _keep_disturbed(self, keepList):
+        """
+        Renumbers the disturbed qubits after only the qubits keepList, in increasing order, remain.
+        """
+        self.disturbed = {i for i, j in enumerate(keepList) if j in self.disturbed}
+
+    def _disturb(self, qubitNums):
+        """
+        Marks the measured qubits qubitNums, and the qubits correlated with them, as disturbed. Must be called
+        before the measurement, which destroys the correlations.
+        """
+        self.disturbed.update(qubitNums)
+        self.disturbed.update(self.correlated_with(qubitNums))
+
     def add_fresh_qubit(self):
         """
         Add a new qubit initialized in the \|0\> state.
@@ -71,6 +88,57 @@ class qutipEngine(quantumEngine):
         num = self.add_qubit(newQubit)
         return num
 
+    def add_fresh_qubits(self, n):
+        """
+        Add n new qubits initialized in the \|0\> state, using a single tensor product with the register.
+        """
+
+        # Check if we are still allowed to add qubits
+        if self.activeQubits + n > self.maxQubits:
+            raise noQubitError("No more qubits available in register.")
+
+        if n == 0:
+            return []
+
+        # Prepare n clean qubits in |0...0>
+        v = qp.basis(2, 0)
+        newQubits = qp.tensor([v * v.dag()] * n)
+
+        # Append to the existing state at the end
+        if self.activeQubits > 0:
+            self.qubitReg = qp.tensor(self.qubitReg, newQubits)
+        else:
+            self.qubitReg = newQubits
+
+        nums = list(range(self.activeQubits, self.activeQubits + n))
+        self.activeQubits = self.activeQubits + n
+
+        return nums
+
+    def add_epr_pair(self):
+        """
+        Add two new qubits in the Bell state (\|00\> + \|11\>)/sqrt(2), using a single tensor product with the register.
+        """
+
+        # Check if we are still allowed to add qubits
+        if self.activeQubits + 2 > self.maxQubits:
+            raise noQubitError("No more qubits available in register.")
+
+        # Prepare the Bell pair directly
+        v = (qp.tensor(qp.basis(2, 0), qp.basis(2, 0)) + qp.tensor(qp.basis(2, 1), qp.basis(2, 1))).unit()
+        newQubits = v * v.dag()
+
+        # Append to the existing state at the end
+        if self.activeQubits > 0:
+            self.qubitReg = qp.tensor(self.qubitReg, newQubits)
+        else:
+            self.qubitReg = newQubits
+
+        num1 = self.activeQubits
+        self.activeQubits = self.activeQubits + 2
+
+        return num1, num1 + 1
+
     def add_qubit(self, newQubit):
         """
         Add new qubit in the state described by the density matrix newQubit
@@ -105,6 +173,7 @@ class qutipEngine(quantumEngine):
         if self.activeQubits == 1:
             self.activeQubits = 0
             self.qubitReg = qp.Qobj()
+            self.disturbed = set()
             return
 
         # Compute the list of qubits to keep
@@ -115,10 +184,36 @@ class qutipEngine(quantumEngine):
 
         # Trace out this qubit by taking the partial trace
         self.qubitReg = self.qubitReg.ptrace(keepList)
+        self._keep_disturbed(keepList)
 
         # Update the number of qubits
         self.activeQubits = self.activeQubits - 1
 
+    def remove_qubits(self, qubitNums):
+        """
+        Removes the qubits with the desired numbers qubitNums, using a single partial trace
+        """
+        for qubitNum in qubitNums:
+            if (qubitNum + 1) > self.activeQubits:
+                raise quantumError("No such qubit to remove")
+
+        # Compute the list of qubits to keep
+        keepList = [j for j in range(self.activeQubits) if j not in qubitNums]
+
+        # Check if these are all the qubits
+        if not keepList:
+            self.activeQubits = 0
+            self.qubitReg = qp.Qobj()
+            self.disturbed = set()
+            return
+
+        # Trace out these qubits by taking the partial trace
+        self.qubitReg = self.qubitReg.ptrace(keepList)
+        self._keep_disturbed(keepList)
+
+        # Update the number of qubits
+        self.activeQubits = len(keepList)
+
     def get_qubits_RI(self, qList):
         """
         Retrieves the qubits in the list and returns the result as a list divided into
@@ -144,6 +239,13 @@ class qutipEngine(quantumEngine):
 
         return (Re, Im)
 
+    def get_register_arrays(self):
+        """
+        Retrieves the entire register in real and imaginary parts as numpy arrays.
+        """
+        M = self.qubitReg.full()
+        return M.real, M.imag
+
     def apply_H(self, qubitNum):
         """
         Applies a Hadamard gate to the qubits with number qubitNum.
@@ -313,6 +415,64 @@ class qutipEngine(quantumEngine):
         # Apply the  unitary
         self.qubitReg = overallU * self.qubitReg * overallU.dag()
 
+    # Gates that may appear in circuits
+    _s = 1 / math.sqrt(2)
+    circuitGates = {
+        "X": np.array([[0, 1], [1, 0]]),
+        "Y": np.array([[0, -1j], [1j, 0]]),
+        "Z": np.array([[1, 0], [0, -1]]),
+        "H": np.array([[_s, _s], [_s, -_s]]),
+        "K": np.array([[_s, -1j * _s], [1j * _s, -_s]]),
+        "T": np.array([[1, 0], [0, cmath.exp(1j * math.pi / 4)]]),
+        "inverse_T": np.array([[1, 0], [0, cmath.exp(-1j * math.pi / 4)]]),
+        "CNOT": np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]]),
+        "CPHASE": np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, -1]]),
+    }
+
+    # Unitaries of the circuits compiled so far, shared by all registers
+    _compiledCircuits = {}
+
+    @staticmethod
+    def _apply_on_axes(U, T, axes):
+        """
+        Multiplies the tensor T with the unitary U acting on the given axes, each axis being one qubit.
+        """
+        k = len(axes)
+        U = U.reshape([2] * (2 * k))
+        T = np.tensordot(U, T, axes=(list(range(k, 2 * k)), list(axes)))
+        return np.moveaxis(T, list(range(k)), list(axes))
+
+    def compile_circuit(self, circuit, n):
+        """
+        Returns the unitary of the circuit on n qubits, computing it only the first time.
+        """
+        key = (circuit, n)
+        if key not in self._compiledCircuits:
+            U = np.eye(2 ** n, dtype=complex).reshape([2] * (2 * n))
+            for gate in circuit:
+                U = self._apply_on_axes(self.circuitGates[gate[0]], U, gate[1:])
+            self._compiledCircuits[key] = U.reshape(2 ** n, 2 ** n)
+        return self._compiledCircuits[key]
+
+    def apply_circuit(self, circuit, qubitNums):
+        """
+        Applies the circuit to the qubits with numbers qubitNums as a single precompiled unitary.
+        """
+        for qubitNum in qubitNums:
+            if (qubitNum + 1) > self.activeQubits:
+                raise quantumError("No such qubit to apply the circuit to.")
+
+        U = self.compile_circuit(circuit, len(qubitNums))
+
+        # Apply U from the left on the row indices and U^dagger from the right on the column indices
+        n = self.activeQubits
+        rho = self.qubitReg.full().reshape([2] * (2 * n))
+        rho = self._apply_on_axes(U, rho, qubitNums)
+        rho = self._apply_on_axes(U.conj(), rho, [n + qubitNum for qubitNum in qubitNums])
+
+        dimL = [2] * n
+        self.qubitReg = qp.Qobj(rho.reshape(2 ** n, 2 ** n), dims=[dimL, dimL])
+
     def measure_qubit_inplace(self, qubitNum):
         """
         Measures the desired qubit in the standard basis. This returns the classical outcome. The quantum register
@@ -340,6 +500,7 @@ class qutipEngine(quantumEngine):
         p0 = obj.tr().real
         obj = M1 * self.qubitReg
         p1 = obj.tr().real
+        self._disturb([qubitNum])
 
         # Sample the measurement outcome from these probabilities
         outcome = int(np.random.choice([0, 1], 1, p=[p0, p1]))
@@ -353,6 +514,112 @@ class qutipEngine(quantumEngine):
         # return measurement outcome
         return outcome
 
+    def measure_bell_inplace(self, qubitNum1, qubitNum2):
+        """
+        Measures the two qubits in the Bell basis. This returns the classical outcomes (x, y). The two qubits are left
+        in the state \|x,y\> corresponding to the obtained outcomes.
+
+        Arguments:
+        qubitNum1	first qubit to be measured
+        qubitNum2	second qubit to be measured
+        """
+
+        # Check we have such qubits...
+        if (max(qubitNum1, qubitNum2) + 1) > self.activeQubits:
+            raise quantumError("No such qubit to be measured.")
+
+        self._disturb(sorted([qubitNum1, qubitNum2]))
+
+        # Rotate the Bell basis onto the standard basis in one step, (H x I) * CNOT
+        s = 1 / math.sqrt(2)
+        bellU = qp.Qobj([[s, 0, 0, s], [0, s, s, 0], [s, 0, 0, -s], [0, s, -s, 0]], dims=[[2, 2], [2, 2]])
+        self.apply_twoqubit_gate(bellU, qubitNum1, qubitNum2)
+
+        # Compute the outcome probabilities from the reduced state of the two qubits, ptrace orders them ascending
+        probs = np.real(self.qubitReg.ptrace(sorted([qubitNum1, qubitNum2])).diag())
+        probs = np.clip(probs, 0, None)
+        k = int(np.random.choice(4, 1, p=probs / probs.sum()))
+        if qubitNum1 < qubitNum2:
+            x, y = k // 2, k % 2
+        else:
+            x, y = k % 2, k // 2
+
+        # Compute the post-measurement state
+        v = qp.tensor(qp.basis(2, x), qp.basis(2, y))
+        M = qp.gate_expand_2toN(v * v.dag(), self.activeQubits, qubitNum1, qubitNum2)
+        M.dims = self.qubitReg.dims
+        self.qubitReg = M * self.qubitReg * M.dag() / probs[k]
+
+        # return measurement outcomes
+        return x, y
+
+    def measure_pauli(self, pauli, qubitNums):
+        """
+        Measures the Pauli operator given as a string such as "XZZXI" on the qubits qubitNums. This returns the
+        classical outcome, 0 for eigenvalue +1 and 1 for eigenvalue -1, and projects the register accordingly.
+
+        Arguments:
+        pauli		Pauli operator, one letter per qubit in qubitNums
+        qubitNums	qubits the operator acts on
+        """
+        return self.measure_paulis([pauli], qubitNums)[0]
+
+    def measure_paulis(self, paulis, qubitNums):
+        """
+        Measures the commuting Pauli operators paulis one after the other on the qubits qubitNums, projecting the
+        density matrix in place and building the register state only once at the end. Returns the outcomes.
+
+        Arguments:
+        paulis		Pauli operators, one letter per qubit in qubitNums each
+        qubitNums	qubits the operators act on
+        """
+        for qubitNum in qubitNums:
+            if (qubitNum + 1) > self.activeQubits:
+                raise quantumError("No such qubit to be measured.")
+
+        measured = sorted({qubitNum for pauli in paulis for p, qubitNum in zip(pauli, qubitNums) if p != "I"})
+        if not measured:
+            return [0] * len(paulis)
+        self._disturb(measured)
+
+        n = self.activeQubits
+        rho = self.qubitReg.full().reshape([2] * (2 * n))
+        outcomes = []
+        for pauli in paulis:
+            support = [(self.circuitGates[p], qubitNum) for p, qubitNum in zip(pauli, qubitNums) if p != "I"]
+            rho, outcome = self._project_pauli(rho, support, n) if support else (rho, 0)
+            outcomes.append(outcome)
+
+        dimL = [2] * n
+        self.qubitReg = qp.Qobj(rho.reshape(2 ** n, 2 ** n), dims=[dimL, dimL])
+
+        return outcomes
+
+    def _project_pauli(self, rho, support, n):
+        """
+        Samples the outcome of measuring the Pauli operator given by support, pairs of gate and qubit, on the density
+        matrix rho of n qubits, given as a tensor with one axis per qubit. Returns the projected rho and the outcome.
+        """
+        # Compute P rho, rho P and P rho P, one qubit at a time
+        left = rho
+        right = rho
+        for P, qubitNum in support:
+            left = self._apply_on_axes(P, left, [qubitNum])
+            right = self._apply_on_axes(P.conj(), right, [n + qubitNum])
+        both = left
+        for P, qubitNum in support:
+            both = self._apply_on_axes(P.conj(), both, [n + qubitNum])
+
+        # Sample the outcome from the expectation value of P
+        expP = np.real(np.trace(left.reshape(2 ** n, 2 ** n)))
+        p0 = min(max((1 + expP) / 2, 0), 1)
+        outcome = int(np.random.choice([0, 1], 1, p=[p0, 1 - p0]))
+        sign = 1 - 2 * outcome
+        prob = p0 if outcome == 0 else 1 - p0
+
+        # Post-measurement state (1 + sign P) rho (1 + sign P) / 4 prob
+        return (rho + sign * left + sign * right + both) / (4 * prob), outcome
+
     def measure_qubit(self, qubitNum):
         """
         Measures the desired qubit in the standard basis. This returns the classical outcome and deletes the qubit.
@@ -398,6 +665,7 @@ class qutipEngine(quantumEngine):
         elif other.activeQubits != 0:
             self.qubitReg = qp.tensor(self.qubitReg, other.qubitReg)
 
+        self.disturbed.update(self.activeQubits + j for j in other.disturbed)
         self.activeQubits = newNum
 
     def absorb_parts(self, R, I, activeQ):
@@ -409,20 +677,22 @@ class qutipEngine(quantumEngine):
         I		imaginary part as a list
         activeQ		active number of qubits
         """
+        self.absorb_arrays(np.array(R), np.array(I), activeQ)
 
-        # Convert the real and imaginary parts given as lists into a qutip object
-        M = I
-        for s in range(len(I)):
-            for t in range(len(I)):
-                M[s][t] = R[s][t] + I[s][t] * 1j
-
-        qt = qp.Qobj(M)
+    def absorb_arrays(self, R, I, activeQ):
+        """
+        Absorb the qubits, given in pieces as numpy arrays. The arrays are only read, so they may be views into
+        shared memory.
+        """
 
         # Check whether there is space
         newNum = self.activeQubits + activeQ
         if newNum > self.maxQubits:
             raise quantumError("Cannot merge: qubits exceed the maximum available.\n")
 
+        # Combining the real and imaginary parts makes the only copy of the state
+        qt = qp.Qobj(R + 1j * I)
+
         # Check whether there are in fact qubits to tensor up....
         if self.activeQubits == 0:
             self.qubitReg = qt
@@ -439,3 +709,127 @@ class qutipEngine(quantumEngine):
             dimL.append(2)
 
         self.qubitReg.dims = [dimL, dimL]
+
+    # Largest deviation of the density matrix from a tensor product that is still taken to be a tensor product
+    _factorTolerance = 1e-9
+
+    def _is_factor(self, qubitNums):
+        """
+        Checks whether the qubits qubitNums, in increasing order, are in a tensor product with the rest of the register.
+        """
+        rest = [j for j in range(self.activeQubits) if j not in qubitNums]
+        if not rest:
+            return True
+
+        product = qp.tensor(self.qubitReg.ptrace(qubitNums), self.qubitReg.ptrace(rest))
+        product = product.permute([int(j) for j in np.argsort(list(qubitNums) + rest)])
+        return np.abs(product.full() - self.qubitReg.full()).max() < self._factorTolerance
+
+    def _correlated(self, j, k, singles):
+        """
+        Checks whether the two qubit reduced state of the qubits j and k is not a product, given the single qubit
+        reduced states singles.
+        """
+        pair = self.qubitReg.ptrace([j, k]).full()
+        return np.abs(pair - qp.tensor(singles[j], singles[k]).full()).max() >= self._factorTolerance
+
+    def correlated_with(self, qubitNums):
+        """
+        Returns the other qubits whose two qubit reduced state with one of the qubits qubitNums is not a product.
+        Only these can come apart from the rest of the register once qubitNums are removed.
+        """
+        rest = [j for j in range(self.activeQubits) if j not in qubitNums]
+        singles = {j: self.qubitReg.ptrace([j]) for j in list(qubitNums) + rest}
+        return [j for j in rest if any(self._correlated(r, j, singles) for r in qubitNums)]
+
+    def find_factors(self, candidates=None):
+        """
+        Looks for parts of the register that are in a tensor product with the rest. Qubits with correlations between
+        them are first put in the same part, after which each part is checked against the rest of the register.
+        Given candidates, only these and the qubits disturbed by measurements since the last call are compared
+        pairwise, and the other qubits stay together in one part.
+        :return: Partition of the qubit numbers
+        :rtype: list of list of int
+        """
+        n = self.activeQubits
+        if candidates is None:
+            candidates = list(range(n))
+        else:
+            candidates = sorted(set(candidates) | {j for j in self.disturbed if j < n})
+        self.disturbed = set()
+        if n <= 1 or not candidates:
+            return [list(range(n))]
+
+        # Join qubits whose two qubit reduced state is not a product, using a union find over the qubits
+        singles = {j: self.qubitReg.ptrace([j]) for j in candidates}
+        parent = list(range(n))
+        others = [j for j in range(n) if j not in candidates]
+        for j in others[1:]:
+            parent[j] = others[0]
+
+        def root(j):
+            while parent[j] != j:
+                j = parent[j]
+            return j
+
+        for a, j in enumerate(candidates):
+            for k in candidates[a + 1:]:
+                if root(j) != root(k) and self._correlated(j, k, singles):
+                    parent[root(k)] = root(j)
+
+        parts = {}
+        for j in range(n):
+            parts.setdefault(root(j), []).append(j)
+        parts = list(parts.values())
+        if len(parts) == 1:
+            return parts
+
+        # Qubits without pairwise correlations can still be entangled, so the parts failing the check stay together
+        factors = [part for part in parts if self._is_factor(part)]
+        rest = sorted(j for part in parts if part not in factors for j in part)
+        return ([rest] if rest else []) + factors
+
+    def split_off(self, qubitNums, other):
+        """
+        Moves the qubits qubitNums, which must be in a tensor product with the rest of the register, to the end
+        of the register other. The qubits keep their order.
+
+        Arguments:
+        qubitNums	qubits to move, in increasing order
+        other		register to move them to
+        """
+        keepList = [j for j in range(self.activeQubits) if j not in qubitNums]
+        if not keepList:
+            raise quantumError("Cannot split off all qubits of the register.")
+        if other.activeQubits + len(qubitNums) > other.maxQubits:
+            raise quantumError("Cannot split: qubits exceed the maximum available.")
+
+        part = self.qubitReg.ptrace(list(qubitNums))
+        self.qubitReg = self.qubitReg.ptrace(keepList)
+        self.activeQubits = len(keepList)
+        self._keep_disturbed(keepList)
+
+        if other.activeQubits == 0:
+            other.qubitReg = part
+        else:
+            other.qubitReg = qp.tensor(other.qubitReg, part)
+        other.activeQubits += len(qubitNums)
+
+    def permute_qubits(self, order):
+        """
+        Reorders the qubits of the register, such that qubit order[i] becomes qubit i.
+
+        Arguments:
+        order		list of all qubit numbers in their new order
+        """
+        if list(order) != list(range(self.activeQubits)):
+            self.qubitReg = self.qubitReg.permute(list(order))
+            self.disturbed = {i for i, j in enumerate(order) if j in self.disturbed}
+
+    def reset(self):
+        """
+        Removes all qubits, leaving an empty register whose engine can be reused for a new register.
+        """
+        self.activeQubits = 0
+        self.qubitReg = qp.Qobj()
+        self.disturbed = set()
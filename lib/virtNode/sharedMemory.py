@@ -0,0 +1,99 @@
+"""
+Handing over numpy arrays, such as the state of a register, between processes on the same host through blocks of
+shared memory. Only the name of the block and the layout of the arrays in it need to be sent.
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+def to_shared(arrays, track=True):
+    """
+    Copies the numpy arrays, which may be None, into a new block of shared memory. Returns the block together with
+    the layout of the arrays in it.
+
+    Arguments
+    arrays		arrays to copy
+    track		whether the resource tracker of this process frees the block if nobody else does. Leave this off
+                        for blocks handed to processes that do not share the resource tracker, which free the block.
+    """
+    size = sum(a.nbytes for a in arrays if a is not None)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    if not track:
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+    layout = []
+    offset = 0
+    for a in arrays:
+        if a is None:
+            layout.append(None)
+            continue
+        view = np.ndarray(a.shape, a.dtype, buffer=shm.buf, offset=offset)
+        view[...] = a
+        del view
+        layout.append((a.shape, a.dtype.str, offset))
+        offset += a.nbytes
+    return shm, layout
+
+
+def use_shared(name, layout, func, unlink=False):
+    """
+    Maps the arrays with the given layout in the block of shared memory name, without copying them, and returns
+    func called with the arrays. The arrays are only valid during the call. If unlink is True, the block is freed
+    afterwards.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return use_block(shm, layout, func)
+    finally:
+        if unlink:
+            shm.unlink()
+
+
+def use_block(shm, layout, func):
+    """
+    Like use_shared, for the block shm which is already open. The block is closed afterwards.
+    """
+    views = []
+    for entry in layout:
+        if entry is None:
+            views.append(None)
+        else:
+            shape, dtype, offset = entry
+            views.append(np.ndarray(shape, dtype, buffer=shm.buf, offset=offset))
+    try:
+        return func(*views)
+    finally:
+        del views
+        shm.close()
+
+
+def take_shared(name):
+    """
+    Opens the block of shared memory name and frees its name right away. The block stays mapped in this process
+    until it is closed, and goes away then, so nobody else has to free it once it was taken.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    shm.unlink()
+    return shm
+
+
+def free_shared(name):
+    """
+    Frees the block of shared memory name, unless it was freed or taken already.
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def from_shared(name, layout, unlink=False):
+    """
+    Returns copies of the arrays with the given layout in the block of shared memory name. If unlink is True, the
+    block is freed afterwards.
+    """
+    return use_shared(name, layout, lambda *views: [None if v is None else np.array(v) for v in views], unlink)
@@ -27,6 +27,10 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import random
+
+import numpy as np
+
 from simulaqron.virtNode.basics import quantumEngine, quantumError, noQubitError
 from simulaqron.toolbox.stabilizerStates import StabilizerState
 
@@ -67,6 +71,39 @@ class stabilizerEngine(quantumEngine):
 
         return num
 
+    def add_fresh_qubits(self, n):
+        """
+        Add n new qubits initialized in the \|0\> state, using a single tensor product with the register.
+        """
+        # Check if we are still allowed to add qubits
+        if self.activeQubits + n > self.maxQubits:
+            raise noQubitError("No more qubits available in register.")
+
+        if n == 0:
+            return []
+
+        nums = list(range(self.activeQubits, self.activeQubits + n))
+
+        # Prepare n clean qubits in |0...0>
+        self.qubitReg = self.qubitReg.tensor_product(StabilizerState(n))
+
+        return nums
+
+    def add_epr_pair(self):
+        """
+        Add two new qubits in the Bell state (\|00\> + \|11\>)/sqrt(2), using a single tensor product with the register.
+        """
+        # Check if we are still allowed to add qubits
+        if self.activeQubits + 2 > self.maxQubits:
+            raise noQubitError("No more qubits available in register.")
+
+        num1 = self.activeQubits
+
+        # Prepare the Bell pair directly from its stabilizer generators
+        self.qubitReg = self.qubitReg.tensor_product(StabilizerState(["XX", "ZZ"]))
+
+        return num1, num1 + 1
+
     def add_qubit(self, newQubit):
         """
         Add new qubit in the state described by the array containing the generators of the stabilizer group.
@@ -107,6 +144,12 @@ class stabilizerEngine(quantumEngine):
 
         return Re, Im
 
+    def get_register_arrays(self):
+        """
+        Retrieves the boolean matrix describing the generators as a numpy array, with None as imaginary part.
+        """
+        return self.qubitReg.to_array(), None
+
     def apply_H(self, qubitNum):
         """
         Applies a Hadamard gate to the qubits with number qubitNum.
@@ -224,6 +267,105 @@ class stabilizerEngine(quantumEngine):
 
         return outcome
 
+    @staticmethod
+    def _multiply_rows(row1, row2, n):
+        """
+        Returns the product of the two commuting generators, given as rows of X part, Z part and phase.
+        """
+        x1, z1, x2, z2 = (np.array(a, dtype=int) for a in (row1[:n], row1[n:-1], row2[:n], row2[n:-1]))
+        # Powers of i picked up per qubit, as in Aaronson and Gottesman
+        g = x1 * z1 * (z2 - x2) + x1 * (1 - z1) * z2 * (2 * x2 - 1) + (1 - x1) * z1 * x2 * (1 - 2 * z2)
+        phase = (2 * int(row1[-1]) + 2 * int(row2[-1]) + int(g.sum())) % 4
+        return np.concatenate((np.logical_xor(row1[:-1], row2[:-1]), [phase == 2]))
+
+    def measure_pauli(self, pauli, qubitNums):
+        """
+        Measures the Pauli operator given as a string such as "XZZXI" on the qubits qubitNums, by updating the
+        generators of the stabilizer group directly.
+
+        Arguments:
+        pauli		Pauli operator, one letter per qubit in qubitNums
+        qubitNums	qubits the operator acts on
+        :return: The measurement outcome, 0 for eigenvalue +1 and 1 for eigenvalue -1
+        :rtype: int
+        """
+        return self.measure_paulis([pauli], qubitNums)[0]
+
+    def measure_paulis(self, paulis, qubitNums):
+        """
+        Measures the commuting Pauli operators paulis one after the other on the qubits qubitNums, updating one copy
+        of the generators and building the register state only once at the end.
+
+        Arguments:
+        paulis		Pauli operators, one letter per qubit in qubitNums each
+        qubitNums	qubits the operators act on
+        :return: The measurement outcomes, 0 for eigenvalue +1 and 1 for eigenvalue -1
+        :rtype: list of int
+        """
+        n = self.activeQubits
+        for qubitNum in qubitNums:
+            if (qubitNum + 1) > n:
+                raise quantumError("No such qubit to be measured.")
+
+        group = self.qubitReg.to_array()
+        outcomes = []
+        changed = False
+        for pauli in paulis:
+            observable = np.zeros(2 * n + 1, dtype=bool)
+            for p, qubitNum in zip(pauli, qubitNums):
+                observable[qubitNum], observable[qubitNum + n] = StabilizerState.Pauli2bool[p]
+            outcome, replaced = self._measure_generators(group, observable, n)
+            outcomes.append(outcome)
+            changed = changed or replaced
+
+        if changed:
+            self.qubitReg = StabilizerState(group, check_symplectic=False)
+        return outcomes
+
+    def _measure_generators(self, group, observable, n):
+        """
+        Measures the observable, a row of X part, Z part and phase, on the generators group of n qubits, which are
+        updated in place. Returns the outcome and whether the generators changed.
+        """
+        anticommuting = [
+            i
+            for i, row in enumerate(group)
+            if (np.sum(row[:n] & observable[n:-1]) + np.sum(row[n:-1] & observable[:n])) % 2
+        ]
+
+        if anticommuting:
+            # Random outcome, the observable replaces one of the generators not commuting with it
+            first = anticommuting[0]
+            for i in anticommuting[1:]:
+                group[i] = self._multiply_rows(group[i], group[first], n)
+            outcome = random.randint(0, 1)
+            observable[-1] = outcome
+            group[first] = observable
+            return outcome, True
+
+        # The observable is, up to its sign, a product of generators, which gives the outcome
+        # Solve for the generators giving the observable by eliminating over GF(2), keeping track of the combinations
+        rows = [(np.array(row[:-1]), np.arange(n) == i) for i, row in enumerate(group)]
+        target = np.array(observable[:-1])
+        combination = np.zeros(n, dtype=bool)
+        for column in range(2 * n):
+            pivots = [k for k, (row, _) in enumerate(rows) if row[column]]
+            if not pivots:
+                continue
+            pivotRow, pivotComb = rows.pop(pivots[0])
+            rows = [
+                (np.logical_xor(row, pivotRow), np.logical_xor(comb, pivotComb)) if row[column] else (row, comb)
+                for row, comb in rows
+            ]
+            if target[column]:
+                target = np.logical_xor(target, pivotRow)
+                combination = np.logical_xor(combination, pivotComb)
+
+        product = np.zeros(2 * n + 1, dtype=bool)
+        for i in np.nonzero(combination)[0]:
+            product = self._multiply_rows(product, group[i], n)
+        return int(product[-1]), False
+
     def replace_qubit(self, qubitNum, state):
         """
         Replaces the qubit at position qubitNum with the one given by state.
@@ -257,3 +399,106 @@ class stabilizerEngine(quantumEngine):
             raise quantumError("Cannot merge: qubits exceed the maximum available.\n")
 
         self.qubitReg = self.qubitReg.tensor_product(StabilizerState(R))
+
+    def absorb_arrays(self, R, I, activeQ):
+        """
+        Absorb the qubits, given as the numpy array describing the stabilizer state, which is copied.
+        """
+        self.absorb_parts(np.array(R), I, activeQ)
+
+    def _echelon(self, group, columns):
+        """
+        Brings the generators into echelon form over the given columns of the generator matrix, keeping track of the
+        phases. Returns the generators and the number of them with support on these columns, which come first.
+        """
+        n = self.activeQubits
+        group = np.array(group, dtype=bool)
+        h = 0
+        for column in columns:
+            rows = [i for i in range(h, len(group)) if group[i, column]]
+            if not rows:
+                continue
+            group[[h, rows[0]]] = group[[rows[0], h]]
+            for i in range(len(group)):
+                if i != h and group[i, column]:
+                    group[i] = self._multiply_rows(group[i], group[h], n)
+            h += 1
+        return group, h
+
+    def find_factors(self, candidates=None):
+        """
+        Looks for parts of the register that are in a tensor product with the rest. With the generators in echelon
+        form, qubits in the support of the same generator are put in the same part. Each part then has as many
+        generators as qubits, which makes the state a tensor product over the parts. This is cheap, so candidates
+        are not needed.
+        :return: Partition of the qubit numbers
+        :rtype: list of list of int
+        """
+        n = self.activeQubits
+        group, _ = self._echelon(self.qubitReg.to_array(), range(2 * n))
+
+        # Union find over the qubits
+        parent = list(range(n))
+
+        def root(j):
+            while parent[j] != j:
+                j = parent[j]
+            return j
+
+        for row in group:
+            support = [j for j in range(n) if row[j] or row[j + n]]
+            for j in support[1:]:
+                parent[root(j)] = root(support[0])
+
+        parts = {}
+        for j in range(n):
+            parts.setdefault(root(j), []).append(j)
+        return list(parts.values())
+
+    def split_off(self, qubitNums, other):
+        """
+        Moves the qubits qubitNums, which must be in a tensor product with the rest of the register, to the end
+        of the register other. The qubits keep their order.
+
+        Arguments:
+        qubitNums	qubits to move, in increasing order
+        other		register to move them to
+        """
+        n = self.activeQubits
+        keepList = [j for j in range(n) if j not in qubitNums]
+        if not keepList:
+            raise quantumError("Cannot split off all qubits of the register.")
+        if other.activeQubits + len(qubitNums) > other.maxQubits:
+            raise quantumError("Cannot split: qubits exceed the maximum available.")
+
+        moveColumns = list(qubitNums) + [j + n for j in qubitNums]
+        keepColumns = keepList + [j + n for j in keepList]
+
+        # The generators without support on the other qubits describe the state of each part
+        group = self.qubitReg.to_array()
+        part, h = self._echelon(group, keepColumns)
+        if n - h != len(qubitNums):
+            raise quantumError("Cannot split: the qubits are entangled with the rest of the register.")
+        part = part[h:][:, moveColumns + [2 * n]]
+        rest, h = self._echelon(group, moveColumns)
+        rest = rest[h:][:, keepColumns + [2 * n]]
+
+        self.qubitReg = StabilizerState(rest)
+        other.qubitReg = other.qubitReg.tensor_product(StabilizerState(part))
+
+    def permute_qubits(self, order):
+        """
+        Reorders the qubits of the register, such that qubit order[i] becomes qubit i.
+
+        Arguments:
+        order		list of all qubit numbers in their new order
+        """
+        n = self.activeQubits
+        columns = list(order) + [j + n for j in order] + [2 * n]
+        self.qubitReg = StabilizerState(self.qubitReg.to_array()[:, columns])
+
+    def reset(self):
+        """
+        Removes all qubits, leaving an empty register whose engine can be reused for a new register.
+        """
+        self.qubitReg = StabilizerState()
@@ -27,25 +27,36 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import errno
+import json
 import logging
+import os
 import random
+import socket
+import tempfile
+import weakref
 
 from collections import deque
 
 from twisted.spread import pb
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, DeferredLock, Deferred, DeferredList
-from twisted.internet.task import deferLater
-from twisted.internet.error import ConnectionRefusedError, CannotListenError
+from twisted.internet.defer import inlineCallbacks, DeferredLock, Deferred, DeferredList, succeed
+from twisted.internet.task import deferLater, LoopingCall
+from twisted.internet.threads import deferToThread
+from twisted.internet.error import ConnectionRefusedError, CannotListenError, ConnectError
 from twisted.spread.pb import RemoteError
 
 from simulaqron.virtNode.basics import quantumError, noQubitError, virtNetError
 from simulaqron.virtNode.quantum import simulatedQubit
+from simulaqron.virtNode.qecCodes import get_code
+from simulaqron.virtNode.processSimulator import registerWorkers, processEngine
+from simulaqron.virtNode.sharedMemory import to_shared, use_block, take_shared, free_shared
 from simulaqron.general.hostConfig import socketsConfig
 from simulaqron.settings import simulaqron_settings
 
 if simulaqron_settings.backend == "qutip":
     from simulaqron.virtNode.qutipSimulator import qutipEngine
+    from simulaqron.virtNode.factoredSimulator import factoredEngine
 elif simulaqron_settings.backend == "projectq":
     from simulaqron.virtNode.projectQSimulator import projectQEngine
 elif simulaqron_settings.backend == "stabilizer":
@@ -54,6 +65,42 @@ else:
     raise quantumError("Unknown backend {}".format(simulaqron_settings.backend))
 
 
+def unix_socket_path(port):
+    """
+    Returns the path of the UNIX domain socket of the virtual node listening on the given port of this host.
+    """
+    return os.path.join(tempfile.gettempdir(), "simulaqron_vnode_{}.sock".format(port))
+
+
+def _read_network(virtualFile, network_name="default"):
+    """
+    Returns the settings of the network in the configuration file, or an empty dictionary for .cfg files.
+    """
+    if not virtualFile.endswith(".json"):
+        return {}
+    with open(virtualFile) as confFile:
+        return json.load(confFile).get(network_name or "default", {})
+
+
+def read_transport(virtualFile, network_name="default"):
+    """
+    Returns the transport set for the network in the configuration file: "unix" to connect nodes on the same host
+    through UNIX domain sockets, or "tcp" (the default) to always use TCP. Only json configuration files can set it.
+    """
+    transport = _read_network(virtualFile, network_name).get("transport", "tcp")
+    if transport not in ["tcp", "unix"]:
+        raise ValueError("Transport needs to be either 'tcp' or 'unix'")
+    return transport
+
+
+def read_topology(virtualFile, network_name="default"):
+    """
+    Returns the topology of the network in the configuration file, as a dictionary of the neighbours of each node,
+    or None if the network is fully connected. Only json configuration files can set it.
+    """
+    return _read_network(virtualFile, network_name).get("topology")
+
+
 ######
 #
 # backEnd - starts the local virtual node and connects to the other virtual nodes
@@ -70,6 +117,8 @@ class backEnd(object):
         try:
             self.config = socketsConfig(virtualFile, network_name=network_name, config_type="vnode")
             self.myID = self.config.hostDict[name]
+            self.transport = read_transport(virtualFile, network_name)
+            self.topology = read_topology(virtualFile, network_name)
         except KeyError as e:
             logging.error("LOCAL {}: No such name in the configuration file {}: {}".format(name, virtualFile, e))
             raise e
@@ -77,18 +126,37 @@ class backEnd(object):
             logging.error("LOCAL {}: Error reading the configuration file {}: {}".format(name, virtualFile, e))
             raise e
 
-    def start(self, maxQubits=simulaqron_settings.max_qubits, maxRegisters=simulaqron_settings.max_registers):
+    def start(
+        self, maxQubits=simulaqron_settings.max_qubits, maxRegisters=simulaqron_settings.max_registers, workers=0
+    ):
         """
         Start listening to requests from other nodes.
 
         Arguments
         maxQubits	maximum qubits in the default register
+        workers		number of worker processes to simulate the registers in
         """
 
         try:
             logging.debug("VIRTUAL NODE %s: Starting on port %d", self.myID.name, self.myID.port)
-            node = virtualNode(self.myID, self.config, maxQubits=maxQubits, maxRegisters=maxRegisters)
-            reactor.listenTCP(self.myID.port, pb.PBServerFactory(node))
+            node = virtualNode(
+                self.myID,
+                self.config,
+                maxQubits=maxQubits,
+                maxRegisters=maxRegisters,
+                workers=workers,
+                transport=self.transport,
+                topology=self.topology,
+            )
+            factory = pb.PBServerFactory(node)
+            reactor.listenTCP(self.myID.port, factory)
+
+            # Nodes on this host connect through the UNIX domain socket, others still through TCP
+            if self.transport == "unix":
+                path = unix_socket_path(self.myID.port)
+                if os.path.exists(path):
+                    os.remove(path)
+                reactor.listenUNIX(path, factory)
 
             logging.debug("VIRTUAL NODE %s: running reactor.", self.myID.name)
             reactor.run()
@@ -111,7 +179,8 @@ class backEnd(object):
 
 class virtualNode(pb.Root):
     def __init__(self, ID, config, maxQubits=simulaqron_settings.max_qubits,
-                 maxRegisters=simulaqron_settings.max_registers):
+                 maxRegisters=simulaqron_settings.max_registers, workers=0, transport="tcp", topology=None,
+                 autoDiscard=False):
         """
         Initialize storing also our own name, hostname and port.
 
@@ -119,6 +188,12 @@ class virtualNode(pb.Root):
         ID		host identifier of this node
         maxQubits	maximum number of qubits to use in the default engine (default 10)
         maxRegister	maximum number of registers
+        workers		number of worker processes to simulate the registers in (default 0: simulate them here)
+        transport	"unix" to connect to nodes on the same host through UNIX domain sockets (default "tcp")
+        topology	neighbours of each node, connected to at startup. Other nodes are connected to on first use.
+                        If None (default), all nodes are connected to at startup.
+        autoDiscard	whether to discard virtual qubits once no client holds a reference to them anymore (default
+                        False: only discard them when asked to)
         """
 
         try:
@@ -127,13 +202,31 @@ class virtualNode(pb.Root):
             self.myID = ID
             self.myID.root = self
             self.config = config
+            self.transport = transport
 
             # Set max nr of registers and virtual qubits
             self.maxRegs = maxRegisters
             self.maxQubits = maxQubits
 
-            # List of connections
+            # List of connections, and whether each node runs on the same host as this node
             self.conn = {}
+            self.sameHost = {}
+
+            # Deferreds waiting for the connection to each node, fired as soon as it is up. Failed attempts to
+            # connect are retried after a delay doubling from firstRetryTime up to conn_retry_time, kept in
+            # retryTimes.
+            self.connWaiters = {}
+            self.firstRetryTime = 0.01
+            self.retryTimes = {}
+
+            # Nodes connected to at startup and kept connected, None for all of them. Connections to other nodes
+            # are opened on first use, and closed once unused for idleTime seconds.
+            self.neighbours = None
+            if topology is not None:
+                self.neighbours = set(topology.get(self.myID.name) or [])
+            self.connecting = set()
+            self.lastUsed = {}
+            self.idleTime = 60.0
 
             # Number of registers _created_ at this node
             # this may not equal the numbers of registers virtually carried
@@ -168,10 +261,212 @@ class virtualNode(pb.Root):
             # List of halves of epr-pairs received to be polled by CQC
             self.cqcRecvEpr = {}
 
+            # Deferreds of CQC calls waiting for a qubit or an epr half to be received, by application ID
+            self.cqcRecvWaiters = {}
+            self.cqcRecvEprWaiters = {}
+
+            # Engines of deleted registers, reset and ready to be reused for new registers. Only registers that
+            # are never handed out are pooled, their numbers are kept in pooledRegs. This pays off for ProjectQ,
+            # whose engines are costly to make. With qutip, the factored engine still makes a small engine for each
+            # of its factors, so the pool only saves making the factored engine itself.
+            self.enginePool = []
+            self.pooledRegs = set()
+            self.maxPooledEngines = 16
+
+            # Engine work on registers of at least this many qubits is done in the thread pool of the reactor,
+            # so that the node keeps answering while it runs. The work on each register is kept in order by its
+            # lock in engineLocks.
+            self.offloadQubits = 8
+            self.engineLocks = weakref.WeakKeyDictionary()
+
+            # After removing qubits, registers are split looking only at the qubits correlated with the removed
+            # ones. Parts of at least this many qubits left by that are searched in full.
+            self.fullSplitQubits = 8
+
+            # With autoDiscard, virtual qubits are discarded once all clients dropped their references to them.
+            # Twisted has no public hook for this, so it relies on the cleanup callbacks of the broker.
+            self.autoDiscard = autoDiscard
+
+            # Calls in progress of each broker. A client may drop its references to qubits it passed to a call
+            # before the call hands them back, so qubits it drops are only discarded once its calls are done.
+            self.callsInProgress = {}
+            self.droppedQubits = {}
+
+            # Brokers of the clients holding references to our virtual qubits. A client that disconnects never drops
+            # its references one by one, so it is dropped as a holder of all qubits at once.
+            self.holderBrokers = set()
+
+            # Registers merged from nodes on the same host are handed over in shared memory rather than as lists
+            # through the connection. Blocks handed out are freed after sharedTimeout seconds, or when the node stops,
+            # unless the node merging the register took them before, such that they do not outlive a node failing
+            # or disconnecting in the meantime.
+            self.sharedHandoff = True
+            self.sharedTimeout = 60
+            self.sharedOut = {}
+            reactor.addSystemEventTrigger("before", "shutdown", self._free_all_shared)
+
+            # Pool of worker processes simulating the registers, if any. They are started before the reactor runs
+            # any threads.
+            self.registerWorkers = None
+            if workers > 0:
+                engineClass, engineArgs = self._engine_class()
+                self.registerWorkers = registerWorkers(workers, engineClass, engineArgs)
+                reactor.addSystemEventTrigger("before", "shutdown", self.registerWorkers.stop)
+
         except Exception as e:
             logging.error("VIRTUAL NODE {}: Critical error when initializing virtNode: {}".format(ID.name, e))
             raise e
 
+    # Calls which may wait for a long time and are not passed any qubits, which are not counted as in progress
+    _waitingCalls = {"cqc_wait_recv", "cqc_wait_epr_recv"}
+
+    def remoteMessageReceived(self, broker, message, args, kw):
+        """
+        Dispatches a remote call, keeping count of the calls in progress of the broker.
+        """
+
+        name = message.decode("utf8") if isinstance(message, bytes) else message
+        if name in self._waitingCalls:
+            result = pb.Root.remoteMessageReceived(self, broker, message, args, kw)
+
+            # Stop waiting if the caller goes away, so that nothing received is handed to it
+            if isinstance(result, Deferred) and not result.called:
+
+                def abandon(waiter=result):
+                    self._abandon_wait(waiter)
+
+                broker.notifyOnDisconnect(abandon)
+                result.addBoth(self._wait_done, broker, abandon)
+            return result
+
+        if not self.autoDiscard:
+            return pb.Root.remoteMessageReceived(self, broker, message, args, kw)
+
+        self.callsInProgress[broker] = self.callsInProgress.get(broker, 0) + 1
+        try:
+            result = pb.Root.remoteMessageReceived(self, broker, message, args, kw)
+        except Exception as err:
+            self._call_done(None, broker)
+            raise err
+        if isinstance(result, Deferred):
+            return result.addBoth(self._call_done, broker)
+        return self._call_done(result, broker)
+
+    @staticmethod
+    def _wait_done(result, broker, abandon):
+        """
+        Called when a waiting call of the broker is done.
+        """
+        if not broker.disconnected:
+            broker.dontNotifyOnDisconnect(abandon)
+        return result
+
+    def _abandon_wait(self, waiter):
+        """
+        Called when the broker of a waiting call went away. The waiter is taken out of its queue without firing it,
+        since there is nobody left to answer.
+        """
+        for waiters in (self.cqcRecvWaiters, self.cqcRecvEprWaiters):
+            for queue in waiters.values():
+                if waiter in queue:
+                    queue.remove(waiter)
+                    return
+
+    def _watch_holder(self, broker):
+        """
+        Called when a virtual qubit is handed out to the broker, to drop it as a holder once it disconnects.
+        """
+
+        if broker not in self.holderBrokers:
+            self.holderBrokers.add(broker)
+            broker.notifyOnDisconnect(lambda: self._holder_gone(broker))
+
+    def _holder_gone(self, broker):
+        """
+        Called when a broker holding virtual qubits disconnected. Its references are gone at once, so the qubits
+        only it held are discarded.
+        """
+
+        self.holderBrokers.discard(broker)
+        self.droppedQubits.pop(broker, None)
+        for q in [q for q in self.virtQubits if broker in q._holders]:
+            q._release_holder(broker)
+
+    def _call_done(self, result, broker):
+        """
+        Called when a call of the broker is done, after its result is serialized, since Broker.serialize adds its
+        callback to the deferred of the call before we do. Qubits handed back in the result were taken out of the
+        dropped qubits while serializing, so once no calls of the broker are in progress, the qubits left there
+        are discarded.
+        """
+
+        self.callsInProgress[broker] -= 1
+        if self.callsInProgress[broker] == 0:
+            del self.callsInProgress[broker]
+            for q in self.droppedQubits.pop(broker, ()):
+                q._reference_dropped(broker)
+        return result
+
+    def run_on_register(self, register, func, *args):
+        """
+        Runs func(*args) on the engine of register once all earlier work on this register is done. For registers of
+        at least offloadQubits qubits, func runs in a worker thread. Returns a deferred firing with the result.
+
+        Arguments
+        register	register whose engine func works on
+        func		function to run
+        """
+
+        lock = self.engineLocks.setdefault(register, DeferredLock())
+        if register.activeQubits >= self.offloadQubits or getattr(register, "offload", False):
+            return lock.run(deferToThread, func, *args)
+        return lock.run(func, *args)
+
+    def _free_shared(self, name):
+        """
+        Frees the block of shared memory name handed out with a register, unless the caller took it already.
+        """
+
+        self.sharedOut.pop(name, None)
+        free_shared(name)
+
+    def _free_all_shared(self):
+        """
+        Frees all blocks of shared memory handed out with registers that may not have been taken yet.
+        """
+
+        for name, call in list(self.sharedOut.items()):
+            if call.active():
+                call.cancel()
+            self._free_shared(name)
+
+    def _shares_host(self, name):
+        """
+        Returns whether the virtual node name runs on the same host as this node.
+        """
+
+        if name not in self.sameHost:
+            try:
+                other = socket.gethostbyname(self.config.hostDict[name].hostname)
+                ours = socket.gethostbyname(self.myID.hostname)
+                self.sameHost[name] = other == ours
+            except (KeyError, OSError) as err:
+                logging.debug("VIRTUAL NODE %s: Cannot tell whether %s shares our host: %s", self.myID.name, name, err)
+                self.sameHost[name] = False
+        return self.sameHost[name]
+
+    def _raise_failure(self, failure):
+        """
+        Raises the error of a failed call again, as yielding the call would. A failure copied from another node
+        only carries the name and message of its error, which are turned into the error itself.
+
+        Arguments
+        failure		failure of the call
+        """
+        if isinstance(failure, pb.CopiedFailure):
+            self.reraise_remote_error(RemoteError(failure.type, failure.value, failure.traceback))
+        failure.raiseException()
+
     def reraise_remote_error(self, remote_err):
         """
         This is a function re-raises the error thrown remotely
@@ -195,10 +490,13 @@ class virtualNode(pb.Root):
         try:
             for key in self.config.hostDict:
                 node = self.config.hostDict[key]
-                if node.name != self.myID.name:
-                    self.connect_to_node(node)
-                else:
+                if node.name == self.myID.name:
                     self.conn[node.name] = node
+                elif self.neighbours is None or node.name in self.neighbours:
+                    self.connect_to_node(node)
+
+            if self.neighbours is not None:
+                LoopingCall(self._close_idle).start(self.idleTime, now=False)
         except Exception as e:
             logging.error(
                 "VIRTUAL NODE {}: Critical error when connection network of virtual nodes: {}".format(self.myID.name, e)
@@ -207,37 +505,40 @@ class virtualNode(pb.Root):
 
     def remote_check_connections(self):
         """
-        Checks if all connections are up. (Just checks if the number of
-        connections equal the number of nodes in config-file)
+        Checks if all connections made at startup are up: to all nodes in the config-file, or to the neighbours
+        in the topology.
         """
-        return len(self.conn) == len(self.config.hostDict)
+        if self.neighbours is None:
+            return len(self.conn) == len(self.config.hostDict)
+        return all(name in self.conn for name in self.neighbours)
 
-    @inlineCallbacks
     def get_connection(self, name):
         """
-        Returns the connection specified by 'name'. If no such connection is
-        up yet but name is in the configuration file, wait and try again.
+        Returns a deferred firing with the connection specified by 'name'. If no such connection is
+        up yet but name is in the configuration file, it fires as soon as the connection is up.
         """
+        self.lastUsed[name] = reactor.seconds()
         if name in self.conn:
-            return self.conn[name]
-        else:
-            try:
-                logging.debug(
-                    "VIRTUAL NODE {}: Connection to {} not up yet, need to wait...".format(self.myID.name, name)
-                )
-                conn_to_return = yield deferLater(reactor, simulaqron_settings.conn_retry_time, self.get_connection,
-                                                  name)
-                return conn_to_return
-            except Exception as e:
-                raise e
+            return succeed(self.conn[name])
+
+        logging.debug("VIRTUAL NODE {}: Connection to {} not up yet, need to wait...".format(self.myID.name, name))
+        if name in self.config.hostDict and name not in self.connecting:
+            self.connect_to_node(self.config.hostDict[name])
+        d = Deferred()
+        self.connWaiters.setdefault(name, []).append(d)
+        return d
 
     def connect_to_node(self, node):
         """
         Connects to other node. If node not up yet, waits for CONF_WAIT_TIME seconds.
         """
         logging.debug("VIRTUAL NODE {}: Trying to connect to node {}.".format(self.myID.name, node.name))
+        self.connecting.add(node.name)
         node.factory = pb.PBClientFactory()
-        reactor.connectTCP(node.hostname, node.port, node.factory)
+        if self.transport == "unix" and self._shares_host(node.name):
+            reactor.connectUNIX(unix_socket_path(node.port), node.factory)
+        else:
+            reactor.connectTCP(node.hostname, node.port, node.factory)
         defer = node.factory.getRootObject()
         defer.addCallback(self.handle_connection, node)
         defer.addErrback(self.handle_connection_error, node)
@@ -251,8 +552,13 @@ class virtualNode(pb.Root):
             # Retrieve the root object: virtualNode on the remote
             node.root = obj
 
-            # Add this node to the local connections
+            # Add this node to the local connections, and hand it to those waiting for it
             self.conn[node.name] = node
+            self.connecting.discard(node.name)
+            self.retryTimes.pop(node.name, None)
+            obj.notifyOnDisconnect(lambda ref: self._connection_lost(node, ref))
+            for d in self.connWaiters.pop(node.name, []):
+                d.callback(node)
         except Exception as e:
             logging.error(
                 "VIRTUAL NODE {}: Critical error when handling connection to node {}: {}".format(
@@ -264,22 +570,67 @@ class virtualNode(pb.Root):
     def handle_connection_error(self, reason, node):
         """
         Handles errors from trying to connect to other node.
-        If a ConnectionRefusedError is raised another try will be made after CONF_WAIT_TIME seconds.
-        CONF_WAIT_TIME is set in 'settings.py'.
-        Any other error is raised again.
+        If a ConnectionRefusedError is raised, or the UNIX domain socket of the node is not there yet, another try
+        will be made after a delay doubling with each try, up to CONF_WAIT_TIME seconds. CONF_WAIT_TIME is set in
+        'settings.py'. Any other error is raised again.
         """
 
         try:
             reason.raiseException()
         except ConnectionRefusedError:
             logging.debug("VIRTUAL NODE {}: Could not connect to {}, trying again...".format(self.myID.name, node.name))
-            reactor.callLater(simulaqron_settings.conn_retry_time, self.connect_to_node, node)
+            self._retry_connect(node)
+        except ConnectError as e:
+            if e.osError != errno.ENOENT:
+                logging.error("VIRTUAL NODE %s: Critical error when connecting to %s: %s", self.myID.name, node.name, e)
+                reactor.stop()
+                return
+            logging.debug("VIRTUAL NODE {}: No socket of {} yet, trying again...".format(self.myID.name, node.name))
+            self._retry_connect(node)
         except Exception as e:
             logging.error(
                 "VIRTUAL NODE {}: Critical error when connection to local virtual node: {}".format(self.myID.name, e)
             )
             reactor.stop()
 
+    def _connection_lost(self, node, ref):
+        """
+        Forgets the connection to the node once it is lost, so that it is opened again on next use.
+        """
+        if self.conn.get(node.name) is node and node.root is ref:
+            logging.debug("VIRTUAL NODE %s: Lost connection to %s.", self.myID.name, node.name)
+            del self.conn[node.name]
+
+    def _close_idle(self):
+        """
+        Closes the connections to nodes other than the neighbours which have not been used for idleTime seconds.
+        Connections are kept while calls through them are in progress, while the other node holds references to
+        objects passed to it through them, or while virtual qubits here are simulated at the other node.
+        """
+        now = reactor.seconds()
+        for name, node in list(self.conn.items()):
+            if name == self.myID.name or name in self.neighbours:
+                continue
+            if now - self.lastUsed.get(name, 0) < self.idleTime:
+                continue
+            broker = node.root.broker
+            if broker.waitingForAnswers or broker.localObjects:
+                continue
+            if any(q.simNode.name == name for q in self.virtQubits):
+                continue
+
+            logging.debug("VIRTUAL NODE %s: Closing idle connection to %s.", self.myID.name, name)
+            del self.conn[name]
+            broker.transport.loseConnection()
+
+    def _retry_connect(self, node):
+        """
+        Tries to connect to the node again after the current retry time, and doubles the retry time.
+        """
+        delay = self.retryTimes.get(node.name, self.firstRetryTime)
+        self.retryTimes[node.name] = min(2 * delay, simulaqron_settings.conn_retry_time)
+        reactor.callLater(delay, self.connect_to_node, node)
+
     def get_virtual_id(self):
         """
         This is a crude and horrible cludge to generate unique IDs for virtual qubits.
@@ -331,6 +682,16 @@ class virtualNode(pb.Root):
             raise e
         logging.debug("VIRTUAL NODE %s: Local GOT LOCK", self.myID.name)
 
+    def _try_global_lock(self):
+        """
+        Takes the global lock if it is free, without waiting for it. Returns whether it was taken, in which case it
+        must be released again. Releasing it otherwise would hand it on while its holder still relies on it.
+        """
+        if self._lock.locked:
+            return False
+        self._lock.acquire()
+        return True
+
     @inlineCallbacks
     def remote_get_global_lock(self):
         logging.debug("VIRTUAL NODE %s: Remote GETTING LOCK", self.myID.name)
@@ -423,6 +784,13 @@ class virtualNode(pb.Root):
         self._next_reg_num += 1
         return reg_num
 
+    def _set_virt_holder(self, simQubit, name):
+        """
+        Record that the node called name holds the virtual qubit backed by the locally simulated qubit. Used to
+        notify only the nodes holding qubits of a register when it moves, and no longer those whose qubits are gone.
+        """
+        simQubit.holder = None if name == self.myID.name else name
+
     def remote_new_register(self, maxQubits=10):
         """
         Initialize a local register. Right now, this simple creates a register according to the simple engine backend
@@ -434,33 +802,147 @@ class virtualNode(pb.Root):
 
         try:
             # Make sure that reg numbers are assigned correctly
-            self._get_global_lock()
+            gotLock = self._try_global_lock()
 
             if self.numRegs >= self.maxRegs:
                 logging.error("%s: Maximum number of registers reached.", self.myID.name)
                 raise quantumError("Maximum number of registers reached.")
 
-            self.numRegs = self.numRegs + 1
-            regNum = self.get_new_reg_num()
-            if simulaqron_settings.backend == "qutip":
-                newReg = qutipEngine(self.myID, regNum, maxQubits)
-            elif simulaqron_settings.backend == "projectq":
-                newReg = projectQEngine(self.myID, regNum, maxQubits)
-            elif simulaqron_settings.backend == "stabilizer":
-                newReg = stabilizerEngine(self.myID, regNum, maxQubits)
-            else:
-                raise quantumError("Unknown backend {}".format(simulaqron_settings.backend))
-
-            self.registers[regNum] = newReg
+            newReg = self._new_engine(maxQubits)
 
             logging.debug("VIRTUAL NODE %s: Initializing new simulated register.", self.myID.name)
         except Exception as e:
             logging.error("VIRTUAL NODE {}: Critical error when getting new register: {}".format(self.myID.name, e))
             raise e
         finally:
-            self._release_global_lock()
+            if gotLock:
+                self._release_global_lock()
         return newReg
 
+    def _new_pooled_register(self, maxQubits=10):
+        """
+        Initialize a local register that is only used internally at this node, such as the register of a single new
+        qubit. Its engine is taken from the pool if possible and returns to the pool once the register is deleted.
+
+        Arguments:
+        maxQubits	maximum number of qubits to use in the engine (default 10)
+        """
+
+        if self.numRegs >= self.maxRegs:
+            logging.error("%s: Maximum number of registers reached.", self.myID.name)
+            raise quantumError("Maximum number of registers reached.")
+
+        return self._new_engine(maxQubits, pooled=True)
+
+    def _new_engine(self, maxQubits, pooled=False):
+        """
+        Creates a register with the engine of the configured backend and adds it to the node.
+
+        Arguments:
+        maxQubits	maximum number of qubits to use in the engine
+        pooled		whether to reuse an engine from the pool, and return it there when the register is deleted
+        """
+
+        self.numRegs = self.numRegs + 1
+        regNum = self.get_new_reg_num()
+        if pooled:
+            self.pooledRegs.add(regNum)
+
+        if pooled and self.enginePool:
+            newReg = self.enginePool.pop()
+            newReg.num = regNum
+            newReg.maxQubits = maxQubits
+        elif self.registerWorkers is not None:
+            newReg = processEngine(self.myID, regNum, maxQubits, workers=self.registerWorkers)
+        else:
+            try:
+                engineClass, engineArgs = self._engine_class()
+            except quantumError as err:
+                self.numRegs -= 1
+                raise err
+            newReg = engineClass(self.myID, regNum, maxQubits, **engineArgs)
+
+        self.registers[regNum] = newReg
+        return newReg
+
+    @staticmethod
+    def _engine_class():
+        """
+        Returns the engine class of the configured backend, together with further keyword arguments for it.
+        """
+
+        if simulaqron_settings.backend == "qutip":
+            # Density matrices grow fast, so keep independent factors of the register apart
+            return factoredEngine, {"engineClass": qutipEngine}
+        elif simulaqron_settings.backend == "projectq":
+            return projectQEngine, {}
+        elif simulaqron_settings.backend == "stabilizer":
+            return stabilizerEngine, {}
+        raise quantumError("Unknown backend {}".format(simulaqron_settings.backend))
+
+    @inlineCallbacks
+    def _split_register(self, register, candidates=None):
+        """
+        Moves the parts of the register that are in a tensor product with the rest into registers of their own, or
+        into factors of their own for engines that keep them apart themselves, such that the cost of simulating them
+        is bounded by the actual entanglement. Relies on the qubits of the
+        register having been locked. The engine work runs through run_on_register, and the qubits are moved as soon
+        as it is queued, such that later work on them queues behind it.
+
+        Arguments:
+        register	register to split
+        candidates	if given, only parts made of these qubits are looked for
+        """
+
+        parts = yield self.run_on_register(register, register.find_factors, candidates)
+        if candidates is not None and max(len(part) for part in parts) >= self.fullSplitQubits:
+            # Looking at pairwise correlations with the removed qubits misses parts whose two qubit reduced
+            # states are maximally mixed, which stay with the rest, such as the ancillas of a decoded block
+            parts = yield self.run_on_register(register, register.find_factors)
+        if len(parts) <= 1:
+            return
+
+        # Engines that keep the parts apart themselves do so within the register. Moving the parts to registers
+        # of their own would only break up registers that clients placed qubits in together.
+        if getattr(register, "factored", False):
+            yield self.run_on_register(register, register.separate, parts)
+            return
+
+        byNum = {q.num: q for q in self.simQubits if q.register == register}
+        for part in parts[1:]:
+            if self.numRegs >= self.maxRegs:
+                logging.debug("VIRTUAL NODE %s: No free register to split register %d.", self.myID.name, register.num)
+                return
+
+            moved = [byNum[num] for num in part]
+            nums = sorted(q.num for q in moved)
+            newReg = self._new_engine(register.maxQubits, pooled=True)
+
+            # Work on the moved qubits must wait until they arrived in the new register
+            newLock = self.engineLocks.setdefault(newReg, DeferredLock())
+            yield newLock.acquire()
+            split = self.run_on_register(register, register.split_off, nums, newReg)
+            logging.debug(
+                "VIRTUAL NODE %s: Split %d qubits off register %d into register %d.",
+                self.myID.name,
+                len(nums),
+                register.num,
+                newReg.num,
+            )
+
+            # Update the positions of the qubits in both registers
+            for q in self.simQubits:
+                if q in moved:
+                    q.num = nums.index(q.num)
+                    q.register = newReg
+                elif q.register == register:
+                    q.num = q.num - len([num for num in nums if num < q.num])
+
+            try:
+                yield split
+            finally:
+                newLock.release()
+
     def remote_delete_register(self, reg):
         """
         Removes the register from the node.
@@ -474,14 +956,65 @@ class virtualNode(pb.Root):
         self.registers.pop(regnum)
         self.numRegs -= 1
 
+        # Keep the engine for reuse if nobody else can hold on to it, once the work queued on it is done
+        if regnum in self.pooledRegs:
+            self.pooledRegs.discard(regnum)
+            if len(self.enginePool) < self.maxPooledEngines:
+                d = self.run_on_register(reg, reg.reset)
+                d.addCallbacks(
+                    lambda _: self._pool_engine(reg),
+                    lambda f: logging.error("VIRTUAL NODE %s: Cannot reset engine: %s", self.myID.name, f.value),
+                )
+
+    def _pool_engine(self, reg):
+        """
+        Adds the engine of a deleted register to the pool, if there is room left.
+        """
+
+        if len(self.enginePool) < self.maxPooledEngines:
+            self.enginePool.append(reg)
+
+    def _register_near(self, near, n=1):
+        """
+        Returns the local register to place n new qubits in, following the hint near. This is the register of near
+        if it is a virtual qubit, or near itself if it is a register. Returns None if the hint cannot be followed,
+        because the register is not simulated at this node or has no room left.
+
+        Arguments:
+        near		virtual qubit or register the new qubits should be placed with, or None
+        n		number of new qubits
+        """
+
+        if near is None:
+            return None
+
+        if isinstance(near, virtualQubit):
+            if near.active != 1 or near.simNode != self.myID:
+                logging.debug("VIRTUAL NODE %s: Qubit %d not simulated here, ignoring hint.", self.myID.name, near.num)
+                return None
+            reg = near.simQubit.register
+        else:
+            reg = near
+
+        if reg.simNode != self.myID or self.registers.get(reg.num) is not reg:
+            logging.debug("VIRTUAL NODE %s: Register not simulated here, ignoring hint.", self.myID.name)
+            return None
+        if reg.activeQubits + n > reg.maxQubits:
+            logging.debug("VIRTUAL NODE %s: Register %d is full, ignoring hint.", self.myID.name, reg.num)
+            return None
+        return reg
+
     @inlineCallbacks
-    def remote_new_qubit(self, ignore_max_qubits=False):
+    def remote_new_qubit(self, ignore_max_qubits=False, near=None):
         """
         Create a new qubit in the default local register.
 
         :param ignore_max_qubits: bool
             Used to ignore the check if max virtual qubits is reached. This is used when creating EPR pairs
             to be able to temporarily create a qubit.
+        :param near: virtualQubit or register
+            If given, the qubit is placed in the register of this qubit, or in this register, so that no merge is
+            needed when they interact. Without it, or if not possible, the qubit gets a register of its own.
         """
         logging.debug("VIRTUAL NODE %s: Request to create new qubit.", self.myID.name)
 
@@ -499,22 +1032,29 @@ class virtualNode(pb.Root):
                 # Qubit in the simulation backend, initialized to |0>
                 simNum = self.get_sim_id()
 
-                # Create a new register
-                newReg = self.remote_add_register()
+                # Use the register hinted at, or create a new register
+                newReg = self._register_near(near)
+                fresh = newReg is None
+                if fresh:
+                    newReg = self._new_pooled_register()
 
                 # simQubit = simulatedQubit(self.myID, self.defaultReg, simNum)
                 simQubit = simulatedQubit(self.myID, newReg, simNum)
                 try:
-                    simQubit.make_fresh()
-                except noQubitError as err:
-                    logging.error("VIRTUAL NODE %s: Max qubits for register reached.", self.myID.name)
+                    yield simQubit.make_fresh()
+                except Exception as err:
+                    if isinstance(err, noQubitError):
+                        logging.error("VIRTUAL NODE %s: Max qubits for register reached.", self.myID.name)
+                    # Do not leave the new register behind empty
+                    if fresh:
+                        self.remote_delete_register(newReg)
                     raise err
 
                 self.simQubits.append(simQubit)
 
                 # Virtual qubit
                 newNum = self.get_virtual_id()
-                newQubit = virtualQubit(self.myID, self.myID, simQubit, newNum)
+                newQubit = virtualQubit(self.myID, self.myID, simQubit, newNum, simNum)
                 self.virtQubits.append(newQubit)
         finally:
             self._release_global_lock()
@@ -546,7 +1086,7 @@ class virtualNode(pb.Root):
                 simNum = self.get_sim_id()
                 simQubit = simulatedQubit(self.myID, reg, simNum)
                 try:
-                    simQubit.make_fresh()
+                    yield simQubit.make_fresh()
                 except noQubitError as err:
                     logging.error("VIRTUAL NODE %s: Max qubits for register reached.", self.myID.name)
                     raise err
@@ -554,13 +1094,106 @@ class virtualNode(pb.Root):
 
                 # Virtual qubit
                 newNum = self.get_virtual_id()
-                newQubit = virtualQubit(self.myID, self.myID, simQubit, newNum)
+                newQubit = virtualQubit(self.myID, self.myID, simQubit, newNum, simNum)
                 self.virtQubits.append(newQubit)
         finally:
             self._release_global_lock()
 
         return newQubit
 
+    @inlineCallbacks
+    def remote_new_qubits(self, n, near=None):
+        """
+        Create n new qubits together in one register. Returns the list of new virtual qubits.
+
+        Arguments:
+        n		number of qubits
+        near		if given, virtual qubit or register to place the new qubits with, so that no merge is needed when
+                        they interact. Without it, or if not possible, the qubits get a new register.
+        """
+
+        try:
+            # Get a lock to assure IDs are assigned correctly and maxQubits is consitently checked
+            try:
+                yield self._get_global_lock()
+            except Exception as err:
+                raise err
+
+            # Only pick the register now, the hinted one may have been merged away while we waited for the lock
+            reg = self._register_near(near, n)
+            fresh = reg is None
+            if fresh:
+                reg = self._new_pooled_register(max(n, 10))
+
+            try:
+                newQubits = yield self._add_new_qubits(reg, n)
+            except Exception as err:
+                # Do not leave the new register behind empty
+                if fresh:
+                    self.remote_delete_register(reg)
+                raise err
+        finally:
+            self._release_global_lock()
+
+        return newQubits
+
+    @inlineCallbacks
+    def remote_new_qubits_inreg(self, reg, n):
+        """
+        Create n new qubits in the specified register reg, enlarging the register only once.
+        Returns the list of new virtual qubits.
+        """
+
+        # Only allow if the register is local
+        if reg.simNode != self.myID:
+            raise quantumError("Can only create qubits registers simulated locally by this node.")
+
+        try:
+            # Get a lock to assure IDs are assigned correctly and maxQubits is consitently checked
+            try:
+                yield self._get_global_lock()
+            except Exception as err:
+                raise err
+
+            newQubits = yield self._add_new_qubits(reg, n)
+        finally:
+            self._release_global_lock()
+
+        return newQubits
+
+    @inlineCallbacks
+    def _add_new_qubits(self, reg, n):
+        """
+        Adds n new qubits to the local register reg and creates their virtual qubits. Relies on the global lock
+        being held. Returns the list of new virtual qubits.
+        """
+
+        if len(self.virtQubits) + n > self.maxQubits:
+            logging.error("VIRTUAL NODE %s: Maximum number of virtual qubits reached.", self.myID.name)
+            raise noQubitError("Max virtual qubits reached")
+
+        # Qubits in the local simulation backend, initialized to |0>
+        try:
+            nums = yield self.run_on_register(reg, reg.add_fresh_qubits, n)
+        except noQubitError as err:
+            logging.error("VIRTUAL NODE %s: Max qubits for register reached.", self.myID.name)
+            raise err
+        logging.info("QUANTUM %s: Adding qubit numbers %s to register %d", self.myID.name, nums, reg.num)
+
+        newQubits = []
+        for num in nums:
+            simNum = self.get_sim_id()
+            simQubit = simulatedQubit(self.myID, reg, simNum, num)
+            self.simQubits.append(simQubit)
+
+            # Virtual qubit
+            newNum = self.get_virtual_id()
+            newQubit = virtualQubit(self.myID, self.myID, simQubit, newNum, simNum)
+            self.virtQubits.append(newQubit)
+            newQubits.append(newQubit)
+
+        return newQubits
+
     @inlineCallbacks
     def remote_cqc_send_qubit(self, num, targetName, app_id, remote_app_id):
         """
@@ -606,6 +1239,13 @@ class virtualNode(pb.Root):
         Add an item to the received list for use in CQC.
         """
 
+        # Hand the qubit straight to a call waiting for it, if any
+        waiters = self.cqcRecvWaiters.get(to_app_id)
+        if waiters:
+            logging.debug("VIRTUAL NODE %s: Handing a qubit for app id %d to a waiting call", self.myID.name, to_app_id)
+            waiters.popleft().callback(self.remote_get_virtual_ref(new_virt_num))
+            return
+
         if not (to_app_id in self.cqcRecv):
             self.cqcRecv[to_app_id] = deque([])
 
@@ -636,6 +1276,20 @@ class virtualNode(pb.Root):
         logging.debug("VIRTUAL NODE %s: Returning qubit for app id %d from recv list", self.myID.name, to_app_id)
         return self.remote_get_virtual_ref(qc.virt_num)
 
+    def remote_cqc_wait_recv(self, to_app_id, timeout=None):
+        """
+        Retrieve the next qubit with the given app ID from the received list, waiting for it to be received if the
+        list is empty. Returns a deferred firing with the qubit, or with None after timeout seconds.
+
+        Arguments
+        to_app_id	application ID the qubit is delivered to
+        timeout		seconds to wait at most, None (default) to wait until a qubit is received
+        """
+
+        if self.cqcRecv.get(to_app_id):
+            return succeed(self.remote_cqc_get_recv(to_app_id))
+        return self._wait_for(self.cqcRecvWaiters, to_app_id, timeout)
+
     @inlineCallbacks
     def remote_cqc_send_epr_half(self, num, targetName, app_id, remote_app_id, rawEntInfo):
         """
@@ -682,6 +1336,13 @@ class virtualNode(pb.Root):
         Add an item to the epr list for use in CQC.
         """
 
+        # Hand the qubit straight to a call waiting for it, if any
+        waiters = self.cqcRecvEprWaiters.get(to_app_id)
+        if waiters:
+            logging.debug("VIRTUAL NODE %s: Handing an epr half for app id %d to a waiter", self.myID.name, to_app_id)
+            waiters.popleft().callback((self.remote_get_virtual_ref(new_virt_num), rawEntInfo))
+            return
+
         if not (to_app_id in self.cqcRecvEpr):
             self.cqcRecvEpr[to_app_id] = deque([])
 
@@ -718,6 +1379,139 @@ class virtualNode(pb.Root):
         except Exception as e:
             raise e
 
+    def remote_cqc_wait_epr_recv(self, to_app_id, timeout=None):
+        """
+        Retrieve the next qubit (half of an EPR-pair) with the given app ID from the received list, waiting for it to
+        be received if the list is empty. Returns a deferred firing with the qubit and the entanglement information,
+        or with None after timeout seconds.
+
+        Arguments
+        to_app_id	application ID the qubit is delivered to
+        timeout		seconds to wait at most, None (default) to wait until a qubit is received
+        """
+
+        if self.cqcRecvEpr.get(to_app_id):
+            return succeed(self.remote_cqc_get_epr_recv(to_app_id))
+        return self._wait_for(self.cqcRecvEprWaiters, to_app_id, timeout)
+
+    def _wait_for(self, waiters, to_app_id, timeout):
+        """
+        Returns a deferred added to the waiters for the application ID, which fires with None after timeout seconds
+        unless it is fired before.
+        """
+
+        queue = waiters.setdefault(to_app_id, deque())
+        d = Deferred(canceller=queue.remove)
+        queue.append(d)
+        if timeout is not None:
+            d.addTimeout(timeout, reactor, onTimeoutCancel=lambda result, timeout: None)
+        return d
+
+    @inlineCallbacks
+    def remote_create_epr(self, targetName, reg=None, app_id=0, remote_app_id=None, rawEntInfo=None, near=None):
+        """
+        Create an EPR pair in a single engine step and place the second half at the node targetName.
+
+        Arguments:
+        targetName	name of the node to place the second half at
+        reg		local register to create the pair in (default: a new register)
+        app_id		application asking for the pair
+        remote_app_id	if given, the second half is also added to the epr list of this application at targetName
+        rawEntInfo	entanglement information to store with the pair
+        near		if no register is given, virtual qubit or register to create the pair with
+        :return: The local half, the other half and the entanglement information. The type of the other half
+            depends on where it is placed: if targetName is this node, it is the virtual qubit, as for the local
+            half. Otherwise it lives at targetName and cannot be referenced from here, so it is its virtual number
+            at targetName, as returned by send_qubit, to be resolved there with get_virtual_ref. In both cases
+            the "virt_num" of the entanglement information is the virtual number of the other half.
+        :rtype: tuple of (virtualQubit, virtualQubit or int, dict)
+        """
+        logging.debug("VIRTUAL NODE %s: Request to create EPR pair with %s.", self.myID.name, targetName)
+
+        if reg is None:
+            reg = self._register_near(near, 2)
+        if reg is None:
+            reg = self._new_pooled_register()
+        elif reg.simNode != self.myID:
+            raise quantumError("Can only create qubits registers simulated locally by this node.")
+
+        qubits = []
+        try:
+            # Get a lock to assure IDs are assigned correctly and maxQubits is consitently checked
+            try:
+                yield self._get_global_lock()
+            except Exception as err:
+                raise err
+
+            if len(self.virtQubits) + 2 > self.maxQubits:
+                logging.error("VIRTUAL NODE %s: Maximum number of virtual qubits reached.", self.myID.name)
+                raise noQubitError("Max virtual qubits reached")
+
+            # Bell pair in the local simulation backend
+            try:
+                nums = yield self.run_on_register(reg, reg.add_epr_pair)
+            except noQubitError as err:
+                logging.error("VIRTUAL NODE %s: Max qubits for register reached.", self.myID.name)
+                raise err
+
+            for num in nums:
+                simNum = self.get_sim_id()
+                simQubit = simulatedQubit(self.myID, reg, simNum, num)
+                self.simQubits.append(simQubit)
+
+                # Virtual qubit
+                newNum = self.get_virtual_id()
+                newQubit = virtualQubit(self.myID, self.myID, simQubit, newNum, simNum)
+                self.virtQubits.append(newQubit)
+                qubits.append(newQubit)
+        finally:
+            self._release_global_lock()
+
+        qubit, other = qubits
+        if targetName != self.myID.name:
+            try:
+                other = yield self.remote_send_qubit(other, targetName)
+            except Exception as err:
+                raise err
+
+        entInfo = {
+            "fromName": self.myID.name,
+            "toName": targetName,
+            "from_app_id": app_id,
+            "to_app_id": remote_app_id,
+            "virt_num": other if targetName != self.myID.name else other.num,
+            "rawEntInfo": rawEntInfo,
+        }
+
+        # Ask to add to list
+        if remote_app_id is not None:
+            if targetName == self.myID.name:
+                self.remote_cqc_add_epr_list(self.myID.name, app_id, remote_app_id, other.num, rawEntInfo)
+            else:
+                try:
+                    remoteNode = yield self.get_connection(targetName)
+                    yield remoteNode.root.callRemote(
+                        "cqc_add_epr_list", self.myID.name, app_id, remote_app_id, other, rawEntInfo
+                    )
+                except RemoteError as remote_err:
+                    self.reraise_remote_error(remote_err)
+                except Exception as err:
+                    raise err
+
+        return qubit, other, entInfo
+
+    def remote_bell_measure(self, qubit1, qubit2):
+        """
+        Measures the two virtual qubits in the Bell basis and removes them from the simulation.
+        Returns the two classical outcomes.
+
+        Arguments
+        qubit1		first virtual qubit
+        qubit2		second virtual qubit
+        """
+
+        return qubit1.remote_bell_measure(qubit2)
+
     @inlineCallbacks
     def remote_send_qubit(self, qubit, targetName):
         """
@@ -747,7 +1541,7 @@ class virtualNode(pb.Root):
 
         try:
             # Get lock to prevent access to qubits between sending and manipulating local list
-            self._get_global_lock()
+            gotLock = self._try_global_lock()
 
             # Check whether we are just the virtual, or also the simulating node
             if qubit.virtNode == qubit.simNode:
@@ -755,11 +1549,14 @@ class virtualNode(pb.Root):
                 # We are both the virtual as well as the simulating node
                 # Pass a reference to our locally simulated qubit object to the remote node
                 try:
-                    newNum = yield remoteNode.root.callRemote("add_qubit", self.myID.name, qubit.simQubit)
+                    newNum = yield remoteNode.root.callRemote(
+                        "add_qubit", self.myID.name, qubit.simQubit, qubit.simQubit.simNum
+                    )
                 except RemoteError as remote_err:
                     self.reraise_remote_error(remote_err)
                 except Exception as err:
                     raise err
+                self._set_virt_holder(qubit.simQubit, targetName)
             else:
                 logging.debug(
                     "VIRTUAL NODE %s: Sending qubit simulated remotely at %s", self.myID.name, qubit.simNode.name
@@ -768,13 +1565,7 @@ class virtualNode(pb.Root):
                 # the actual simulating node to do the transfer for us. Due to the pecularities of Twisted PB
                 # we need to do this by the simulated qubit number
                 try:
-                    simQubitNum = yield qubit.simQubit.callRemote("get_sim_number")
-                except RemoteError as remote_err:
-                    self.reraise_remote_error(remote_err)
-                except Exception as err:
-                    raise err
-                try:
-                    newNum = yield qubit.simNode.root.callRemote("transfer_qubit", simQubitNum, targetName)
+                    newNum = yield qubit.simNode.root.callRemote("transfer_qubit", qubit.simNum, targetName)
                 except RemoteError as remote_err:
                     self.reraise_remote_error(remote_err)
                 except Exception as err:
@@ -783,15 +1574,167 @@ class virtualNode(pb.Root):
             # We gave it away so mark as inactive
             qubit.active = 0
 
-            # Remove the qubit from the local virtual list. Note it remains in the simulated
-            # list, since we continue to simulate this qubit if we did so before.
-            self.virtQubits.remove(qubit)
-        except Exception as err:
-            raise err
-        finally:
-            self._release_global_lock()
+            # Remove the qubit from the local virtual list. Note it remains in the simulated
+            # list, since we continue to simulate this qubit if we did so before.
+            self.virtQubits.remove(qubit)
+        except Exception as err:
+            raise err
+        finally:
+            if gotLock:
+                self._release_global_lock()
+
+        return newNum
+
+    @inlineCallbacks
+    def remote_send_qubits(self, qubits, targetName):
+        """
+        Sends a list of qubits to the specified target node. This does the same as send_qubit for each of the
+        qubits, but takes the lock once and registers all the new virtual qubits at the remote node in one call
+        per simulating node.
+
+        Arguments
+        qubits		list of virtual qubits to be sent
+        targetName	target node to place the qubits at (host object)
+
+        Returns the list of the new virtual qubit numbers at the target node, in the order of qubits.
+        """
+        logging.debug("VIRTUAL NODE %s: Request to send %d qubits to %s.", self.myID.name, len(qubits), targetName)
+        for qubit in qubits:
+            if qubit.active != 1:
+                logging.error("VIRTUAL NODE %s: Attempt to manipulate qubit no longer at this node.", self.myID.name)
+                raise quantumError("Cannot send qubit {}: no longer at this node.".format(qubit.num))
+        if len(set(qubits)) != len(qubits):
+            raise quantumError("Cannot send the same qubit twice.")
+
+        # Lookup host id of node
+        try:
+            if not (targetName in self.config.hostDict):
+                raise virtNetError(
+                    "Trying to get conncetion to virtual node {}, but this is not in configuration file".format(
+                        targetName
+                    )
+                )
+            remoteNode = yield self.get_connection(targetName)
+        except Exception as e:
+            raise e
+
+        # Group the qubits by the node simulating them, keeping track of their positions in the list
+        local = []
+        remote = {}
+        for pos, qubit in enumerate(qubits):
+            if qubit.virtNode == qubit.simNode:
+                local.append(pos)
+            else:
+                remote.setdefault(qubit.simNode.name, []).append(pos)
+
+        newNums = [None] * len(qubits)
+        try:
+            # Get lock to prevent access to qubits between sending and manipulating local list
+            gotLock = self._try_global_lock()
+
+            calls = []
+            if local:
+                logging.debug("VIRTUAL NODE %s: Sending %d qubits simulated locally", self.myID.name, len(local))
+                # Pass references to our locally simulated qubit objects to the remote node
+                simQubits = [qubits[pos].simQubit for pos in local]
+                d = remoteNode.root.callRemote(
+                    "add_qubits", self.myID.name, simQubits, [q.simNum for q in simQubits]
+                )
+                calls.append((local, d))
+            for positions in remote.values():
+                # We are only the virtual node, ask the simulating node to do the transfer for us
+                simNode = qubits[positions[0]].simNode
+                logging.debug(
+                    "VIRTUAL NODE %s: Sending %d qubits simulated remotely at %s",
+                    self.myID.name,
+                    len(positions),
+                    simNode.name,
+                )
+                d = simNode.root.callRemote("transfer_qubits", [qubits[pos].simNum for pos in positions], targetName)
+                calls.append((positions, d))
+
+            results = yield DeferredList([d for _, d in calls], consumeErrors=True)
+            failure = None
+            for (positions, _), (success, result) in zip(calls, results):
+                if not success:
+                    failure = failure or result
+                    continue
+
+                # We gave them away so mark as inactive and remove them from the local virtual list. Note they
+                # remain in the simulated list, since we continue to simulate these qubits if we did so before.
+                # This holds for the qubits of each call that went through, even if another one failed, since
+                # they are at the target now.
+                for pos, newNum in zip(positions, result):
+                    newNums[pos] = newNum
+                    qubit = qubits[pos]
+                    qubit.active = 0
+                    self.virtQubits.remove(qubit)
+                    if qubit.virtNode == qubit.simNode:
+                        self._set_virt_holder(qubit.simQubit, targetName)
+
+            if failure is not None:
+                sent = [qubits[pos].num for pos in range(len(qubits)) if newNums[pos] is not None]
+                if sent:
+                    logging.error(
+                        "VIRTUAL NODE %s: Sending qubits to %s partly failed, qubits %s were sent.",
+                        self.myID.name,
+                        targetName,
+                        sent,
+                    )
+                self._raise_failure(failure)
+        except Exception as err:
+            raise err
+        finally:
+            if gotLock:
+                self._release_global_lock()
+
+        return newNums
+
+    @inlineCallbacks
+    def remote_transfer_qubits(self, simQubitNums, targetName):
+        """
+        Transfer a list of qubits to the destination node if we are the simulating node, see transfer_qubit.
+
+        Arguments
+        simQubitNums	simulated qubit numbers to be sent
+        targetName	target node to place the qubits at (host object)
+        """
+        logging.debug(
+            "VIRTUAL NODE %s: Request to transfer %d qubits to %s.", self.myID.name, len(simQubitNums), targetName
+        )
+
+        # Convert the numbers into the right local objects
+        simQubits = [self._q_num_to_obj(num) for num in simQubitNums]
+
+        # Lookup host id of node
+        try:
+            if not (targetName in self.config.hostDict):
+                raise virtNetError(
+                    "Trying to get conncetion to virtual node {}, but this is not in configuration file".format(
+                        targetName
+                    )
+                )
+            remoteNode = yield self.get_connection(targetName)
+        except Exception as e:
+            raise e
+
+        # Check if we are both the destination node and simulating node
+        if self.myID.name == targetName:
+            try:
+                newNums = yield remoteNode.root.remote_add_qubits(self.myID.name, simQubits, simQubitNums)
+            except Exception as err:
+                raise err
+        else:
+            try:
+                newNums = yield remoteNode.root.callRemote("add_qubits", self.myID.name, simQubits, simQubitNums)
+            except RemoteError as remote_err:
+                self.reraise_remote_error(remote_err)
+            except Exception as err:
+                raise err
+        for q in simQubits:
+            self._set_virt_holder(q, targetName)
 
-        return newNum
+        return newNums
 
     @inlineCallbacks
     def remote_transfer_qubit(self, simQubitNum, targetName):
@@ -824,27 +1767,29 @@ class virtualNode(pb.Root):
         # Check if we are both the destination node and simulating node
         if self.myID.name == targetName:
             try:
-                newNum = yield remoteNode.root.remote_add_qubit(self.myID.name, simQubit)
+                newNum = yield remoteNode.root.remote_add_qubit(self.myID.name, simQubit, simQubitNum)
             except Exception as err:
                 raise err
         else:
             try:
-                newNum = yield remoteNode.root.callRemote("add_qubit", self.myID.name, simQubit)
+                newNum = yield remoteNode.root.callRemote("add_qubit", self.myID.name, simQubit, simQubitNum)
             except RemoteError as remote_err:
                 self.reraise_remote_error(remote_err)
             except Exception as err:
                 raise err
+        self._set_virt_holder(simQubit, targetName)
 
         return newNum
 
     @inlineCallbacks
-    def remote_add_qubit(self, name, simQubit):
+    def remote_add_qubit(self, name, simQubit, simNum=None):
         """
         Add a qubit to the local virtual node.
 
         Arguments
         name		name of the node simulating this qubit
         simQubit 	simulated qubit reference in the backend we're adding
+        simNum		simulation number of simQubit at the simulating node (looked up if not given)
         """
 
         logging.debug("VIRTUAL NODE %s: Request to add qubit from %s.", self.myID.name, name)
@@ -859,26 +1804,84 @@ class virtualNode(pb.Root):
         except Exception as e:
             raise e
 
+        if simNum is None:
+            if name == self.myID.name:
+                simNum = simQubit.simNum
+            else:
+                try:
+                    simNum = yield simQubit.callRemote("get_sim_number")
+                except RemoteError as remote_err:
+                    self.reraise_remote_error(remote_err)
+                except Exception as err:
+                    raise err
+
         try:
             # Get a lock to make sure IDs are assigned correctly
-            self._get_global_lock()
+            gotLock = self._try_global_lock()
 
             if len(self.virtQubits) >= self.maxQubits:
                 raise noQubitError("Max virtual qubits reached")
 
             # Generate a new virtual qubit object for the qubit now at this node
             newNum = self.get_virtual_id()
-            newQubit = virtualQubit(self.myID, nb, simQubit, newNum)
+            newQubit = virtualQubit(self.myID, nb, simQubit, newNum, simNum)
 
             # Add to local list
             self.virtQubits.append(newQubit)
         except Exception as err:
             raise err
         finally:
-            self._release_global_lock()
+            if gotLock:
+                self._release_global_lock()
 
         return newNum
 
+    @inlineCallbacks
+    def remote_add_qubits(self, name, simQubits, simNums):
+        """
+        Add a list of qubits simulated at the same node to the local virtual node.
+
+        Arguments
+        name		name of the node simulating these qubits
+        simQubits 	simulated qubit references in the backend we're adding
+        simNums		simulation numbers of simQubits at the simulating node
+
+        Returns the list of the new virtual qubit numbers.
+        """
+
+        logging.debug("VIRTUAL NODE %s: Request to add %d qubits from %s.", self.myID.name, len(simQubits), name)
+
+        # Get the details of the remote node
+        try:
+            if not (name in self.config.hostDict):
+                raise virtNetError(
+                    "Trying to get conncetion to virtual node {}, but this is not in configuration file".format(name)
+                )
+            nb = yield self.get_connection(name)
+        except Exception as e:
+            raise e
+
+        newNums = []
+        try:
+            # Get a lock to make sure IDs are assigned correctly
+            gotLock = self._try_global_lock()
+
+            if len(self.virtQubits) + len(simQubits) > self.maxQubits:
+                raise noQubitError("Max virtual qubits reached")
+
+            # Generate new virtual qubit objects for the qubits now at this node
+            for simQubit, simNum in zip(simQubits, simNums):
+                newNum = self.get_virtual_id()
+                self.virtQubits.append(virtualQubit(self.myID, nb, simQubit, newNum, simNum))
+                newNums.append(newNum)
+        except Exception as err:
+            raise err
+        finally:
+            if gotLock:
+                self._release_global_lock()
+
+        return newNums
+
     def remote_get_virtual_ref(self, num):
         """
         Return a virual qubit object for the given number.
@@ -893,6 +1896,65 @@ class virtualNode(pb.Root):
 
         return None
 
+    def remote_get_virtual_refs(self, nums):
+        """
+        Return the virtual qubit objects for the given numbers, in the same order.
+        Raises a quantumError if any of the numbers is unknown.
+
+        Arguments
+        nums		list of numbers of the virtual qubits
+        """
+
+        byNum = {q.num: q for q in self.virtQubits}
+        unknown = [num for num in nums if num not in byNum]
+        if unknown:
+            logging.error("VIRTUAL NODE %s: Unknown virtual qubit numbers %s.", self.myID.name, unknown)
+            raise quantumError("Unknown virtual qubit numbers {}".format(unknown))
+
+        return [byNum[num] for num in nums]
+
+    def remote_discard(self, qubits):
+        """
+        Discards the virtual qubits, tracing them out of their registers without measuring them.
+
+        Arguments
+        qubits		virtual qubits to discard
+        """
+
+        return self._discard_qubits(qubits)
+
+    @inlineCallbacks
+    def _discard_qubits(self, qubits):
+        """
+        Discards the virtual qubits, removing them at the nodes simulating them in one call per node. Qubits which
+        are no longer at this node are skipped.
+
+        Arguments
+        qubits		virtual qubits to discard
+        """
+
+        # Mark them as gone first, so that no further operations are started on them
+        bySimNode = {}
+        for q in qubits:
+            if q.active == 1 and q in self.virtQubits:
+                q.active = 0
+                self.virtQubits.remove(q)
+                bySimNode.setdefault(q.simNode.name, []).append(q)
+
+        for dead in bySimNode.values():
+            logging.debug(
+                "VIRTUAL NODE %s: Discarding %d qubits simulated at %s", self.myID.name, len(dead), dead[0].simNode.name
+            )
+            if dead[0].simNode == self.myID:
+                yield self._remove_sim_qubits([q.simQubit for q in dead])
+            else:
+                try:
+                    yield dead[0].simNode.root.callRemote("remove_sim_qubit_nums", [q.simNum for q in dead])
+                except RemoteError as remote_err:
+                    self.reraise_remote_error(remote_err)
+                except Exception as err:
+                    raise err
+
     def remote_remove_sim_qubit_num(self, delNum):
         """
         Removes the simulated qubit delQubit from the node and also from the underlying engine. Relies on this qubit
@@ -904,7 +1966,16 @@ class virtualNode(pb.Root):
 
         self._remove_sim_qubit(self._q_num_to_obj(delNum))
 
-    @inlineCallbacks
+    def remote_remove_sim_qubit_nums(self, delNums):
+        """
+        Removes the simulated qubits with the given simIDs from the node and also from the underlying engine.
+
+        Arguments
+        delNums		simIDs of the simulated qubits to delete
+        """
+
+        return self._remove_sim_qubits([self._q_num_to_obj(delNum) for delNum in delNums])
+
     def _remove_sim_qubit(self, delQubit):
         """
         Removes the simulated qubit object.
@@ -913,54 +1984,242 @@ class virtualNode(pb.Root):
         delQubit	simulated qubit object to delete
         """
 
-        # Caution: Only qubits simulated at this node can be removed
-        if delQubit not in self.simQubits:
-            logging.error("VIRTUAL NODE %s: Attempt to delete qubit not simulated at this node.", self.myID.name)
-            raise quantumError("%s: Cannot delete qubits we don't simulate.")
+        return self._remove_sim_qubits([delQubit])
+
+    @inlineCallbacks
+    def _remove_sim_qubits(self, delQubits):
+        """
+        Removes the simulated qubit objects, taking each affected register out of the engine in one step.
 
-        #
-        delNum = delQubit.num
-        delRegister = delQubit.register
+        Arguments
+        delQubits	simulated qubit objects to delete
+        """
 
+        # Caution: Only qubits simulated at this node can be removed
+        for delQubit in delQubits:
+            if delQubit not in self.simQubits:
+                logging.error("VIRTUAL NODE %s: Attempt to delete qubit not simulated at this node.", self.myID.name)
+                raise quantumError("%s: Cannot delete qubits we don't simulate.")
+
+        # Group the qubits by register
+        delRegisters = []
+        for delQubit in delQubits:
+            if delQubit.register not in delRegisters:
+                delRegisters.append(delQubit.register)
+
+        locked = []
         try:
             # We need to manipulate multiple qubits, get global lock
             yield self._get_global_lock()
 
             # Lock all relevant qubits first
-            for q in self.simQubits:
-                if q.register == delRegister:
-                    yield q.lock()
-
-            # First we remove the physical qubit from the register
-            delRegister.remove_qubit(delNum)
-
-            # Check if this was the last qubit
-            if delRegister.activeQubits == 0:
-                self.remote_delete_register(delRegister)
-            else:
-                # When removing a qubit, we need to update the positions of the qubits in
-                # the underlying physical register
-                # in all relevant qubit objects.
-                for q in self.simQubits:
-                    # If they are in the same engine, and update is required
-                    if q.register == delRegister:
-                        if q.num > delNum:
-                            q.num = q.num - 1
-
-            # Remove the qubit form the list of simulated qubits
-            self.simQubits.remove(delQubit)
+            locked = [q for q in self.simQubits if q.register in delRegisters]
+            for q in locked:
+                yield q.lock()
+
+            candidates = {}
+            remaining = {}
+            for delRegister in delRegisters:
+                delNums = [q.num for q in delQubits if q.register == delRegister]
+
+                # Only qubits correlated with the removed ones can come apart from the rest afterwards
+                if delRegister.activeQubits - len(delNums) > 1:
+                    correlated = yield self.run_on_register(delRegister, delRegister.correlated_with, delNums)
+                    candidates[delRegister] = [
+                        j - len([delNum for delNum in delNums if delNum < j]) for j in correlated
+                    ]
+
+                # First we remove the physical qubits from the register. Later work on the register queues behind
+                # this, so the positions of the remaining qubits are updated right away.
+                remaining[delRegister] = delRegister.activeQubits - len(delNums)
+                removed = self.run_on_register(delRegister, delRegister.remove_qubits, delNums)
+
+                # Check if these were the last qubits
+                if remaining[delRegister] == 0:
+                    self.remote_delete_register(delRegister)
+                else:
+                    # When removing qubits, we need to update the positions of the qubits in
+                    # the underlying physical register
+                    # in all relevant qubit objects.
+                    for q in self.simQubits:
+                        # If they are in the same engine, and update is required
+                        if q.register == delRegister and q not in delQubits:
+                            q.num = q.num - len([delNum for delNum in delNums if delNum < q.num])
+                yield removed
+
+            # Remove the qubits form the list of simulated qubits
+            for delQubit in delQubits:
+                self.simQubits.remove(delQubit)
+
+            # What remains may no longer be entangled as a whole
+            for delRegister in delRegisters:
+                if remaining[delRegister] > 1:
+                    yield self._split_register(delRegister, candidates[delRegister])
 
         except Exception as e:
-            logging.error("VIRTUAL NODE %s: Cannot remove sim qubit - %s", self.myID.name, e.strerror)
+            logging.error("VIRTUAL NODE %s: Cannot remove sim qubit - %s", self.myID.name, e)
         finally:
             # Release all relevant qubits again
-            for q in self.simQubits:
-                if q.register == delRegister:
+            for q in locked:
+                if q in self.simQubits:
                     q.unlock()
 
             # Release the global multi qubit lock
             self._release_global_lock()
 
+    @inlineCallbacks
+    def _run_code_op(self, codeName, op, qubits):
+        """
+        Runs an operation of an error correcting code on the block of virtual qubits, in one step at the node
+        simulating them. The qubits are first brought into the same register if this is not the case yet.
+        Returns the result of the operation.
+
+        Arguments
+        codeName	name of the code in the registry of qecCodes
+        op		operation of the code: encode, correct or decode
+        qubits		virtual qubits of the block, in order
+        """
+
+        code = get_code(codeName)
+        if len(qubits) != code.n:
+            raise quantumError("The code {} uses blocks of {} qubits.".format(codeName, code.n))
+
+        for q in qubits:
+            if q.active != 1:
+                logging.error("VIRTUAL NODE %s: Attempt to manipulate qubits no longer at this node.", self.myID.name)
+                raise quantumError("Attempt to manipulate qubits no longer at this node.")
+
+        first = qubits[0]
+        for attempt in range(2):
+            # Try to run the operation directly, which works if all qubits already share a register
+            if all(q.simNode == first.simNode for q in qubits):
+                simNums = [q.simNum for q in qubits]
+                try:
+                    if first.simNode == first.virtNode:
+                        (done, result) = yield self.remote_code_op_sim(codeName, op, simNums)
+                    else:
+                        (done, result) = yield first.simNode.root.callRemote("code_op_sim", codeName, op, simNums)
+                except RemoteError as remote_err:
+                    self.reraise_remote_error(remote_err)
+                except Exception as err:
+                    raise err
+                if done:
+                    return result
+
+            if attempt == 0:
+                # Bring all qubits into the register of the first one
+                logging.debug("VIRTUAL NODE %s: Code %s demands register merge.", self.myID.name, codeName)
+                for q in qubits[1:]:
+                    yield first._two_qubit_gate(q, "merge_with")
+
+        raise quantumError("Cannot bring the qubits into the same register.")
+
+    @inlineCallbacks
+    def remote_code_op_sim(self, codeName, op, simNums):
+        """
+        Runs an operation of an error correcting code on the simulated qubits with the given simIDs.
+        Returns (True, result), or (False, None) without running it if the qubits are not all in the same register.
+
+        Arguments
+        codeName	name of the code in the registry of qecCodes
+        op		operation of the code: encode, correct or decode
+        simNums		simIDs of the simulated qubits of the block, in order
+        """
+
+        if op not in ("encode", "correct", "decode"):
+            raise quantumError("Unknown operation {}".format(op))
+        code = get_code(codeName)
+
+        try:
+            yield self._get_global_lock()
+
+            simQubits = [self._q_num_to_obj(num) for num in simNums]
+            if None in simQubits:
+                raise quantumError("Cannot apply codes to qubits we don't simulate.")
+
+            register = simQubits[0].register
+            if any(q.register != register for q in simQubits):
+                return (False, None)
+
+            logging.debug("VIRTUAL NODE %s: %s with code %s in register %d", self.myID.name, op, codeName, register.num)
+            nums = [q.num for q in simQubits]
+            result = yield self.run_on_register(register, self._apply_code_op, code, op, register, simQubits, nums)
+        finally:
+            self._release_global_lock()
+
+        return (True, result)
+
+    @staticmethod
+    def _apply_code_op(code, op, register, simQubits, nums):
+        """
+        Applies noise to the simulated qubits if required, and then the operation op of code to them. The qubits
+        are at the positions nums of register.
+        """
+
+        for q, num in zip(simQubits, nums):
+            q._apply_random_pauli_noise(register, num)
+        return getattr(code, op)(register, nums)
+
+    @inlineCallbacks
+    def remote_encode(self, codeName, qubit, ancillas):
+        """
+        Encodes the qubit with the given error correcting code, in one step at the node simulating the qubits.
+        Returns the block of virtual qubits, starting with qubit.
+
+        Arguments
+        codeName	name of the code in the registry of qecCodes
+        qubit		virtual qubit to encode
+        ancillas	virtual qubits in the state |0> completing the block
+        """
+
+        block = [qubit] + list(ancillas)
+        yield self._run_code_op(codeName, "encode", block)
+        return block
+
+    @inlineCallbacks
+    def remote_correct(self, codeName, block):
+        """
+        Measures the syndrome of a block of the given error correcting code and corrects it, in one step at the node
+        simulating the qubits. Returns the syndrome.
+
+        Arguments
+        codeName	name of the code in the registry of qecCodes
+        block		virtual qubits of the block
+        """
+
+        syndrome = yield self._run_code_op(codeName, "correct", block)
+        return list(syndrome)
+
+    @inlineCallbacks
+    def remote_decode(self, codeName, block):
+        """
+        Corrects and decodes a block of the given error correcting code, in one step at the node simulating the
+        qubits. Returns the first qubit of the block, which holds the decoded state. The other qubits are left in |0>.
+
+        Arguments
+        codeName	name of the code in the registry of qecCodes
+        block		virtual qubits of the block
+        """
+
+        yield self._run_code_op(codeName, "decode", block)
+        return block[0]
+
+    def remote_shor_encode(self, qubit, ancillas):
+        """
+        Encodes the qubit into Shor's 9 qubit code using the 8 ancillas in the state |0>.
+        Returns the block of 9 virtual qubits, starting with qubit.
+        """
+
+        return self.remote_encode("shor", qubit, ancillas)
+
+    def remote_shor_decode(self, block):
+        """
+        Decodes a block of Shor's 9 qubit code, correcting a single error. Returns the first qubit of the block,
+        which holds the decoded state.
+        """
+
+        return self.remote_decode("shor", block)
+
     def remote_merge_regs(self, num1, num2):
         """
         Merges the two local quantum registers. Note that these register may simulate virtual qubits across different
@@ -978,8 +2237,9 @@ class virtualNode(pb.Root):
             elif q.simNum == num2:
                 q2 = q
 
-        self.local_merge_regs(q1, q2)
+        return self.local_merge_regs(q1, q2)
 
+    @inlineCallbacks
     def local_merge_regs(self, qubit1, qubit2):
         """
         Merges the two local quantum registers. Note that these register may simulate virtual qubits across different
@@ -1019,8 +2279,11 @@ class virtualNode(pb.Root):
         # For relabelling qubit numbers get the offset
         offset = reg1.activeQubits
 
-        # Add reg2 to reg1
-        reg1.absorb(reg2)
+        # Add reg2 to reg1 once the work already queued on reg2 is done. Later work on the qubits of reg2 queues
+        # behind this on reg1, so they are moved right away.
+        lock2 = self.engineLocks.setdefault(reg2, DeferredLock())
+        yield lock2.acquire()
+        absorbed = self.run_on_register(reg1, reg1.absorb, reg2)
 
         # Update the simulated qubit numbering and register
         for q in self.simQubits:
@@ -1029,6 +2292,11 @@ class virtualNode(pb.Root):
                 q.register = reg1
                 q.num = q.num + offset
 
+        try:
+            yield absorbed
+        finally:
+            lock2.release()
+
         # reg2.reset()
         self.remote_delete_register(reg2)
 
@@ -1063,8 +2331,11 @@ class virtualNode(pb.Root):
             raise e
 
         # Fetch the details of the remote register and qubit, and remove sim qubits at node
+        shared = self.sharedHandoff and self._shares_host(simNodeName)
         try:
-            (R, I, activeQ, oldRegNum, oldQubitNum) = yield simNode.root.callRemote("get_register_del", simQubitNum)
+            (R, I, activeQ, oldRegNum, oldQubitNum, oldSimNums, holders) = yield simNode.root.callRemote(
+                "get_register_del", simQubitNum, shared
+            )
         except RemoteError as remote_err:
             self.reraise_remote_error(remote_err)
         except Exception as err:
@@ -1073,34 +2344,47 @@ class virtualNode(pb.Root):
         # Get numbering offset from previous register: append at end
         offset = localReg.activeQubits
 
-        # Allow localReg to absorb the remote register
+        # Allow localReg to absorb the remote register. If it was handed over in shared memory, R holds the name
+        # and layout of the block, which is freed once absorbed.
         localReg.maxQubits = localReg.maxQubits + activeQ
-        localReg.absorb_parts(R, I, activeQ)
+        if shared and activeQ > 0:
+            name, layout = R
+
+            # Take the block right away, so that it goes away even if absorbing it fails
+            block = take_shared(name)
+
+            def absorb(Re, Im):
+                localReg.absorb_arrays(Re, Im, activeQ)
 
-        # Collect mappings between numbers and objects for updating the virtual qubits
+            yield self.run_on_register(localReg, use_block, block, layout, absorb)
+        else:
+            yield self.run_on_register(localReg, localReg.absorb_parts, R, I, activeQ)
+
+        # Collect mappings from the old simulation numbers to the new numbers and objects, for updating
+        # the virtual qubits
         newD = {}
 
-        # Make new qubit objects
+        # Make new qubit objects, held by the same nodes as before
         for k in range(activeQ):
             simNum = self.get_sim_id()
             newQubit = simulatedQubit(self.myID, localReg, simNum, offset + k)
+            self._set_virt_holder(newQubit, holders[k])
             self.simQubits.append(newQubit)
-            newD[k] = newQubit
+            newD[oldSimNums[k]] = (simNum, newQubit)
 
-        # Issue an update call to all nodes to update their virtual qubits if necessary
-        # for name in self.conn:
-        for name in self.config.hostDict:
+        # Issue an update call to the nodes holding virtual qubits of the moved register, all at once
+        updates = []
+        for name in set(holders):
             if name != self.myID.name:
-                try:
-                    nb = yield self.get_connection(name)
-                except Exception as err:
-                    raise err
-                try:
-                    yield nb.root.callRemote("update_virtual_merge", self.myID.name, simNodeName, oldRegNum, newD)
-                except RemoteError as remote_err:
-                    self.reraise_remote_error(remote_err)
-                except Exception as err:
-                    raise err
+                d = self.get_connection(name)
+                d.addCallback(
+                    lambda nb: nb.root.callRemote("update_virtual_merge", self.myID.name, simNodeName, oldRegNum, newD)
+                )
+                updates.append(d)
+        results = yield DeferredList(updates, consumeErrors=True)
+        for success, result in results:
+            if not success:
+                self._raise_failure(result)
 
         # Locally, we might also already have virtual qubits which were in the remote simulated
         # register. Update them as well
@@ -1111,19 +2395,19 @@ class virtualNode(pb.Root):
             raise err
 
         # Return the qubit object corresponding to the new physical qubit
-        return newD[oldQubitNum]
+        return newD[simQubitNum][1]
 
     @inlineCallbacks
     def remote_update_virtual_merge(self, newSimNodeName, oldSimNodeName, oldRegNum, newD):
         """
-        Update the virtual qubits to the new simulating node, if applicable. This is extremely
-        inefficient due to not keeping register information in virtualQubit.
+        Update the virtual qubits to the new simulating node, if applicable.
 
         Arguments
         newSimNodeName	new node simulating this qubit
         oldSimNodeName	old node simulating the qubit
         oldReg		old register
-        newD		dictionary mapping qubit numbers to qubit objects at the new simulating node
+        newD		dictionary mapping the old simulation numbers to the new simulation numbers and qubit objects
+        		at the new simulating node
         """
 
         logging.debug("VIRTUAL NODE %s: Request to update local virtual qubits.", self.myID.name)
@@ -1153,33 +2437,20 @@ class virtualNode(pb.Root):
         except Exception as e:
             raise e
 
+        # The simulation numbers are unique at the old simulating node, so they identify the moved qubits
+        # without asking the old simulating node for the register details of each qubit
         for q in self.virtQubits:
-            if q.virtNode == q.simNode and q.simNode == oldSimNode:
-                logging.debug("VIRTUAL NODE %s: Simulating node update.", self.myID.name)
-                # We previously simulated this qubit ourselves
-                givenReg = q.simQubit.register.num
-                givenNum = q.simQubit.num
-            elif q.simNode == oldSimNode:
-                logging.debug("VIRTUAL NODE %s: Previously remote simulator node update.", self.myID.name)
-                # We had the virtual qubit but it was simulated elsewhere
-                try:
-                    (givenNum, givenReg) = yield q.simQubit.callRemote("get_numbers")
-                except RemoteError as remote_err:
-                    self.reraise_remote_error(remote_err)
-                except Exception as err:
-                    raise err
-
-            # Check if this qubit needs updating
-            if q.simNode == oldSimNode and givenReg == oldRegNum:
+            if q.simNode == oldSimNode and q.simNum in newD:
                 logging.debug(
-                    "VIRTUAL NODE %s: Updating virtual qubit %d, previously %s now %s",
+                    "VIRTUAL NODE %s: Updating virtual qubit %d from register %d, previously %s now %s",
                     self.myID.name,
                     q.num,
+                    oldRegNum,
                     oldSimNode.name,
                     newSimNode.name,
                 )
                 q.simNode = newSimNode
-                q.simQubit = newD[givenNum]
+                (q.simNum, q.simQubit) = newD[q.simNum]
 
     @inlineCallbacks
     def remote_get_register_RI(self, qubit):
@@ -1193,23 +2464,31 @@ class virtualNode(pb.Root):
             realM, imagM = yield qubit.callRemote("get_register_RI")
         return realM, imagM
 
+    @inlineCallbacks
     def remote_get_register(self, qubit):
         """
         Return the value of of a locally simulated register which contains this virtual qubit.
         """
 
-        (realM, imagM) = qubit.simQubit.register.get_register_RI()
+        (realM, imagM) = yield qubit.simQubit.remote_get_register_RI()
         activeQ = qubit.simQubit.register.activeQubits
         oldRegNum = qubit.simQubit.register.num
         oldQubitNum = qubit.simQubit.num
 
         return (realM, imagM, activeQ, oldRegNum, oldQubitNum)
 
-    def remote_get_register_del(self, qubitNum):
+    @inlineCallbacks
+    def remote_get_register_del(self, qubitNum, shared=False):
         """
         Return the value of of a locally simulated register, and remove the simulated qubits from this node.
 
         Caution: virtual qubits not updated.
+
+        Arguments
+        qubitNum	simulation number of a qubit in the register
+        shared		if True, the register is placed in a block of shared memory, to be taken by the caller with
+                        take_shared, and its name and layout are returned in place of the real part, with None as
+                        imaginary part. Blocks not taken within sharedTimeout seconds are freed.
         """
 
         assert self._lock.locked
@@ -1223,24 +2502,39 @@ class virtualNode(pb.Root):
         # If nothing is found, return
         if gotQ is None:
             logging.debug("VIRTUAL NODE %s: No simulated qubit with ID %d.", qubitNum)
-            return ([], [], 0, 0, 0)
-
-        (realM, imagM) = gotQ.register.get_register_RI()
+            return ([], [], 0, 0, 0, [], [])
+
+        # Read the register once all work on it is done, gates may still run on it in a worker thread
+        if shared:
+            arrays = yield self.run_on_register(gotQ.register, gotQ.register.get_register_arrays)
+            shm, layout = to_shared(arrays, track=False)
+            realM, imagM = (shm.name, layout), None
+            shm.close()
+            self.sharedOut[shm.name] = reactor.callLater(self.sharedTimeout, self._free_shared, shm.name)
+        else:
+            (realM, imagM) = yield self.run_on_register(gotQ.register, gotQ.register.get_register_RI)
         activeQ = gotQ.register.activeQubits
         oldRegNum = gotQ.register.num
         oldQubitNum = gotQ.num
         delRegister = gotQ.register
 
+        # Simulation numbers of the qubits in the register, and the nodes holding their virtual qubits, which will
+        # need to update them, by position
+        simNums = [None] * activeQ
+        holders = [None] * activeQ
+
         # Remove all simulated qubits and the register
         # Need to iterate of simQubits in reverse, otherwise wrong elements are removed
         for q in reversed(self.simQubits):
             if q.register.num == oldRegNum:
+                simNums[q.num] = q.simNum
+                holders[q.num] = q.holder or self.myID.name
                 self.simQubits.remove(q)
                 # gotQ.register.activeQubits -= 1
 
         self.remote_delete_register(delRegister)
 
-        return (realM, imagM, activeQ, oldRegNum, oldQubitNum)
+        return (realM, imagM, activeQ, oldRegNum, oldQubitNum, simNums, holders)
 
     @inlineCallbacks
     def remote_get_multiple_qubits(self, qList):
@@ -1276,7 +2570,7 @@ class virtualNode(pb.Root):
             for q in qList:
                 nums.append(q.simQubit.simNum)
             logging.debug("VIRTUAL NODE %s: Looking for simulated qubits. %s", self.myID.name, nums)
-            (R, I) = self.remote_get_state(nums)
+            (R, I) = yield self.remote_get_state(nums)
         else:
             # Qubits are located elsewhere.
             nums = []
@@ -1297,6 +2591,7 @@ class virtualNode(pb.Root):
 
         return (R, I)
 
+    @inlineCallbacks
     def remote_get_state(self, simNumList):
         """
         Return the state of multiple qubits corresponding to the IDs in simNumList.
@@ -1323,7 +2618,7 @@ class virtualNode(pb.Root):
             return
 
         traceList.sort()
-        (realM, imagM) = prev.register.get_qubits_RI(traceList)
+        (realM, imagM) = yield self.run_on_register(prev.register, prev.register.get_qubits_RI, traceList)
 
         return (realM, imagM)
 
@@ -1339,7 +2634,7 @@ class virtualNode(pb.Root):
 
 
 class virtualQubit(pb.Referenceable):
-    def __init__(self, virtNode, simNode, simQubit, num):
+    def __init__(self, virtNode, simNode, simQubit, num, simNum):
         """
         Creates a virtual qubit object simulated in the specified simulation register backend
 
@@ -1348,6 +2643,7 @@ class virtualQubit(pb.Referenceable):
         simNode		node where this qubit is simulated
         simQubit	reference to the underlying qubit object (may be remote)
         num		number ID among the virtual qubits
+        simNum		simulation number of the underlying qubit object at the simulating node
         """
 
         # Node where this qubit is virtually located
@@ -1359,6 +2655,10 @@ class virtualQubit(pb.Referenceable):
         # Underlying qubit object for simulation
         self.simQubit = simQubit
 
+        # Simulation number of the underlying qubit object, kept up to date on register merges
+        # so that the simulating node does not need to be asked for it
+        self.simNum = simNum
+
         # Qubit active at this node. The client may retain a reference to this object,
         # which will cause python to keep it, while it has actually be transferred to
         # another node. We do not allow operations on a qubit that is now virtually elsewhere.
@@ -1368,6 +2668,61 @@ class virtualQubit(pb.Referenceable):
         # with the number of the qubits in the register
         self.num = num
 
+        # Brokers of the clients holding references to us. Once all of them dropped their references,
+        # nobody can use this qubit anymore and it is traced out of its register.
+        self._holders = set()
+
+    def jellyFor(self, jellier):
+        """
+        Keeps track of the brokers we are handed out to, in order to be discarded when all references are dropped,
+        if the node discards unreferenced qubits.
+        """
+
+        broker = jellier.invoker
+        if self.virtNode.root.autoDiscard and broker is not None and not broker.disconnected and self.active == 1:
+            self._holders.add(broker)
+            broker._localCleanup.setdefault(self.processUniqueID(), lambda: self._reference_dropped(broker))
+            self.virtNode.root._watch_holder(broker)
+
+            # Handed back to a broker which dropped us during a call, so we are held again
+            self.virtNode.root.droppedQubits.get(broker, set()).discard(self)
+        return pb.Referenceable.jellyFor(self, jellier)
+
+    def _reference_dropped(self, broker):
+        """
+        Called when the broker no longer holds any reference to us.
+        """
+
+        # A call of the broker may still hand us back to it
+        root = self.virtNode.root
+        if root.callsInProgress.get(broker):
+            root.droppedQubits.setdefault(broker, set()).add(self)
+            return
+
+        self._release_holder(broker)
+
+    def _release_holder(self, broker):
+        """
+        Stops counting the broker as a holder, discarding the qubit once nobody holds it anymore.
+        """
+
+        self._holders.discard(broker)
+        if not self._holders and self.active == 1:
+            logging.debug("VIRTUAL NODE %s: Discarding unreferenced qubit %d", self.virtNode.name, self.num)
+            d = self.virtNode.root._discard_qubits([self])
+            d.addErrback(
+                lambda f: logging.error(
+                    "VIRTUAL NODE %s: Cannot discard unreferenced qubit - %s", self.virtNode.name, f.getErrorMessage()
+                )
+            )
+
+    def remote_discard(self):
+        """
+        Discards the qubit, tracing it out of its register without measuring it.
+        """
+
+        return self.virtNode.root._discard_qubits([self])
+
     @inlineCallbacks
     def _single_gate(self, name, *args):
         """
@@ -1402,7 +2757,7 @@ class virtualQubit(pb.Referenceable):
                     try:
                         yield self.simQubit.lock()
                         if self.simQubit.active:
-                            getattr(self.simQubit, localName)(*args)
+                            yield getattr(self.simQubit, localName)(*args)
                             waiting = False
                             outcome = True
                     except Exception as e:
@@ -1561,7 +2916,7 @@ class virtualQubit(pb.Referenceable):
                         yield self.simQubit.lock()
                         if self.simQubit.active:
                             logging.debug("VIRTUAL NODE %s: Measuring local qubit", self.virtNode.name)
-                            outcome = self.simQubit.remote_measure_inplace()
+                            outcome = yield self.simQubit.remote_measure_inplace()
                             if not inplace:
                                 self.virtNode.root._remove_sim_qubit(self.simQubit)
 
@@ -1674,11 +3029,14 @@ class virtualQubit(pb.Referenceable):
 
         """
 
+        lockedLocal = False
+
         try:
             # Release qubit node locks
             if q1simNode == q1virtNode:
                 # first qubit was locally simulated
                 yield self.simNode.root._release_global_lock()
+                lockedLocal = True
             else:
                 # first qubit was remote
                 yield q1simNode.root.callRemote("release_global_lock")
@@ -1688,12 +3046,15 @@ class virtualQubit(pb.Referenceable):
                 if q2simNode == q2virtNode:
                     # target qubit was local
                     yield q2simNode.root._release_global_lock()
+                    lockedLocal = True
                 else:
                     # target qubit was remote
                     yield q2simNode.root.callRemote("release_global_lock")
 
-            # Release local node (may be the same as above)
-            self.virtNode.root._release_global_lock()
+            # Release local node, unless it was locked as one of the above. Releasing it twice would release the
+            # lock held by the next one waiting for it.
+            if not lockedLocal:
+                self.virtNode.root._release_global_lock()
         except RemoteError as remote_err:
             self.virtNode.root.reraise_remote_error(remote_err)
         except Exception as err:
@@ -1763,6 +3124,42 @@ class virtualQubit(pb.Referenceable):
         except Exception as err:
             raise err
 
+    @inlineCallbacks
+    def remote_bell_measure(self, target):
+        """
+        Measures this qubit and the target qubit in the Bell basis, and removes both from the simulation.
+        Returns the outcomes (x, y), which are the ones of measuring this qubit in the Hadamard basis and the target
+        in the standard basis after a CNOT from this qubit onto the target.
+
+        Arguments
+        target		the virtual qubit to measure together with this one
+        """
+
+        try:
+            outcome = yield self._two_qubit_gate(target, "measure_bell_inplace")
+        except Exception as err:
+            raise err
+
+        if outcome is None:
+            return
+
+        # Both qubits are now in the same register, remove them together
+        try:
+            if self.simNode == self.virtNode:
+                yield self.virtNode.root._remove_sim_qubits([self.simQubit, target.simQubit])
+            else:
+                yield self.simNode.root.callRemote("remove_sim_qubit_nums", [self.simNum, target.simNum])
+        except RemoteError as remote_err:
+            self.virtNode.root.reraise_remote_error(remote_err)
+        except Exception as err:
+            raise err
+
+        # Delete from virtual qubits
+        self.virtNode.root.virtQubits.remove(self)
+        self.virtNode.root.virtQubits.remove(target)
+
+        return tuple(outcome)
+
     @inlineCallbacks
     def _two_qubit_gate(self, target, name):
         """
@@ -1771,6 +3168,8 @@ class virtualQubit(pb.Referenceable):
         Arguments
         target		second virtual qubit (beyond self which is the first)
         name		name of the gate to perform
+
+        Returns the outcome of the gate if it has one, and True otherwise.
         """
 
         if self.active != 1 or target.active != 1:
@@ -1867,6 +3266,8 @@ class virtualQubit(pb.Referenceable):
         q2simNode = target.simNode
         q2virtNode = target.virtNode
 
+        outcome = None
+
         # Todo a 2 qubit gate, both qubits must be in the same simulated register. We will merge
         # registers if this is not already the case.
         try:
@@ -1878,14 +3279,14 @@ class virtualQubit(pb.Referenceable):
 
                     if self.simQubit.register == target.simQubit.register:
                         # They are even in the same register, just do the gate
-                        getattr(self.simQubit, localName)(target.simQubit.num)
+                        outcome = yield getattr(self.simQubit, localName)(target.simQubit.num)
                     else:
                         logging.debug("VIRTUAL NODE %s: 2qubit command demands register merge.", self.virtNode.name)
                         # Both are local but not in the same register
-                        self.simNode.root.local_merge_regs(self.simQubit, target.simQubit)
+                        yield self.simNode.root.local_merge_regs(self.simQubit, target.simQubit)
 
                         # After the merge, just do the gate
-                        getattr(self.simQubit, localName)(target.simQubit.num)
+                        outcome = yield getattr(self.simQubit, localName)(target.simQubit.num)
                 else:
                     # Both are remotely simulated
                     logging.debug("VIRTUAL NODE %s: 2qubit command demands remote register merge.", self.virtNode.name)
@@ -1906,7 +3307,7 @@ class virtualQubit(pb.Referenceable):
                     targetNum = yield target.simQubit.callRemote("get_number")
 
                     # Execute the 2 qubit gate
-                    yield self.simQubit.callRemote(name, targetNum)
+                    outcome = yield self.simQubit.callRemote(name, targetNum)
                     logging.debug(
                         "VIRTUAL NODE %s: Remote 2qubit command to %s.", self.virtNode.name, target.simNode.name
                     )
@@ -1928,12 +3329,13 @@ class virtualQubit(pb.Referenceable):
                     target.simQubit = yield self.simNode.root.remote_merge_from(
                         target.simNode.name, fNum, self.simQubit.register
                     )
+                    target.simNum = target.simQubit.simNum
 
                     # Get the number of the target in the new register
                     targetNum = target.simQubit.num
 
                     # Execute the 2 qubit gate
-                    getattr(self.simQubit, localName)(targetNum)
+                    outcome = yield getattr(self.simQubit, localName)(targetNum)
 
                 elif target.simNode == target.virtNode:
 
@@ -1950,12 +3352,13 @@ class virtualQubit(pb.Referenceable):
                     self.simQubit = yield target.simNode.root.remote_merge_from(
                         self.simNode.name, fNum, target.simQubit.register
                     )
+                    self.simNum = self.simQubit.simNum
 
                     # Get the number of the target in the new register
                     targetNum = target.simQubit.num
 
                     # Execute the 2 qubit gate
-                    getattr(self.simQubit, localName)(targetNum)
+                    outcome = yield getattr(self.simQubit, localName)(targetNum)
 
                 else:
                     # Both qubits are remotely simulated - we will pull both registers to become one local register
@@ -1967,7 +3370,7 @@ class virtualQubit(pb.Referenceable):
                     )
 
                     # Create a new local register
-                    newLocalReg = self.virtNode.root.remote_add_register()
+                    newLocalReg = self.virtNode.root._new_pooled_register()
 
                     # Fetch the detail of the two registers from remote
                     (fNum, fNode) = yield self.simQubit.callRemote("get_details")
@@ -1981,15 +3384,17 @@ class virtualQubit(pb.Referenceable):
 
                     # Pull the remote registers to this node
                     self.simQubit = yield self.virtNode.root.remote_merge_from(self.simNode.name, fNum, newLocalReg)
+                    self.simNum = self.simQubit.simNum
                     target.simQubit = yield target.virtNode.root.remote_merge_from(
                         target.simNode.name, tNum, newLocalReg
                     )
+                    target.simNum = target.simQubit.simNum
                     # Get the number of the target in the new register
                     targetNum = target.simQubit.num
 
                     # Finally, execute the two qubit gate
                     logging.debug("RUN GATE")
-                    getattr(self.simQubit, localName)(targetNum)
+                    outcome = yield getattr(self.simQubit, localName)(targetNum)
         except RemoteError as remote_err:
             self.virtNode.root.reraise_remote_error(remote_err)
         except Exception as e:
@@ -2002,6 +3407,8 @@ class virtualQubit(pb.Referenceable):
             yield self._unlock_inreg(target)
             yield self._unlock_nodes(q1simNode, q1virtNode, q2simNode, q2virtNode)
 
+        if outcome is not None:
+            return outcome
         return True
 
     @inlineCallbacks
@@ -2054,7 +3461,7 @@ class virtualQubit(pb.Referenceable):
             logging.error("VIRTUAL NODE %s: Attempt to manipulate qubits no longer at this node.", self.virtNode.name)
 
         if self.virtNode == self.simNode:
-            (R, I) = self.simQubit.remote_get_qubit()
+            (R, I) = yield self.simQubit.remote_get_qubit()
         else:
             try:
                 try:
@@ -2071,7 +3478,7 @@ class virtualQubit(pb.Referenceable):
     @inlineCallbacks
     def remote_get_register_RI(self):
         if self.simNode == self.virtNode:
-            realM, imagM = self.simQubit.register.get_register_RI()
+            realM, imagM = yield self.simQubit.remote_get_register_RI()
         else:
             realM, imagM = yield self.simQubit.callRemote("get_register_RI")
         return realM, imagM
@@ -0,0 +1,654 @@
+"""
+Runs a repeater chain of any length: Alice, the repeaters Repeater1 to RepeaterN and Bob. Alice shares an EPR pair
+with Bob by sending one half along the chain. Each hop sends the qubit encoded in an error correcting code, and each
+repeater decodes it and swaps the entanglement onto a new EPR pair that it forwards. The corrections for the swaps
+are collected in a Pauli frame that travels along with the qubit, and Bob applies them once at the end.
+
+With --rounds, Alice shares several pairs with Bob. Rounds are pipelined: Alice starts the next round as soon as she
+has sent the qubit of the last one, each node processes the rounds in the order they come in, and Bob reports the
+outcome of each round to Alice.
+
+With --protocol nested, all neighbouring nodes share an EPR pair at once instead, and the repeaters swap these in
+rounds that each join pairs of neighbouring segments, so that the number of rounds grows with the logarithm of the
+length of the chain. Alice collects the outcomes of the swaps and Bob corrects his qubit once at the end.
+
+The configuration files of the virtual and classical networks are generated for the chain. All nodes run in this
+process, or with --processes each node runs in a process of its own.
+
+Example: python3 chain_simqtest.py --hops 3 --code shor --backend qutip
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, Deferred, DeferredList, DeferredQueue, DeferredSemaphore
+from twisted.internet.error import ConnectionRefusedError
+from twisted.internet.task import deferLater
+from twisted.spread import pb
+
+from simulaqron.settings import simulaqron_settings
+from simulaqron.general.hostConfig import socketsConfig
+from simulaqron.local.messages import messageBox
+from simulaqron.virtNode.qecCodes import codes, get_code
+
+
+def chain_names(hops):
+    """
+    Returns the names of the nodes of a chain with the given number of repeaters, from Alice to Bob.
+    """
+    return ["Alice"] + ["Repeater{}".format(k) for k in range(1, hops + 1)] + ["Bob"]
+
+
+def write_configs(names, directory, basePort):
+    """
+    Writes the configuration files of the virtual and the classical network of the nodes into directory, using
+    consecutive ports from basePort. Returns the paths of both files.
+    """
+    virtualFile = os.path.join(directory, "virtualNodes.cfg")
+    classicalFile = os.path.join(directory, "classicalNet.cfg")
+    for path, offset in [(virtualFile, 0), (classicalFile, len(names))]:
+        with open(path, "w") as f:
+            for i, name in enumerate(names):
+                f.write("{}, localhost, {}\n".format(name, basePort + offset + i))
+    return virtualFile, classicalFile
+
+
+@inlineCallbacks
+def connect(node):
+    """
+    Connects to the PB server of the host node and returns its root object, trying again with a doubling delay
+    while the server is not up yet.
+    """
+    delay = 0.01
+    while True:
+        factory = pb.PBClientFactory()
+        reactor.connectTCP(node.hostname, node.port, factory)
+        try:
+            root = yield factory.getRootObject()
+            return root
+        except ConnectionRefusedError:
+            yield deferLater(reactor, delay, lambda: None)
+            delay = min(2 * delay, simulaqron_settings.conn_retry_time)
+
+
+class roundError(Exception):
+    """
+    Raised at the source for a round which failed at another node of the chain.
+    """
+    pass
+
+
+#####################################################################################################
+#
+# chainNode
+#
+# The classical server of a node in the chain, which runs its part of the protocol. Alice is the source, the last
+# node is Bob and the nodes in between are repeaters.
+#
+class chainNode(pb.Root):
+    def __init__(self, name, names, classicalNet, codeName=None):
+        """
+        Arguments
+        name		name of this node
+        names		names of the nodes of the chain, from Alice to Bob
+        classicalNet	servers in the classical communication network (socketsConfig)
+        codeName	name of the error correcting code to send the qubits in, None to send them bare
+        """
+
+        self.name = name
+        self.names = names
+        pos = names.index(name)
+        self.source = names[0]
+        self.destination = names[-1]
+        self.nextName = names[pos + 1] if pos + 1 < len(names) else None
+        self.classicalNet = classicalNet
+        self.codeName = codeName
+
+        # Each EPR pair is made in a register of its own, so that the qubits of different rounds stay apart
+        self.virtRoot = None
+
+        # Root objects of the classical servers of the next node and of the source, and for the nested protocol at
+        # the source of all other nodes
+        self.peers = {}
+
+        # Halves of the EPR pairs shared with the previous and the next node in the nested protocol
+        self.left = None
+        self.right = None
+
+        # Classical messages from the other nodes
+        self.messages = messageBox()
+
+        # Rounds sent by the previous node but not yet processed, as (round_id, virtualNums)
+        self.rounds = DeferredQueue()
+
+        # Set once this node and all nodes after it are connected, with the calls waiting for that
+        self.ready = False
+        self._readyWaiters = []
+
+    @inlineCallbacks
+    def connect(self, virtualNet):
+        """
+        Connects to the virtual node and to the classical servers this node talks to. Done once the nodes after it
+        in the chain are connected as well.
+        """
+
+        self.virtRoot = yield connect(virtualNet.hostDict[self.name])
+        for name in [self.nextName, self.source]:
+            if name is not None and name != self.name and name not in self.peers:
+                self.peers[name] = yield connect(self.classicalNet.hostDict[name])
+
+        if self.nextName is not None:
+            yield self.peers[self.nextName].callRemote("ready")
+        if self.name != self.source:
+            self._serve_rounds()
+        self.ready = True
+        for d in self._readyWaiters:
+            d.callback(True)
+        self._readyWaiters = []
+
+    def remote_ready(self):
+        """
+        Returns once this node and all nodes after it in the chain are connected.
+        """
+        if self.ready:
+            return True
+        d = Deferred()
+        self._readyWaiters.append(d)
+        return d
+
+    @inlineCallbacks
+    def _encode(self, qubit):
+        """
+        Encodes the qubit in the code, if any, and returns the block of qubits to send.
+        """
+        if self.codeName is None:
+            return [qubit]
+
+        # intialised to |0>, placed with qubit so encoding needs no merge
+        n = get_code(self.codeName).n
+        ancillas = yield self.virtRoot.callRemote("new_qubits", n - 1, near=qubit)
+        block = yield self.virtRoot.callRemote("encode", self.codeName, qubit, ancillas)
+        return block
+
+    @inlineCallbacks
+    def _decode(self, block):
+        """
+        Decodes the block of qubits received, if encoded, and returns the qubit it holds.
+        """
+        if self.codeName is None:
+            return block[0]
+
+        qubit = yield self.virtRoot.callRemote("decode", self.codeName, block)
+        # The rest of the block is back in |0> and no longer needed
+        yield self.virtRoot.callRemote("discard", block[1:])
+        return qubit
+
+    @inlineCallbacks
+    def _send(self, qubit):
+        """
+        Sends the qubit to the next node, encoded if a code is used, and returns the numbers of the qubits sent.
+        """
+        block = yield self._encode(qubit)
+        qubit_ids = yield self.virtRoot.callRemote("send_qubits", block, self.nextName)
+        return qubit_ids
+
+    @inlineCallbacks
+    def run_source(self, rounds=1, window=None):
+        """
+        Runs the protocol at Alice for a number of rounds. A round starts as soon as the qubit of the last one is
+        sent, without waiting for it to get through the chain. Returns the outcomes of measuring Alice's and Bob's
+        half of the EPR pair in each round.
+
+        Arguments
+        rounds		number of rounds to run
+        window		number of rounds under way at most at any time, None or 0 for no limit
+        """
+
+        slots = DeferredSemaphore(window or rounds)
+        finished = []
+        for round_id in range(rounds):
+            yield slots.acquire()
+            qA, qB, entInfo = yield self.virtRoot.callRemote("create_epr", self.name)
+            qubit_ids = yield self._send(qB)
+            yield self.peers[self.nextName].callRemote("process_qubits", qubit_ids, round_id, (0, 0))
+            finished.append(self._finish_round(qA, round_id, slots))
+
+        results = yield DeferredList(finished, fireOnOneErrback=True, consumeErrors=True)
+        return [outcomes for success, outcomes in results]
+
+    @inlineCallbacks
+    def _finish_round(self, qA, round_id, slots):
+        """
+        Waits for Bob's outcome of the round, then measures Alice's half of the EPR pair. Returns both outcomes and
+        frees the slot of the round.
+        """
+        try:
+            # Alice's half is simulated along with the qubits of the round, which move down the chain, so it is
+            # only measured once the round is through
+            outcome = yield self.messages.expect(self.destination, round_id)
+            if isinstance(outcome, roundError):
+                raise outcome
+            x = yield qA.callRemote("measure")
+        finally:
+            slots.release()
+        return x, outcome
+
+    def remote_process_qubits(self, virtualNums, round_id=0, frame=(0, 0)):
+        """
+        Queues the qubits of a round sent by the previous node for processing, and returns at once.
+
+        Arguments
+        virtualNums	numbers of the virtual qubits received
+        round_id	round of the protocol the qubits belong to
+        frame		Pauli frame (x, z) of the qubit, corrected by X^x Z^z at Bob
+        """
+        self.rounds.put((round_id, virtualNums, frame))
+
+    @inlineCallbacks
+    def _serve_rounds(self):
+        """
+        Processes the rounds sent by the previous node one after the other, in the order they came in.
+        """
+        while True:
+            round_id, virtualNums, frame = yield self.rounds.get()
+            try:
+                yield self._process_round(round_id, virtualNums, frame)
+            except Exception as e:
+                logging.error("LOCAL %s: Round %d failed: %s", self.name, round_id, e)
+
+                # The source waits for the outcome of the round, which will not come
+                try:
+                    yield self.peers[self.source].callRemote("round_failed", str(e), self.name, round_id)
+                except Exception as err:
+                    logging.error("LOCAL %s: Cannot report failure of round %d: %s", self.name, round_id, err)
+
+    @inlineCallbacks
+    def _process_round(self, round_id, virtualNums, frame):
+        """
+        Processes the qubits of a round. Repeaters swap the entanglement onto a new EPR pair and forward it, Bob
+        corrects and measures the qubit and reports the outcome to Alice.
+        """
+
+        block = yield self.virtRoot.callRemote("get_virtual_refs", virtualNums)
+        qB = yield self._decode(block)
+
+        if self.nextName is None:
+            x = yield self._measure_corrected(qB, frame)
+            logging.info("LOCAL %s: Measured %d in round %d", self.name, x, round_id)
+            yield self.peers[self.source].callRemote("report_outcome", x, self.name, round_id)
+            return
+
+        # Swap the entanglement onto qD by measuring qB and qC in the Bell basis, after which qD is off by X^y Z^x
+        qC, qD, entInfo = yield self.virtRoot.callRemote("create_epr", self.name)
+        x, y = yield self.virtRoot.callRemote("bell_measure", qB, qC)
+        frame = (frame[0] ^ y, frame[1] ^ x)
+
+        qubit_ids = yield self._send(qD)
+        yield self.peers[self.nextName].callRemote("process_qubits", qubit_ids, round_id, frame)
+
+    @inlineCallbacks
+    def _measure_corrected(self, qubit, frame):
+        """
+        Corrects the qubit by the Pauli frame (x, z), applying X^x Z^z, and measures it. Returns the outcome.
+        """
+        fx, fz = frame
+        if fz:
+            yield qubit.callRemote("apply_Z")
+        if fx:
+            yield qubit.callRemote("apply_X")
+        x = yield qubit.callRemote("measure")
+        return x
+
+    def remote_report_outcome(self, outcome, sender, round_id=0):
+        self.messages.deliver(sender, outcome, round_id)
+
+    def remote_round_failed(self, reason, sender, round_id=0):
+        """
+        Fails the round at the source, in place of the outcome of Bob.
+
+        Arguments
+        reason		description of the error
+        sender		name of the node at which the round failed
+        round_id	round of the protocol that failed
+        """
+        error = roundError("Round {} failed at {}: {}".format(round_id, sender, reason))
+        self.messages.deliver(self.destination, error, round_id)
+
+    ###########################################################################################################
+    #
+    # Nested protocol
+    #
+
+    @inlineCallbacks
+    def _peer(self, name):
+        """
+        Returns the root object of the classical server of node name, connecting to it if need be.
+        """
+        if name not in self.peers:
+            self.peers[name] = yield connect(self.classicalNet.hostDict[name])
+        return self.peers[name]
+
+    @inlineCallbacks
+    def run_source_nested(self):
+        """
+        Runs the nested protocol at Alice. All neighbouring nodes first share an EPR pair. The repeaters then swap
+        these in rounds, each of which joins pairs of neighbouring segments of the chain, until Alice and Bob share
+        a pair. Returns the outcomes of measuring Alice's and Bob's half of it.
+        """
+
+        for name in self.names[1:]:
+            yield self._peer(name)
+
+        # The EPR pairs over all links are made at the same time
+        links = [self.remote_make_link()]
+        links.extend(self.peers[name].callRemote("make_link") for name in self.names[1:-1])
+        yield DeferredList(links, fireOnOneErrback=True, consumeErrors=True)
+
+        # Each segment is given by its ends and by the Pauli frame (x, z) of the pair between them, which Bob
+        # corrects with X^x Z^z in the end
+        segments = [(self.names[i], self.names[i + 1], (0, 0)) for i in range(len(self.names) - 1)]
+        while len(segments) > 1:
+            pairs = [(segments[i], segments[i + 1]) for i in range(0, len(segments) - 1, 2)]
+            swaps = [self.peers[left[1]].callRemote("swap") for left, right in pairs]
+            results = yield DeferredList(swaps, fireOnOneErrback=True, consumeErrors=True)
+
+            joined = []
+            for (left, right), (success, (x, y)) in zip(pairs, results):
+                # The frame of the left segment moves over to the far end of the right one
+                frame = (left[2][0] ^ right[2][0] ^ y, left[2][1] ^ right[2][1] ^ x)
+                joined.append((left[0], right[1], frame))
+            if len(segments) % 2:
+                joined.append(segments[-1])
+            segments = joined
+
+        outcome = yield self.peers[self.destination].callRemote("measure_end", segments[0][2])
+        x = yield self.right.callRemote("measure")
+        return x, outcome
+
+    @inlineCallbacks
+    def remote_make_link(self):
+        """
+        Makes an EPR pair with the next node, keeping one half and sending the other.
+        """
+        self.right, qubit, entInfo = yield self.virtRoot.callRemote("create_epr", self.name)
+        qubit_ids = yield self._send(qubit)
+        yield self.peers[self.nextName].callRemote("receive_link", qubit_ids)
+
+    @inlineCallbacks
+    def remote_receive_link(self, virtualNums):
+        """
+        Keeps the half of the EPR pair sent by the previous node.
+
+        Arguments
+        virtualNums	numbers of the virtual qubits received
+        """
+        block = yield self.virtRoot.callRemote("get_virtual_refs", virtualNums)
+        self.left = yield self._decode(block)
+
+    @inlineCallbacks
+    def remote_swap(self):
+        """
+        Swaps the entanglement of the pairs shared towards both ends of the chain by measuring the halves held here
+        in the Bell basis. Returns the outcomes (x, y), after which the far end on the right is off by X^y Z^x.
+        """
+        x, y = yield self.virtRoot.callRemote("bell_measure", self.left, self.right)
+        self.left = self.right = None
+        logging.info("LOCAL %s: Swapped with outcomes %d %d", self.name, x, y)
+        return x, y
+
+    @inlineCallbacks
+    def remote_measure_end(self, frame):
+        """
+        Corrects Bob's half of the pair shared with Alice and measures it. Returns the outcome.
+
+        Arguments
+        frame		Pauli frame (x, z) of the pair, corrected by X^x Z^z
+        """
+        x = yield self._measure_corrected(self.left, frame)
+        self.left = None
+        logging.info("LOCAL %s: Measured %d", self.name, x)
+        return x
+
+
+#####################################################################################################
+#
+# Running the chain
+#
+def use_backend(backend):
+    """
+    Sets the simulation backend for this process only. Setting simulaqron_settings.backend instead would write it to
+    the settings file of the package, which all other runs read as well.
+    """
+    # The settings offer no way to change a value without writing the file, so the value read from it is replaced
+    # in memory. The engines only ever read the backend through simulaqron_settings.backend, which returns this value,
+    # and the processes of the chain never write the settings, so the file keeps its own value.
+    if backend is not None:
+        simulaqron_settings._config["backend"] = backend
+
+
+def start_node(name, names, virtualFile, classicalFile, codeName=None, workers=0, backend=None):
+    """
+    Starts the virtual node and the classical server of the node in the chain, simulating with the backend if given.
+    Returns the classical server.
+    """
+    use_backend(backend)
+
+    # Imported once the backend is set, since the engines are picked on import
+    from simulaqron.virtNode.virtual import virtualNode
+
+    # Virtual nodes connect to their neighbours in the chain at once, and to other nodes when needed
+    pos = names.index(name)
+    topology = {name: names[max(pos - 1, 0):pos] + names[pos + 1:pos + 2]}
+
+    virtualNet = socketsConfig(virtualFile)
+    vNode = virtualNode(virtualNet.hostDict[name], virtualNet, workers=workers, topology=topology)
+    reactor.listenTCP(virtualNet.hostDict[name].port, pb.PBServerFactory(vNode))
+
+    classicalNet = socketsConfig(classicalFile)
+    lNode = chainNode(name, names, classicalNet, codeName)
+    reactor.listenTCP(classicalNet.hostDict[name].port, pb.PBServerFactory(lNode))
+    return lNode
+
+
+@inlineCallbacks
+def run_chain(lNodes, virtualFile, protocol="forward", rounds=1, window=None):
+    """
+    Connects the nodes, runs the protocol, forward or nested, for a number of rounds from the source, the first of
+    them, and returns the outcomes at Alice and Bob of each round with the time taken.
+    """
+    yield DeferredList([lNode.connect(socketsConfig(virtualFile)) for lNode in lNodes], fireOnOneErrback=True)
+
+    start = time.time()
+    if protocol == "nested":
+        # Each round uses the links of all nodes, so the rounds run one after the other
+        outcomes = []
+        for round_id in range(rounds):
+            result = yield lNodes[0].run_source_nested()
+            outcomes.append(result)
+    else:
+        outcomes = yield lNodes[0].run_source(rounds, window)
+    return outcomes, time.time() - start
+
+
+def _stop(result):
+    """
+    Stops the reactor once the chain has run, passing on the result.
+    """
+    if reactor.running:
+        reactor.stop()
+    return result
+
+
+def run_in_process(
+    names, virtualFile, classicalFile, codeName, workers, protocol="forward", rounds=1, window=None, backend=None
+):
+    """
+    Runs all nodes of the chain in this process. Returns the outcomes and the time taken.
+    """
+    lNodes = [start_node(name, names, virtualFile, classicalFile, codeName, workers, backend) for name in names]
+
+    results = []
+
+    def go():
+        d = run_chain(lNodes, virtualFile, protocol, rounds, window)
+        d.addCallback(results.append)
+        d.addErrback(lambda reason: logging.error("Chain failed: %s", reason.getTraceback()))
+        d.addBoth(_stop)
+
+    reactor.callWhenRunning(go)
+    reactor.run()
+    return results[0] if results else None
+
+
+def _serve_node(name, names, virtualFile, classicalFile, codeName, workers, conn, protocol="forward", rounds=1,
+                window=None, backend=None):
+    """
+    Runs a node of the chain in a process of its own. The source runs the protocol and sends the result over conn.
+    """
+    lNode = start_node(name, names, virtualFile, classicalFile, codeName, workers, backend)
+
+    def failed(reason):
+        logging.error("Chain failed: %s", reason.getTraceback())
+        conn.send(None)
+
+    def go():
+        d = run_chain([lNode], virtualFile, protocol, rounds, window)
+        d.addCallbacks(conn.send, failed)
+        d.addBoth(_stop)
+
+    if conn is None:
+        reactor.callWhenRunning(lNode.connect, socketsConfig(virtualFile))
+    else:
+        reactor.callWhenRunning(go)
+    reactor.run()
+
+
+def run_in_processes(
+    names,
+    virtualFile,
+    classicalFile,
+    codeName,
+    workers,
+    timeout=None,
+    protocol="forward",
+    rounds=1,
+    window=None,
+    backend=None,
+):
+    """
+    Runs each node of the chain in a process of its own, and stops them all once the source is done. Returns the
+    outcomes and the time taken.
+    """
+    # Forked processes would share the reactor of this one, so they are spawned. They are not daemonic, since a node
+    # forks its pool of register workers, and are stopped below instead.
+    ctx = multiprocessing.get_context("spawn")
+    parentConn, childConn = ctx.Pipe(duplex=False)
+    processes = []
+    for name in names:
+        conn = childConn if name == names[0] else None
+        p = ctx.Process(
+            target=_serve_node,
+            args=(name, names, virtualFile, classicalFile, codeName, workers, conn, protocol, rounds, window, backend),
+        )
+        p.start()
+        processes.append(p)
+
+    try:
+        if parentConn.poll(timeout):
+            result = parentConn.recv()
+            # The source stops by itself once it has sent the result
+            processes[0].join(timeout)
+            return result
+        logging.error("Chain did not finish within %s seconds", timeout)
+        return None
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+        for p in processes:
+            p.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send one half of an EPR pair from Alice to Bob along a chain.")
+    parser.add_argument("--hops", type=int, default=3, help="number of repeaters between Alice and Bob")
+    parser.add_argument(
+        "--code",
+        choices=sorted(codes) + ["none"],
+        default="shor",
+        help="error correcting code to send the qubits in, or none",
+    )
+    parser.add_argument(
+        "--protocol",
+        choices=["forward", "nested"],
+        default="forward",
+        help="forward the qubit hop by hop, or share EPR pairs over all links at once and swap them in nested rounds",
+    )
+    parser.add_argument("--rounds", type=int, default=1, help="number of EPR pairs to share between Alice and Bob")
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=2,
+        help="rounds under way at most at any time, bounded by the qubits a node may hold, 0 for no limit",
+    )
+    parser.add_argument("--backend", default=None, help="simulation backend: qutip, projectq or stabilizer")
+    parser.add_argument("--processes", action="store_true", help="run each node in a process of its own")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes simulating each node's registers")
+    parser.add_argument("--base-port", type=int, default=8100, help="first port used by the nodes")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds to wait for the chain with --processes")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s:%(levelname)s:%(message)s", level=simulaqron_settings.log_level)
+
+    names = chain_names(args.hops)
+    codeName = None if args.code == "none" else args.code
+
+    with tempfile.TemporaryDirectory() as directory:
+        virtualFile, classicalFile = write_configs(names, directory, args.base_port)
+        if args.processes:
+            result = run_in_processes(
+                names,
+                virtualFile,
+                classicalFile,
+                codeName,
+                args.workers,
+                args.timeout,
+                args.protocol,
+                args.rounds,
+                args.window,
+                args.backend,
+            )
+        else:
+            result = run_in_process(
+                names,
+                virtualFile,
+                classicalFile,
+                codeName,
+                args.workers,
+                args.protocol,
+                args.rounds,
+                args.window,
+                args.backend,
+            )
+
+    if result is None:
+        print("CHAIN: Failed")
+        return
+    outcomes, elapsed = result
+    for round_id, (x, outcome) in enumerate(outcomes):
+        print("CHAIN: Round {}: Alice measured {}, Bob measured {}".format(round_id, x, outcome))
+    agreed = sum(x == outcome for x, outcome in outcomes)
+    print(
+        "CHAIN: {} repeaters, code {}, {} protocol: {} rounds, {} agreed, in {:.3f} s, {:.2f} pairs/s".format(
+            args.hops, args.code, args.protocol, len(outcomes), agreed, elapsed, len(outcomes) / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
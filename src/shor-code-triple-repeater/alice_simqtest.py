@@ -59,58 +59,25 @@ def runClientNode(qReg, virtRoot, myName, classicalNet):
 
     logging.debug("LOCAL %s: Runing client side program.", myName)
 
-    # Create 2 qubits
-    qA = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-    qB = yield virtRoot.callRemote("new_qubit_inreg", qReg)
+    # Create 2 qubits in a maximally entangled state
+    qA, qB, entInfo = yield virtRoot.callRemote("create_epr", myName, qReg)
 
     remoteNumA = yield qA.callRemote("get_virt_num");
 
-    # Put qubits A and B in a maximally entangled state
-    yield qA.callRemote("apply_H")
-    yield qA.callRemote("cnot_onto", qB)
-
     #remoteNum = yield virtRoot.callRemote("send_qubit", qB, "Repeater1")
 
     # prepare shor code
-    shor1 = qB
-    # intialised to |0>
-    shor2 = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-    shor3 = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-    shor4 = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-    shor5 = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-    shor6 = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-    shor7 = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-    shor8 = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-    shor9 = yield virtRoot.callRemote("new_qubit_inreg", qReg)
-
-    shor1.callRemote("cnot_onto", shor4)
-    shor1.callRemote("cnot_onto", shor7)
-    shor1.callRemote("apply_H")
-    shor4.callRemote("apply_H")
-    shor7.callRemote("apply_H")
-    shor1.callRemote("cnot_onto", shor2)
-    shor4.callRemote("cnot_onto", shor5)
-    shor7.callRemote("cnot_onto", shor8)
-    shor1.callRemote("cnot_onto", shor3)
-    shor4.callRemote("cnot_onto", shor6)
-    shor7.callRemote("cnot_onto", shor9)
+    # intialised to |0>, placed with qB so encoding needs no merge
+    ancillas = yield virtRoot.callRemote("new_qubits", 8, near=qB)
+    block = yield virtRoot.callRemote("shor_encode", qB, ancillas)
     # shor code prepared
 
     # send qubits
-    shor1_num = yield virtRoot.callRemote("send_qubit", shor1, "Repeater1")
-    shor2_num = yield virtRoot.callRemote("send_qubit", shor2, "Repeater1")
-    shor3_num = yield virtRoot.callRemote("send_qubit", shor3, "Repeater1")
-    shor4_num = yield virtRoot.callRemote("send_qubit", shor4, "Repeater1")
-    shor5_num = yield virtRoot.callRemote("send_qubit", shor5, "Repeater1")
-    shor6_num = yield virtRoot.callRemote("send_qubit", shor6, "Repeater1")
-    shor7_num = yield virtRoot.callRemote("send_qubit", shor7, "Repeater1")
-    shor8_num = yield virtRoot.callRemote("send_qubit", shor8, "Repeater1")
-    shor9_num = yield virtRoot.callRemote("send_qubit", shor9, "Repeater1")
-
-    qubit_ids = [shor1_num,shor2_num,shor3_num,shor4_num,shor5_num,shor6_num,shor7_num,shor8_num,shor9_num]
-    # Tell repeater the IDs of the qubits
+    qubit_ids = yield virtRoot.callRemote("send_qubits", block, "Repeater1")
+    # Tell repeater the IDs of the qubits, with the Pauli frame (x, z) of the corrections so far
+    # The call returns once Bob has measured, after applying the corrections of all swaps
     repeater = classicalNet.hostDict["Repeater1"]
-    yield repeater.root.callRemote("process_qubits", qubit_ids)
+    yield repeater.root.callRemote("process_qubits", qubit_ids, (0, 0))
 
     # Measure to obtain a random number
     #x = yield qA.callRemote("measure")
@@ -118,17 +85,6 @@ def runClientNode(qReg, virtRoot, myName, classicalNet):
     #print("ALICE: My Random Number is ", x, "\n")
     print("ALICE: A qubit was sent.");
 
-    alice = classicalNet.hostDict["Alice"]
-    while True:
-        has_measurement = yield alice.root.has_measurement()
-        if (has_measurement):
-            break
-
-    measurement = yield alice.root.get_measurement()
-    print("ALICE: Got ACK in main thread:", measurement)
-    if (measurement):
-        qA.callRemote("apply_Z")
-
     x = yield qA.callRemote("measure")
     print("ALICE: My Random Number is ", x, "\n")
 
@@ -152,15 +108,6 @@ class localNode(pb.Root):
         self.virtRoot = None
         self.qReg = None
 
-        self._has_measurement = False
-        self._measurement = None
-
-    def get_measurement(self):
-        return self._measurement
-
-    def has_measurement(self):
-        return self._has_measurement
-
     def set_virtual_node(self, virtRoot):
         self.virtRoot = virtRoot
 
@@ -170,11 +117,6 @@ class localNode(pb.Root):
     def remote_test(self):
         return "Tested!"
 
-    def remote_repeater_ack(self, measurement):
-        print("ALICE: Repeater ACK was: ", measurement)
-        self._measurement = measurement
-        self._has_measurement = True
-        return
 
 #####################################################################################################
 #
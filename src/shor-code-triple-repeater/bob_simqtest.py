@@ -91,45 +91,29 @@ class localNode(pb.Root):
         # This can be called by Alice to tell Bob to process the qubit
 
     @inlineCallbacks
-    def remote_process_qubits(self, virtualNums):
+    def remote_process_qubits(self, virtualNums, frame=(0, 0)):
         """
         Recover the qubit and measure it to get a random number.
 
         Arguments
         virtualNum    number of the virtual qubit corresponding to the EPR pair received
+        frame    Pauli frame (x, z) of the qubit, to be corrected by X^x Z^z at the end
         """
 
         print("BOB: Awaiting measurement\n");
         print("BOB LIST OF QUBITS:", virtualNums)
-        shor1 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[0])
-        shor2 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[1])
-        shor3 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[2])
-        shor4 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[3])
-        shor5 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[4])
-        shor6 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[5])
-        shor7 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[6])
-        shor8 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[7])
-        shor9 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[8])
-
-        # Shor decode start
-        shor1.callRemote("cnot_onto", shor2)
-        shor4.callRemote("cnot_onto", shor5)
-        shor7.callRemote("cnot_onto", shor8)
-        shor1.callRemote("cnot_onto", shor3)
-        shor4.callRemote("cnot_onto", shor6)
-        shor7.callRemote("cnot_onto", shor9)
-        self.toffoli_gate(shor1, shor2, shor3)
-        self.toffoli_gate(shor4, shor5, shor6)
-        self.toffoli_gate(shor7, shor8, shor9)
-        shor1.callRemote("apply_H")
-        shor4.callRemote("apply_H")
-        shor7.callRemote("apply_H")
-        shor1.callRemote("cnot_onto", shor4)
-        shor1.callRemote("cnot_onto", shor7)
-        self.toffoli_gate(shor1, shor4, shor7)
-        # Shor decode end
-
-        qB = shor1
+        block = yield self.virtRoot.callRemote("get_virtual_refs", virtualNums)
+
+        # Shor decode
+        qB = yield self.virtRoot.callRemote("shor_decode", block)
+        # The rest of the block is back in |0> and no longer needed
+        yield self.virtRoot.callRemote("discard", block[1:])
+
+        # Apply the corrections of all swaps at once
+        if frame[1]:
+            yield qB.callRemote("apply_Z")
+        if frame[0]:
+            yield qB.callRemote("apply_X")
 
         # Measure
         x = yield qB.callRemote("measure")
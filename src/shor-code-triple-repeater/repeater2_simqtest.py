@@ -88,127 +88,46 @@ class localNode(pb.Root):
     def remote_test(self):
         return "Tested!"
 
-    def toffoli_gate(self, a, b, c):
-        a.callRemote("apply_H")
-        b.callRemote("cnot_onto", a)
-        a.callRemote("apply_inverse_T")
-        c.callRemote("cnot_onto", a)
-        a.callRemote("apply_T")
-        b.callRemote("cnot_onto", a)
-        a.callRemote("apply_inverse_T")
-        c.callRemote("cnot_onto", a)
-        b.callRemote("apply_T")
-        a.callRemote("apply_T")
-        a.callRemote("apply_H")
-        c.callRemote("cnot_onto", b)
-        c.callRemote("apply_T")
-        b.callRemote("apply_inverse_T")
-        c.callRemote("cnot_onto", b)
-
     # This can be called by Alice to tell Bob to process the qubit
     @inlineCallbacks
-    def remote_process_qubits(self, virtualNums):
+    def remote_process_qubits(self, virtualNums, frame=(0, 0)):
         """
         Recover the qubit and measure it to get a random number.
 
         Arguments
         virtualNum    number of the virtual qubit corresponding to the EPR pair received
+        frame    Pauli frame (x, z) of the qubit, to be corrected by X^x Z^z at the end
         """
 
         print("REPEATER2 LIST OF QUBITS:", virtualNums)
-        shor1 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[0])
-        shor2 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[1])
-        shor3 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[2])
-        shor4 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[3])
-        shor5 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[4])
-        shor6 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[5])
-        shor7 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[6])
-        shor8 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[7])
-        shor9 = yield self.virtRoot.callRemote("get_virtual_ref", virtualNums[8])
-
-        # Shor decode start
-        shor1.callRemote("cnot_onto", shor2)
-        shor4.callRemote("cnot_onto", shor5)
-        shor7.callRemote("cnot_onto", shor8)
-        shor1.callRemote("cnot_onto", shor3)
-        shor4.callRemote("cnot_onto", shor6)
-        shor7.callRemote("cnot_onto", shor9)
-        self.toffoli_gate(shor1, shor2, shor3)
-        self.toffoli_gate(shor4, shor5, shor6)
-        self.toffoli_gate(shor7, shor8, shor9)
-        shor1.callRemote("apply_H")
-        shor4.callRemote("apply_H")
-        shor7.callRemote("apply_H")
-        shor1.callRemote("cnot_onto", shor4)
-        shor1.callRemote("cnot_onto", shor7)
-        self.toffoli_gate(shor1, shor4, shor7)
-        # Shor decode end
-
-        qB = shor1
+        block = yield self.virtRoot.callRemote("get_virtual_refs", virtualNums)
+
+        # Shor decode
+        qB = yield self.virtRoot.callRemote("shor_decode", block)
+        # The rest of the block is back in |0> and no longer needed
+        yield self.virtRoot.callRemote("discard", block[1:])
 
 	# Entanglement swap
 	# Create 2 qubits
-        qC = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-        qD = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
         # Entangle qC and qD
-        yield qC.callRemote("apply_H")
-        yield qC.callRemote("cnot_onto", qD)
-        # Un-make EPR pair of Alice's qB and repeater's qC
-        yield qB.callRemote("cnot_onto", qC)
-        yield qB.callRemote("apply_H")
+        qC, qD, entInfo = yield self.virtRoot.callRemote("create_epr", self.node.name, self.qReg)
+        # Un-make EPR pair of Alice's qB and repeater's qC by measuring them in the Bell basis
+        x, y = yield self.virtRoot.callRemote("bell_measure", qB, qC)
         print("REPEATER2: Entanglement has been swapped\n")
 
-        # Measure qB and qC
-        x = yield qB.callRemote("measure", True)
-        y = yield qC.callRemote("measure", True)
-
-        # Send ACK to source, using classical network
-        # The source machine can correct the Z phase by using the measurement we sent
-        alice = self.classicalNet.hostDict["Alice"]
-        yield alice.root.callRemote("repeater_ack", y)
-        print("REPEATER2: Sent ACK to source over classical network")
-
-        if (y): # If qC is ON then apply a CNOT date to qD
-            yield qC.callRemote("cnot_onto", qD)
-
-        shor1 = qD
-        # intialised to |0>
-        shor2 = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-        shor3 = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-        shor4 = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-        shor5 = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-        shor6 = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-        shor7 = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-        shor8 = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-        shor9 = yield self.virtRoot.callRemote("new_qubit_inreg", self.qReg)
-
-        shor1.callRemote("cnot_onto", shor4)
-        shor1.callRemote("cnot_onto", shor7)
-        shor1.callRemote("apply_H")
-        shor4.callRemote("apply_H")
-        shor7.callRemote("apply_H")
-        shor1.callRemote("cnot_onto", shor2)
-        shor4.callRemote("cnot_onto", shor5)
-        shor7.callRemote("cnot_onto", shor8)
-        shor1.callRemote("cnot_onto", shor3)
-        shor4.callRemote("cnot_onto", shor6)
-        shor7.callRemote("cnot_onto", shor9)
+        # Add the corrections for the swap to the Pauli frame, instead of sending them to the source
+        frame = (frame[0] ^ y, frame[1] ^ x)
+
+        # intialised to |0>, placed with qD so encoding needs no merge
+        ancillas = yield self.virtRoot.callRemote("new_qubits", 8, near=qD)
+        block = yield self.virtRoot.callRemote("shor_encode", qD, ancillas)
+        # shor code prepared
 
         # Send the qubit to the next node
-        shor1_num = yield self.virtRoot.callRemote("send_qubit", shor1, "Repeater3")
-        shor2_num = yield self.virtRoot.callRemote("send_qubit", shor2, "Repeater3")
-        shor3_num = yield self.virtRoot.callRemote("send_qubit", shor3, "Repeater3")
-        shor4_num = yield self.virtRoot.callRemote("send_qubit", shor4, "Repeater3")
-        shor5_num = yield self.virtRoot.callRemote("send_qubit", shor5, "Repeater3")
-        shor6_num = yield self.virtRoot.callRemote("send_qubit", shor6, "Repeater3")
-        shor7_num = yield self.virtRoot.callRemote("send_qubit", shor7, "Repeater3")
-        shor8_num = yield self.virtRoot.callRemote("send_qubit", shor8, "Repeater3")
-        shor9_num = yield self.virtRoot.callRemote("send_qubit", shor9, "Repeater3")
-
-        qubit_ids = [shor1_num,shor2_num,shor3_num,shor4_num,shor5_num,shor6_num,shor7_num,shor8_num,shor9_num]
+        qubit_ids = yield self.virtRoot.callRemote("send_qubits", block, "Repeater3")
 
         repeater3 = self.classicalNet.hostDict["Repeater3"]
-        yield repeater3.root.callRemote("process_qubits", qubit_ids)
+        yield repeater3.root.callRemote("process_qubits", qubit_ids, frame)
 
         print("REPEATER2: Forwarded qubit to next node over quantum network\n")
 
@@ -91,17 +91,24 @@ class localNode(pb.Root):
         # This can be called by Alice to tell Bob to process the qubit
 
     @inlineCallbacks
-    def remote_process_qubit(self, virtualNum):
+    def remote_process_qubit(self, virtualNum, frame=(0, 0)):
         """
         Recover the qubit and measure it to get a random number.
 
         Arguments
         virtualNum    number of the virtual qubit corresponding to the EPR pair received
+        frame    Pauli frame (x, z) of the qubit, to be corrected by X^x Z^z at the end
         """
 
         print("BOB: Awaiting measurement\n");
         qB = yield self.virtRoot.callRemote("get_virtual_ref", virtualNum)
 
+        # Apply the corrections of all swaps at once
+        if frame[1]:
+            yield qB.callRemote("apply_Z")
+        if frame[0]:
+            yield qB.callRemote("apply_X")
+
         # Measure
         x = yield qB.callRemote("measure")
 
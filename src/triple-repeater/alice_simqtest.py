@@ -73,9 +73,10 @@ def runClientNode(qReg, virtRoot, myName, classicalNet):
     # Instruct the virtual node to transfer the qubit
     remoteNum = yield virtRoot.callRemote("send_qubit", qB, "Repeater1")
 
-    # Tell repeater the ID of the qubit
+    # Tell repeater the ID of the qubit, with the Pauli frame (x, z) of the corrections so far
+    # The call returns once Bob has measured, after applying the corrections of all swaps
     repeater = classicalNet.hostDict["Repeater1"]
-    yield repeater.root.callRemote("process_qubit", remoteNum)
+    yield repeater.root.callRemote("process_qubit", remoteNum, (0, 0))
 
     # Measure to obtain a random number
     #x = yield qA.callRemote("measure")
@@ -83,17 +84,6 @@ def runClientNode(qReg, virtRoot, myName, classicalNet):
     #print("ALICE: My Random Number is ", x, "\n")
     print("ALICE: A qubit was sent.");
 
-    alice = classicalNet.hostDict["Alice"]
-    while True:
-        has_measurement = yield alice.root.has_measurement()
-        if (has_measurement):
-            break
-
-    measurement = yield alice.root.get_measurement()
-    print("ALICE: Got ACK in main thread:", measurement)
-    if (measurement):
-        qA.callRemote("apply_Z")
-
     x = yield qA.callRemote("measure")
     print("ALICE: My Random Number is ", x, "\n")
 
@@ -117,15 +107,6 @@ class localNode(pb.Root):
         self.virtRoot = None
         self.qReg = None
 
-        self._has_measurement = False
-        self._measurement = None
-
-    def get_measurement(self):
-        return self._measurement
-
-    def has_measurement(self):
-        return self._has_measurement
-
     def set_virtual_node(self, virtRoot):
         self.virtRoot = virtRoot
 
@@ -135,11 +116,6 @@ class localNode(pb.Root):
     def remote_test(self):
         return "Tested!"
 
-    def remote_repeater_ack(self, measurement):
-        print("ALICE: Repeater ACK was: ", measurement)
-        self._measurement = measurement
-        self._has_measurement = True
-        return
 
 #####################################################################################################
 #
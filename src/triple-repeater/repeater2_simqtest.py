@@ -90,12 +90,13 @@ class localNode(pb.Root):
 
     # This can be called by Alice to tell Bob to process the qubit
     @inlineCallbacks
-    def remote_process_qubit(self, virtualNum):
+    def remote_process_qubit(self, virtualNum, frame=(0, 0)):
         """
         Recover the qubit and measure it to get a random number.
 
         Arguments
         virtualNum    number of the virtual qubit corresponding to the EPR pair received
+        frame    Pauli frame (x, z) of the qubit, to be corrected by X^x Z^z at the end
         """
 
         qB = yield self.virtRoot.callRemote("get_virtual_ref", virtualNum)
@@ -107,28 +108,17 @@ class localNode(pb.Root):
         # Entangle qC and qD
         yield qC.callRemote("apply_H")
         yield qC.callRemote("cnot_onto", qD)
-        # Un-make EPR pair of Alice's qB and repeater's qC
-        yield qB.callRemote("cnot_onto", qC)
-        yield qB.callRemote("apply_H")
+        # Un-make EPR pair of Alice's qB and repeater's qC by measuring them in the Bell basis
+        x, y = yield self.virtRoot.callRemote("bell_measure", qB, qC)
         print("REPEATER2: Entanglement has been swapped\n")
 
-        # Measure qB and qC
-        x = yield qB.callRemote("measure", True)
-        y = yield qC.callRemote("measure", True)
-
-        # Send ACK to source, using classical network
-        # The source machine can correct the Z phase by using the measurement we sent
-        alice = self.classicalNet.hostDict["Alice"]
-        yield alice.root.callRemote("repeater_ack", y)
-        print("REPEATER2: Sent ACK to source over classical network")
-
-        if (y): # If qC is ON then apply a CNOT date to qD
-            yield qC.callRemote("cnot_onto", qD)
+        # Add the corrections for the swap to the Pauli frame, instead of sending them to the source
+        frame = (frame[0] ^ y, frame[1] ^ x)
 
         # Send the qubit to the next node
         remoteNum = yield self.virtRoot.callRemote("send_qubit", qD, "Repeater3")
         repeater3 = self.classicalNet.hostDict["Repeater3"]
-        yield repeater3.root.callRemote("process_qubit", remoteNum)
+        yield repeater3.root.callRemote("process_qubit", remoteNum, frame)
 
         print("REPEATER2: Forwarded qubit to next node over quantum network\n")
 